@@ -0,0 +1,226 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import httpx
+
+from body_reader import CHUNK_SIZE, DEFAULT_MAX_BYTES, BodyReader, ResponseRejected
+from rate_limiter import parse_retry_after
+
+# ==============================================================================
+# MOTORE DI DOWNLOAD ASINCRONO (--engine async)
+# ==============================================================================
+# Alternativa ai fetcher a thread della pipeline: un solo thread con
+# asyncio gestisce centinaia di download contemporanei (limitati da un semaforo),
+# mentre decodifica/codifica delle immagini (CPU) gira in un executor a parte.
+#
+# La pipeline (vedi pipeline/fetchers.py) costruisce dei "job", dizionari con le chiavi:
+#   'url'      URL da scaricare
+#   'index'    numero progressivo usato nei log ([index/total])
+#   'total'    totale usato nei log
+#   'headers'  (opzionale) header aggiuntivi per la singola richiesta
+#   'handle'   funzione handle(status_code, headers, content) -> risultato, che
+#              riceve la risposta completa (200, oppure 304 per i GET
+#              condizionali della cache) e converte l'immagine
+#   'metrics'  (opzionale) ImageMetrics della pipeline (vedi pipeline/metrics.py)
+#              in cui registrare tempi, tentativi e byte del download
+# AsyncEngineRunner fa girare il motore in un thread dedicato e accetta i job
+# uno alla volta: ogni submit ritorna un Future con il risultato del job (None
+# per i download falliti).
+
+logger = logging.getLogger(__name__)
+
+
+def should_retry(status_code):
+    """
+    True se vale la pena riprovare una risposta con questo status: errori del
+    server, timeout e 429. Gli altri 4xx (404, 403, 410, ...) non cambiano
+    riprovando e vengono scartati subito.
+    """
+    return status_code >= 500 or status_code in (408, 429)
+
+
+async def fetch_image(client, semaphore, rate_limiter, url, index, total, headers=None, retry_delay=5, max_retries=3,
+                      max_bytes=DEFAULT_MAX_BYTES, metrics=None):
+    """
+    Scarica il contenuto di un URL con la stessa politica di retry della pipeline:
+    backoff esponenziale sui 429 (imposto a tutto l'host da `rate_limiter`, un
+    HostRateLimiter), attesa lineare sugli altri errori (vedi should_retry).
+    L'attesa del rate limiter e i backoff avvengono fuori dal semaforo, così uno
+    slot di concorrenza è occupato solo durante la richiesta vera e propria.
+    Il corpo viene letto a blocchi con BodyReader (limite `max_bytes`): le
+    risposte che non sono immagini vengono interrotte subito e non riprovate.
+    Ritorna (risposta, contenuto) per i 200, o per i 304 delle richieste
+    condizionali (contenuto vuoto), oppure None se tutti i tentativi falliscono.
+    Con `metrics` (ImageMetrics) registra attese, connessione, TTFB,
+    trasferimento, tentativi e byte ricevuti.
+    """
+    extensions = {'trace': metrics.async_connect_trace()} if metrics is not None else None
+    for attempt in range(1, max_retries + 1):
+        start = time.perf_counter()
+        await rate_limiter.wait_async(url)
+        if metrics is not None:
+            metrics.since('throttle', start)
+        status_code = None
+        try:
+            content = b''
+            start = time.perf_counter()
+            async with semaphore:
+                if metrics is not None:
+                    # L'attesa di uno slot di concorrenza è l'equivalente della coda dei thread
+                    if attempt == 1:
+                        metrics.download_started(start)
+                    else:
+                        metrics.since('queue', start)
+                    started = metrics.request_started()
+                async with client.stream('GET', url, headers=headers, extensions=extensions) as response:
+                    status_code = response.status_code
+                    if metrics is not None:
+                        metrics.headers_received(started)
+                        start = time.perf_counter()
+                    if response.status_code == 200:
+                        reader = BodyReader(url, response.headers, max_bytes)
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            reader.feed(chunk)
+                        content = reader.finish()
+                        if metrics is not None:
+                            metrics.since('transfer', start)
+            if metrics is not None:
+                metrics.attempt(response.status_code, len(content))
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if response.status_code == 429 and retry_after is None:
+                retry_after = retry_delay * (2 ** (attempt - 1))
+            rate_limiter.record_response(url, response.status_code, retry_after)
+
+            if response.status_code in (200, 304):
+                return response, content
+            elif response.status_code == 429:  # Too Many Requests
+                logger.warning(f"[{index}/{total}] Rate limit raggiunto (429) per {url}. Tentativo {attempt}/{max_retries}.")
+                # L'attesa è già imposta dal rate limiter a tutto l'host
+                continue
+            else:
+                logger.error(f"[{index}/{total}] ERRORE HTTP {response.status_code}: Impossibile scaricare {url}")
+                if not should_retry(response.status_code):
+                    return None
+                wait_time = retry_delay * attempt
+        except ResponseRejected as e:
+            if metrics is not None:
+                metrics.attempt(status_code)
+            logger.error(f"[{index}/{total}] Risposta scartata: {e}")
+            return None
+        except httpx.HTTPError as e:
+            if metrics is not None:
+                metrics.attempt(status_code)
+            logger.error(f"[{index}/{total}] ERRORE RICHIESTA (httpx) per {url} (tentativo {attempt}/{max_retries}): {type(e).__name__} - {e}")
+            wait_time = retry_delay * attempt
+
+        if attempt < max_retries:
+            start = time.perf_counter()
+            await asyncio.sleep(wait_time)
+            if metrics is not None:
+                metrics.since('throttle', start)
+
+    logger.error(f"[{index}/{total}] Download fallito per {url} dopo {max_retries} tentativi.")
+    return None
+
+
+async def _run_job(job, client, semaphore, executor, rate_limiter, retry_delay, max_retries, max_bytes):
+    """Scarica un singolo job e ne delega la gestione della risposta (handle) all'executor."""
+    total = job['total']
+    metrics = job.get('metrics')
+    try:
+        fetched = await fetch_image(
+            client, semaphore, rate_limiter, job['url'], job['index'], total,
+            headers=job.get('headers'), retry_delay=retry_delay, max_retries=max_retries,
+            max_bytes=max_bytes, metrics=metrics
+        )
+    finally:
+        if metrics is not None:
+            metrics.download_finished()
+
+    if fetched is None:
+        return None
+    response, content = fetched
+
+    process = partial(job['handle'], response.status_code, response.headers, content)
+
+    if metrics is not None:
+        process = partial(_timed_process, process, metrics, time.perf_counter())
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, process)
+    except Exception as e:
+        logger.error(f"[{job['index']}/{total}] ERRORE durante la conversione di {job['url']}: {type(e).__name__} - {e}")
+        return None
+
+
+def _timed_process(process, metrics, submitted):
+    # Attesa di un thread dell'executor libero: coda della conversione
+    metrics.since('cpu_queue', submitted)
+    return process()
+
+
+def _create_client(max_concurrency, headers, http2):
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    return httpx.AsyncClient(
+        http2=http2, headers=headers, limits=limits,
+        follow_redirects=True, timeout=30.0
+    )
+
+
+class AsyncEngineRunner:
+    """
+    Il motore asincrono in un thread dedicato, per chi produce i job un po' alla
+    volta: submit(job) ritorna subito un concurrent.futures.Future con il
+    risultato del job, così il chiamante decide quanti job tenere in volo.
+
+    `max_concurrency` è il numero massimo di download in volo, `cpu_workers` il
+    numero di thread dedicati a decodifica/codifica (default: numero di core).
+    `rate_limiter` è l'HostRateLimiter condiviso che regola le richieste per
+    host, `max_bytes` la dimensione massima di un'immagine. Va chiuso con close().
+    """
+
+    def __init__(self, rate_limiter, max_concurrency=100, cpu_workers=None, headers=None,
+                 http2=False, retry_delay=5, max_retries=3, max_bytes=DEFAULT_MAX_BYTES):
+        self.rate_limiter = rate_limiter
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count() or 4)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._semaphore, self._client = asyncio.run_coroutine_threadsafe(
+            self._open(max_concurrency, headers, http2), self._loop
+        ).result()
+
+    @staticmethod
+    async def _open(max_concurrency, headers, http2):
+        # Semaforo e client vanno creati dentro l'event loop che li userà
+        return asyncio.Semaphore(max_concurrency), _create_client(max_concurrency, headers, http2)
+
+    def submit(self, job):
+        return asyncio.run_coroutine_threadsafe(
+            _run_job(job, self._client, self._semaphore, self._executor,
+                     self.rate_limiter, self.retry_delay, self.max_retries, self.max_bytes),
+            self._loop
+        )
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,117 @@
+import io
+import time
+import argparse
+from pathlib import Path
+from PIL import Image
+from image_analysis import analyze_image
+from output_formats import OutputFormats, available_alpha_formats
+
+# ==============================================================================
+# CONFRONTO DEI FORMATI PER LE IMMAGINI CON TRASPARENZA
+# ==============================================================================
+# Codifica in memoria le immagini con trasparenza di una o più cartelle (per
+# esempio le cartelle prodotte da download_piu_bordi_png.py) con ogni politica
+# di --alpha-format e stampa tempo di codifica e byte prodotti:
+#
+#   python benchmark_formats.py catalogo1/ catalogo2/ --limit 200
+#
+# Le immagini vengono decodificate una sola volta: si misura solo l'encoder.
+#
+# Risultati di riferimento su immagini SINTETICHE, non su un catalogo vero:
+# 40 PNG RGBA generati con benchmark_server.render_image (0.6-2.2 Mpx, 62 Mpx
+# in totale; rumore su tutta l'immagine, ellisse opaca su sfondo trasparente),
+# un core, Pillow 11.2.1 come in requirements.txt (senza supporto AVIF):
+#
+#   formato                  ms/immagine   MB totali   vs png
+#   png optimize                   840.5      145.44    100%
+#   webp q85 m4                    195.8        3.91      3%
+#   webp q85 m6                   2027.1        3.42      2%
+#   webp q85 m0                     56.6        4.36      3%
+#   webp q85 m4 alpha_q 50         203.6        3.91      3%
+#   webp lossless m4               297.5       45.66     31%
+#   avif q85 s6             non supportato da questa installazione di Pillow
+#
+# Il rumore sintetico gonfia il PNG e l'alfa tutto-o-niente rende inutile
+# alpha_q: prima di cambiare --alpha-format in produzione va ripetuta la
+# misura su un catalogo vero.
+
+IMAGE_EXTENSIONS = ('.png', '.webp', '.avif', '.jpg', '.jpeg', '.gif')
+
+# Configurazioni confrontate: (etichetta, argomenti di OutputFormats)
+CONFIGURATIONS = [
+    ("png optimize", {'alpha_format': 'png'}),
+    ("webp q85 m4", {'alpha_format': 'webp'}),
+    ("webp q85 m6", {'alpha_format': 'webp', 'webp_method': 6}),
+    ("webp q85 m0", {'alpha_format': 'webp', 'webp_method': 0}),
+    ("webp q85 m4 alpha_q 50", {'alpha_format': 'webp', 'alpha_quality': 50}),
+    ("webp lossless m4", {'alpha_format': 'webp', 'lossless_alpha': True}),
+    ("avif q85 s6", {'alpha_format': 'avif'}),
+]
+
+
+def iter_image_paths(paths):
+    """Genera i file immagine indicati o contenuti nelle cartelle indicate."""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        else:
+            yield path
+
+
+def load_transparent_images(paths, limit=None):
+    """Decodifica le immagini con trasparenza reale (in RGBA); ritorna (immagini, scartate)."""
+    images, skipped = [], 0
+    for path in iter_image_paths(paths):
+        if limit and len(images) >= limit:
+            break
+        try:
+            with Image.open(path) as img:
+                has_transparency, _ = analyze_image(img)
+                if not has_transparency:
+                    skipped += 1
+                    continue
+                images.append(img.convert('RGBA'))
+        except Exception as e:
+            print(f"Impossibile leggere {path}: {e}")
+            skipped += 1
+    return images, skipped
+
+
+def benchmark(images, formats):
+    """Codifica tutte le immagini con la politica indicata; ritorna (secondi, byte totali)."""
+    _, save_format, save_options = formats.for_image(True)
+    elapsed, total_bytes = 0.0, 0
+    for img in images:
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        img.save(buffer, save_format, **save_options)
+        elapsed += time.perf_counter() - start
+        total_bytes += buffer.tell()
+    return elapsed, total_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Confronta tempo di codifica e dimensione dei formati per le immagini con trasparenza."
+    )
+    parser.add_argument("paths", nargs='+', help="File o cartelle di immagini da usare come campione.")
+    parser.add_argument("--limit", type=int, help="Numero massimo di immagini con trasparenza da usare.")
+    args = parser.parse_args()
+
+    images, skipped = load_transparent_images(args.paths, args.limit)
+    if not images:
+        parser.error("Nessuna immagine con trasparenza trovata.")
+    pixels = sum(img.width * img.height for img in images)
+    print(f"Campione: {len(images)} immagini con trasparenza ({pixels / 1e6:.1f} Mpx), {skipped} scartate\n")
+
+    available = available_alpha_formats()
+    reference = None
+    print(f"{'formato':<24}{'ms/immagine':>12}{'MB totali':>12}{'vs png':>9}")
+    for label, options in CONFIGURATIONS:
+        if options['alpha_format'] not in available:
+            print(f"{label:<24}{'non supportato da questa installazione di Pillow':>33}")
+            continue
+        elapsed, total_bytes = benchmark(images, OutputFormats(**options))
+        reference = reference or total_bytes
+        print(f"{label:<24}{elapsed * 1000 / len(images):>12.1f}{total_bytes / (1024 * 1024):>12.2f}"
+              f"{total_bytes / reference:>8.0%}")
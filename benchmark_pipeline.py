@@ -0,0 +1,306 @@
+import os
+import csv
+import sys
+import json
+import time
+import shlex
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark_server import render_image, start_server
+from pipeline.metrics import STAGE_GROUPS
+from pipeline.presets import PRESETS
+from pipeline.fetchers import FETCHERS
+
+# ==============================================================================
+# BENCHMARK DELLA PIPELINE SU UN SERVER LOCALE
+# ==============================================================================
+# Misura la pipeline completa (download, conversione, _local.csv) contro il
+# server di immagini sintetiche di benchmark_server.py, senza rete:
+#   1. genera un CSV di `--images` righe prendendo nomi e descrizioni dai
+#      _local.csv esistenti (local_csv/*.csv): le righe che puntano a un .png
+#      diventano PNG con trasparenza, le altre JPEG o PNG opachi di varie
+#      dimensioni; una parte delle righe fallisce (404), riceve dei 429, ha un
+#      errore temporaneo (500) o ripete l'URL di una riga precedente
+#   2. esegue `python -m pipeline` per ogni combinazione di preset, fetcher e
+#      numero di worker, ognuna in una cartella nuova e in un processo separato
+#   3. riporta per ogni esecuzione immagini/s, latenza per immagine p50/p99
+#      (dalla prima richiesta al server alla scrittura del file), tempo CPU e
+#      memoria massima (VmHWM) tra il processo e i suoi processi di conversione
+#   4. dal report --metrics-report della pipeline (vedi pipeline/metrics.py)
+#      somma i tempi degli stadi di tutte le immagini: rete (connessione, TTFB,
+#      trasferimento), decodifica, bordi (analisi, tela e varianti), codifica
+#      e scrittura, ognuno nella sua colonna
+# Lo stesso --seed produce lo stesso CSV e le stesse immagini: i risultati sono
+# confrontabili tra macchine e versioni del codice.
+#
+#   python benchmark_pipeline.py --images 400 --presets piu_bordi_png,images --fetchers requests,async --workers 8,32
+#
+# Risultati di riferimento (100 immagini, --latency-ms 40, 1 core, seed 1,
+# Pillow 11.2.1 come in requirements.txt):
+#
+#   preset        fetcher  worker  img/s  p50 ms  p99 ms  CPU s  rete s  decod. s  bordi s  cod. s scritt. s  RSS MB
+#   piu_bordi_png requests      8    3.3    2232    7308   26.2     5.1       1.5      0.2    24.4      0.03     166
+#   piu_bordi_png async         8    3.2    2451    7917   27.0     5.6       1.6      0.2    24.8      0.03     165
+#   images        requests      8    3.4    2249    7336   25.2     5.1       1.7      0.0    23.5      0.05     166
+#   images        async         8    3.3    2107    7566   25.6     5.7       1.7      0.0    23.5      0.04     166
+#
+# Su un solo core la codifica è il collo di bottiglia (quasi tutto il tempo
+# CPU): le immagini aspettano in coda la conversione, da cui le latenze alte, e
+# i due fetcher si equivalgono.
+
+DEFAULT_TEMPLATES = "local_csv"
+# Dimensioni (larghezza, altezza) delle immagini opache e relativo peso
+SIZES = [((400, 400), 20), ((800, 600), 30), ((1200, 1200), 25), ((2000, 1500), 20), ((3000, 3000), 5)]
+# Opzioni passate a ogni esecuzione: il rate limiter di default (5 richieste/s
+# per host) misurerebbe solo se stesso
+BASE_ARGS = ["--rate", "1000", "--burst", "1000"]
+RSS_POLL_INTERVAL = 0.05
+
+
+def read_templates(folder):
+    """Righe (nome, descrizione, ha_trasparenza) dei _local.csv usati come modello."""
+    templates = []
+    for path in sorted(Path(folder).glob("*.csv")):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('name'):
+                    image_url = row.get('image_url') or ''
+                    templates.append((row['name'], row.get('description') or '', image_url.endswith('.png')))
+    return templates
+
+
+def build_csv(path, templates, images, base_url, seed=1, fail_ratio=0.02, burst_ratio=0.01, flaky_ratio=0.01,
+              duplicate_ratio=0.05):
+    """Scrive il CSV del benchmark; ritorna la lista degli URL delle righe."""
+    rng = random.Random(seed)
+    sizes, weights = zip(*SIZES)
+    urls = []
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'description', 'image_url'])
+        writer.writeheader()
+        for number in range(1, images + 1):
+            name, description, transparent = rng.choice(templates) if templates else (f"Prodotto {number}", '', False)
+            if urls and rng.random() < duplicate_ratio:
+                url = rng.choice(urls)
+            else:
+                kind = rng.choices(['img', 'fail', 'burst', 'flaky'],
+                                   [1 - fail_ratio - burst_ratio - flaky_ratio, fail_ratio, burst_ratio, flaky_ratio])[0]
+                width, height = rng.choices(sizes, weights)[0]
+                if transparent:
+                    url = f"{base_url}/{kind}/{number}.png?w={width}&h={height}&alpha=1"
+                else:
+                    extension = 'png' if rng.random() < 0.2 else 'jpg'
+                    url = f"{base_url}/{kind}/{number}.{extension}?w={width}&h={height}"
+            urls.append(url)
+            # Nome unico per riga: il benchmark misura le immagini, non i nomi duplicati dei cataloghi
+            writer.writerow({'name': f"{name} {number}", 'description': description, 'image_url': url})
+    return urls
+
+
+def _request_path(url):
+    parsed = urlsplit(url)
+    return parsed.path + (f"?{parsed.query}" if parsed.query else '')
+
+
+def _server_call(base_url, endpoint):
+    with urllib.request.urlopen(f"{base_url}/{endpoint}") as response:
+        return response.read()
+
+
+def warm_up(urls, workers=8):
+    """Genera in anticipo le immagini del server, così la generazione non entra nelle misure."""
+    def render(url):
+        parsed = urlsplit(url)
+        if parsed.path.startswith('/fail/'):
+            return
+        query = dict(part.split('=') for part in parsed.query.split('&'))
+        render_image(parsed.path, int(query['w']), int(query['h']), query.get('alpha') == '1')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(render, set(urls)))
+
+
+def percentile(values, fraction):
+    """Percentile (0-1) con interpolazione lineare, None se non ci sono valori."""
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=1000, method='inclusive')[round(fraction * 1000) - 1]
+
+
+def _tree_peak_rss(pid):
+    """Picco di memoria (VmHWM, KB) più alto tra `pid` e i suoi discendenti."""
+    peak = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1])
+        children = []
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except (FileNotFoundError, ProcessLookupError):
+        return peak
+    return max([peak] + [_tree_peak_rss(child) for child in children])
+
+
+def run_configuration(csv_path, run_dir, base_url, preset, fetcher, workers, extra_args=()):
+    """
+    Esegue la pipeline in un processo separato dentro `run_dir`.
+    Ritorna il dizionario dei risultati (tempi, CPU, RSS, latenze, file prodotti).
+    """
+    run_dir.mkdir(parents=True)
+    bench_csv = run_dir / "bench.csv"
+    bench_csv.write_bytes(Path(csv_path).read_bytes())
+    command = [sys.executable, "-m", "pipeline", bench_csv.name, "--preset", preset, "--fetcher", fetcher,
+               "--workers", str(workers), "--metrics-report", "metrics.json", *BASE_ARGS, *extra_args]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent),
+                                                                   os.environ.get('PYTHONPATH')])))
+
+    _server_call(base_url, "_reset")
+    with open(run_dir / "output.log", 'wb') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 ritorna la CPU del figlio e dei processi di conversione che ha atteso;
+        # il suo ru_maxrss invece include la memoria di questo processo prima
+        # dell'exec, quindi il picco di memoria si legge da /proc durante il run
+        peak_rss = 0
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            peak_rss = max(peak_rss, _tree_peak_rss(process.pid))
+            time.sleep(RSS_POLL_INTERVAL)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+    first_request = json.loads(_server_call(base_url, "_stats"))
+
+    # Latenza per immagine: dalla prima richiesta dell'URL alla scrittura del file
+    latencies = {}
+    with open(bench_csv, encoding='utf-8', newline='') as original, \
+         open(run_dir / "local_csv" / "bench_local.csv", encoding='utf-8', newline='') as local:
+        for row, local_row in zip(csv.DictReader(original), csv.DictReader(local)):
+            local_url = local_row['image_url']
+            if not local_url.startswith('/images/') or row['image_url'] in latencies:
+                continue
+            output = run_dir / "bench" / local_url.rsplit('/', 1)[1]
+            requested = first_request.get(_request_path(row['image_url']))
+            if requested is not None:
+                latencies[row['image_url']] = max(0.0, output.stat().st_mtime - requested)
+
+    # Tempi degli stadi sommati su tutte le immagini
+    stages = {}
+    metrics_path = run_dir / "metrics.json"
+    if metrics_path.exists():
+        with open(metrics_path, encoding='utf-8') as f:
+            stages = {stage: stats['total'] for stage, stats in json.load(f)['stages'].items()}
+
+    values = sorted(latencies.values())
+    return {
+        'preset': preset, 'fetcher': fetcher, 'workers': workers, 'exit_code': process.returncode,
+        'seconds': elapsed, 'images': len(values), 'images_per_second': len(values) / elapsed if elapsed else 0,
+        'p50_ms': percentile(values, 0.50) * 1000 if values else None,
+        'p99_ms': percentile(values, 0.99) * 1000 if values else None,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': peak_rss / 1024,
+        'network_seconds': sum(stages.get(stage, 0.0) for stage in STAGE_GROUPS['rete']),
+        'decode_seconds': stages.get('decode', 0.0),
+        'square_seconds': stages.get('square', 0.0),
+        'encode_seconds': stages.get('encode', 0.0),
+        'write_seconds': stages.get('write', 0.0),
+    }
+
+
+def _csv_list(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def _int_list(value):
+    return [int(part) for part in _csv_list(value)]
+
+
+def print_report(results):
+    columns = [("preset", 14, 's'), ("fetcher", 8, 's'), ("worker", 6, 'd'), ("img/s", 6, '.1f'),
+               ("p50 ms", 7, '.0f'), ("p99 ms", 7, '.0f'), ("CPU s", 6, '.1f'), ("rete s", 7, '.1f'),
+               ("decod. s", 9, '.1f'), ("bordi s", 8, '.1f'), ("cod. s", 7, '.1f'), ("scritt. s", 9, '.2f'),
+               ("RSS MB", 7, '.0f')]
+    keys = ['preset', 'fetcher', 'workers', 'images_per_second', 'p50_ms', 'p99_ms', 'cpu_seconds',
+            'network_seconds', 'decode_seconds', 'square_seconds', 'encode_seconds', 'write_seconds', 'peak_rss_mb']
+    print("".join(f"{label:<{width}}" if fmt == 's' else f"{label:>{width + 1}}" for label, width, fmt in columns))
+    for result in results:
+        cells = []
+        for (label, width, fmt), key in zip(columns, keys):
+            value = result.get(key)
+            if fmt == 's':
+                cells.append(f"{value:<{width}}")
+            elif value is None:
+                cells.append(f"{'-':>{width + 1}}")
+            else:
+                cells.append(f"{value:>{width + 1}{fmt}}")
+        print("".join(cells) + ("" if result['exit_code'] == 0 else f"  (uscita {result['exit_code']})"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Misura throughput, latenza, CPU e memoria della pipeline contro un server locale di immagini sintetiche."
+    )
+    parser.add_argument("--images", type=int, default=200, help="Righe del CSV di benchmark (default: 200)")
+    parser.add_argument("--templates", default=DEFAULT_TEMPLATES, help=f"Cartella dei CSV da cui prendere nomi e descrizioni (default: {DEFAULT_TEMPLATES})")
+    parser.add_argument("--seed", type=int, default=1, help="Seed del CSV generato (default: 1)")
+    parser.add_argument("--presets", type=_csv_list, default=['piu_bordi_png'], help="Preset da misurare, separati da virgola (default: piu_bordi_png)")
+    parser.add_argument("--fetchers", type=_csv_list, default=['requests'], help=f"Fetcher da misurare tra {', '.join(FETCHERS)} (default: requests)")
+    parser.add_argument("--workers", type=_int_list, default=[8], help="Valori di --workers da misurare, separati da virgola (default: 8)")
+    parser.add_argument("--latency-ms", type=float, default=40, help="Latenza media del server in millisecondi (default: 40)")
+    parser.add_argument("--fail-ratio", type=float, default=0.02, help="Frazione di righe con risposta 404 (default: 0.02)")
+    parser.add_argument("--burst-ratio", type=float, default=0.01, help="Frazione di righe che ricevono dei 429 (default: 0.01)")
+    parser.add_argument("--flaky-ratio", type=float, default=0.01, help="Frazione di righe con un 500 prima dell'immagine (default: 0.01)")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="Frazione di righe che ripetono l'URL di una riga precedente (default: 0.05)")
+    parser.add_argument("--pipeline-args", type=shlex.split, default=[], help="Opzioni aggiuntive per la pipeline, es. \"--stream --alpha-format webp\"")
+    parser.add_argument("--workdir", help="Cartella in cui eseguire le prove (default: cartella temporanea)")
+    parser.add_argument("--json", help="File in cui salvare i risultati in JSON")
+    args = parser.parse_args()
+
+    for preset in args.presets:
+        if preset not in PRESETS:
+            parser.error(f"Preset sconosciuto: {preset}")
+    for fetcher in args.fetchers:
+        if fetcher not in FETCHERS:
+            parser.error(f"Fetcher sconosciuto: {fetcher}")
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="benchmark_pipeline_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    server = start_server(latency_ms=args.latency_ms)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    csv_path = workdir / "bench.csv"
+    urls = build_csv(csv_path, read_templates(args.templates), args.images, base_url, args.seed,
+                     args.fail_ratio, args.burst_ratio, args.flaky_ratio, args.duplicate_ratio)
+    print(f"CSV di benchmark: {csv_path} ({len(urls)} righe, {len(set(urls))} URL unici)")
+    warm_up(urls)
+
+    results = []
+    for preset in args.presets:
+        for fetcher in args.fetchers:
+            for workers in args.workers:
+                run_dir = workdir / f"{preset}-{fetcher}-{workers}"
+                print(f"Esecuzione: {run_dir.name} ...", flush=True)
+                results.append(run_configuration(csv_path, run_dir, base_url, preset, fetcher, workers,
+                                                 args.pipeline_args))
+
+    server.shutdown()
+    print()
+    print_report(results)
+    print(f"\nLog e file prodotti: {workdir}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,161 @@
+import io
+import json
+import time
+import zlib
+import argparse
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image
+
+# ==============================================================================
+# SERVER LOCALE DI IMMAGINI SINTETICHE PER I BENCHMARK
+# ==============================================================================
+# Simula i server dei fornitori senza rete: ogni URL produce sempre la stessa
+# immagine (generata da un seed ricavato dal percorso), quindi le misure sono
+# riproducibili offline.
+#   /img/<id>.jpg?w=800&h=600          JPEG opaco
+#   /img/<id>.png?w=800&h=600          PNG opaco
+#   /img/<id>.png?w=800&h=600&alpha=1  PNG con prodotto scontornato e bordi trasparenti
+#   /burst/<id>.jpg?...                429 con Retry-After per le prime BURST_REQUESTS richieste
+#   /flaky/<id>.jpg?...                500 alla prima richiesta, poi l'immagine
+#   /fail/<id>.jpg                     404
+# Ogni risposta attende `latency_ms` (con una variazione fissa per URL tra 0.5x
+# e 1.5x). Le immagini generate restano in memoria, così dopo un primo giro
+# di riscaldamento il server misura solo la latenza configurata.
+# Endpoint di servizio:
+#   /_reset   azzera i contatori di 429/500 e gli orari delle richieste
+#   /_stats   JSON con l'orario (time.time) della prima richiesta per URL
+#
+#   python benchmark_server.py --port 8765 --latency-ms 40
+
+BURST_REQUESTS = 2      # Risposte 429 prima dell'immagine per gli URL /burst/
+RETRY_AFTER = 1         # Secondi indicati nel Retry-After dei 429
+
+
+def _seed(path):
+    return zlib.crc32(path.encode())
+
+
+@lru_cache(maxsize=4096)
+def render_image(path, width, height, alpha):
+    """Byte dell'immagine sintetica per un percorso: sfumatura, rumore e un "prodotto" centrale."""
+    rng = np.random.default_rng(_seed(path))
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.integers(40, 200, size=3)
+    gradient = (x / max(width - 1, 1))[..., None] * rng.integers(-60, 60, size=3)
+    noise = rng.normal(0, 12, size=(height, width, 3))
+    rgb = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+
+    # Un'ellisse centrale più scura fa da soggetto; con alpha è l'unica parte opaca
+    inside = ((x - width / 2) / (width * 0.35)) ** 2 + ((y - height / 2) / (height * 0.4)) ** 2 <= 1
+    rgb[inside] = rgb[inside] // 2
+    extension = path.rsplit('.', 1)[-1].lower()
+    if alpha:
+        img = Image.fromarray(np.dstack([rgb, np.where(inside, 255, 0).astype(np.uint8)]), 'RGBA')
+    else:
+        img = Image.fromarray(rgb, 'RGB')
+
+    buffer = io.BytesIO()
+    if extension == 'png':
+        img.save(buffer, 'PNG')
+    else:
+        img.convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class _State:
+    def __init__(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.first_request = {}
+
+    def hit(self, url):
+        with self.lock:
+            self.hits[url] = self.hits.get(url, 0) + 1
+            self.first_request.setdefault(url, time.time())
+            return self.hits[url]
+
+    def reset(self):
+        with self.lock:
+            self.hits.clear()
+            self.first_request.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type=None, headers=()):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        parsed = urlsplit(self.path)
+        if parsed.path == '/_reset':
+            state.reset()
+            return self._send(200, b'ok', 'text/plain')
+        if parsed.path == '/_stats':
+            with state.lock:
+                body = json.dumps(state.first_request).encode()
+            return self._send(200, body, 'application/json')
+
+        hits = state.hit(self.path)
+        # Latenza fissa per URL: stesso run, stessi tempi
+        time.sleep(state.latency_ms / 1000 * (0.5 + (_seed(self.path) % 1000) / 1000))
+
+        kind = parsed.path.split('/')[1]
+        if kind == 'fail':
+            return self._send(404, b'not found', 'text/plain')
+        if kind == 'burst' and hits <= BURST_REQUESTS:
+            return self._send(429, headers=[('Retry-After', str(RETRY_AFTER))])
+        if kind == 'flaky' and hits == 1:
+            return self._send(500, b'error', 'text/plain')
+
+        query = parse_qs(parsed.query)
+        width = int(query.get('w', ['800'])[0])
+        height = int(query.get('h', ['600'])[0])
+        alpha = query.get('alpha', ['0'])[0] == '1'
+        body = render_image(parsed.path, width, height, alpha)
+        etag = f'"{zlib.crc32(body):08x}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, headers=[('ETag', etag)])
+        content_type = 'image/png' if parsed.path.endswith('.png') else 'image/jpeg'
+        self._send(200, body, content_type, [('ETag', etag)])
+
+
+def start_server(port=0, latency_ms=0):
+    """Avvia il server in un thread; ritorna il ThreadingHTTPServer (porta in server.server_port)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.state = _State(latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server locale di immagini sintetiche per i benchmark.")
+    parser.add_argument("--port", type=int, default=8765, help="Porta su cui ascoltare (default: 8765)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latenza media di ogni risposta in millisecondi (default: 0)")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency_ms)
+    print(f"Server di benchmark su http://127.0.0.1:{server.server_port}/ (Ctrl+C per terminare)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,95 @@
+import io
+import warnings
+from PIL import Image
+
+# ==============================================================================
+# LETTURA IN STREAMING DEL CORPO DELLE RISPOSTE (--max-bytes)
+# ==============================================================================
+# Invece di bufferizzare tutta la risposta (response.content) il corpo viene
+# letto a blocchi con BodyReader, che scarta le risposte sbagliate il prima
+# possibile:
+#   - prima di leggere il corpo: Content-Type non da immagine (pagine HTML di
+#     errore, JSON, ...) o Content-Length oltre il limite
+#   - durante la lettura: corpo che supera il limite di byte
+#   - dopo i primi KB: intestazione che PIL non riconosce come immagine
+#     (formato e dimensioni vengono letti con Image.open sui soli primi byte)
+# La connessione viene chiusa senza leggere il resto, risparmiando banda e memoria.
+
+DEFAULT_MAX_MB = 25
+DEFAULT_MAX_BYTES = DEFAULT_MAX_MB * 1024 * 1024
+CHUNK_SIZE = 64 * 1024          # Byte letti per blocco
+SNIFF_BYTES = 16 * 1024         # Primi byte su cui riconoscere l'immagine
+SNIFF_MAX_BYTES = 512 * 1024    # Oltre questa soglia un'intestazione non riconosciuta è un errore
+
+# Content-Type che sicuramente non sono immagini; gli altri (image/*, octet-stream,
+# assente) vengono accettati e verificati dallo sniffing
+REJECTED_CONTENT_TYPES = (
+    'text/', 'application/json', 'application/xml', 'application/xhtml+xml',
+    'application/javascript', 'application/pdf',
+)
+
+
+class ResponseRejected(ValueError):
+    """La risposta non contiene un'immagine utilizzabile: non ha senso riprovare."""
+
+
+class BodyReader:
+    """
+    Legge il corpo di una risposta a blocchi (feed) con limite di dimensione e
+    riconoscimento anticipato dell'immagine. `max_bytes` 0 o None = nessun limite.
+    Dopo finish() `image_format` e `image_size` descrivono l'immagine.
+    """
+
+    def __init__(self, url, headers, max_bytes=DEFAULT_MAX_BYTES):
+        self.url = url
+        self.max_bytes = max_bytes or None
+        self.image_format = None
+        self.image_size = None
+        self._buffer = bytearray()
+        self._next_sniff = SNIFF_BYTES
+
+        content_type = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type.startswith(REJECTED_CONTENT_TYPES):
+            raise ResponseRejected(f"Content-Type non valido ({content_type}) per {url}")
+        content_length = headers.get('Content-Length')
+        if self.max_bytes and content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise ResponseRejected(f"Immagine troppo grande ({int(content_length)} byte, limite {self.max_bytes}) per {url}")
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.max_bytes and len(self._buffer) > self.max_bytes:
+            raise ResponseRejected(f"Immagine oltre il limite di {self.max_bytes} byte per {self.url}")
+        if self.image_format is None and len(self._buffer) >= self._next_sniff:
+            self._sniff(complete=False)
+
+    def _sniff(self, complete):
+        try:
+            with warnings.catch_warnings():
+                # I primi KB di un'immagine grande possono far scattare l'avviso di decompression bomb
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                with Image.open(io.BytesIO(bytes(self._buffer))) as img:
+                    self.image_format, self.image_size = img.format, img.size
+        except Image.DecompressionBombError:
+            raise ResponseRejected(f"Immagine con troppi pixel per {self.url}")
+        except Exception:
+            # Alcune intestazioni (JPEG con metadati grandi) non stanno nei primi KB
+            if complete or len(self._buffer) >= SNIFF_MAX_BYTES:
+                raise ResponseRejected(f"Il contenuto scaricato non è un'immagine riconoscibile per {self.url}")
+            self._next_sniff = len(self._buffer) * 2
+
+    def finish(self):
+        """Ritorna il contenuto completo, dopo aver verificato che sia un'immagine."""
+        if self.image_format is None:
+            self._sniff(complete=True)
+        return bytes(self._buffer)
+
+    def read(self, chunks):
+        """Legge tutti i blocchi di un iterabile (iter_content / iter_bytes) e ritorna il contenuto."""
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.finish()
+
+
+def add_body_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni sulla lettura delle risposte."""
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help=f"Dimensione massima in byte di un'immagine scaricata, 0 per nessun limite (default: {DEFAULT_MAX_MB} MB)")
@@ -0,0 +1,226 @@
+import os
+import csv
+import time
+import queue
+import logging
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from pathlib import Path
+
+# ==============================================================================
+# LETTURA IN STREAMING DEI CSV (--stream)
+# ==============================================================================
+# Senza --stream gli script leggono tutto il CSV, sottomettono tutte le righe
+# all'executor insieme e scrivono il _local.csv solo dopo l'ultima immagine.
+# In streaming invece:
+#   - le righe vengono lette una alla volta (iter_rows)
+#   - al massimo `window` righe sono in lavorazione contemporaneamente
+#     (run_windowed): i risultati vengono raccolti nell'ordine in cui si
+#     completano e riordinati in un buffer, la lettura si ferma solo finché la
+#     riga più vecchia non è pronta
+#   - con --image-deadline una riga più lenta della scadenza non blocca la
+#     finestra: viene rimandata in fondo al CSV (e riprovata se fallisce)
+#   - il _local.csv viene scritto riga per riga, nell'ordine dell'input, appena
+#     l'immagine della riga è risolta (LocalCsvWriter); le righe rimandate
+#     vengono corrette alla fine (patch_local_csv)
+# La memoria resta costante anche con cataloghi da centinaia di migliaia di
+# righe e un'interruzione lascia un _local.csv parziale ma valido.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_PER_WORKER = 4   # Righe in lavorazione per worker se --window non è indicato
+DEFAULT_CHECKPOINT_INTERVAL = 30.0  # Secondi tra due salvataggi intermedi dei _local.csv (senza --stream)
+
+# Risultato provvisorio di run_windowed per gli item rimandati oltre la scadenza
+DEFERRED = object()
+
+
+def iter_rows(csv_file_path):
+    """Genera le coppie (numero di riga 1-based, riga) del CSV senza caricarlo in memoria."""
+    with open(csv_file_path, 'r', encoding='utf-8', newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row_number, row in enumerate(reader, 1):
+            yield row_number, row
+
+
+def read_fieldnames(csv_file_path):
+    """Ritorna l'header del CSV (None se il file è vuoto)."""
+    with open(csv_file_path, 'r', encoding='utf-8', newline='') as csvfile:
+        return csv.DictReader(csvfile).fieldnames
+
+
+def local_csv_path(original_csv_path):
+    """Percorso del _local.csv corrispondente al CSV indicato (crea la cartella local_csv/)."""
+    local_csv_folder = Path("local_csv")
+    local_csv_folder.mkdir(exist_ok=True)
+    return local_csv_folder / f"{Path(original_csv_path).stem}_local.csv"
+
+
+class LocalCsvWriter:
+    """
+    Scrive il _local.csv una riga alla volta: dopo ogni riga il file viene
+    svuotato su disco, così contiene sempre un CSV valido con le righe già pronte.
+    """
+
+    def __init__(self, original_csv_path, fieldnames):
+        self.path = local_csv_path(original_csv_path)
+        self._file = open(self.path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        self._writer.writeheader()
+        self._file.flush()
+
+    def write_row(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def patch_local_csv(path, rows):
+    """
+    Sostituisce nel _local.csv le righe indicate ({numero di riga 1-based: riga})
+    riscrivendo il file in streaming su un file temporaneo, poi rinominato.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(path, 'r', encoding='utf-8', newline='') as infile, \
+         open(temporary_path, 'w', encoding='utf-8', newline='') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        for row_number, row in enumerate(reader, 1):
+            writer.writerow(rows.get(row_number, row))
+    os.replace(temporary_path, path)
+
+
+def when_resolved(result, callback):
+    """
+    Chiama callback(risultato) appena il risultato è pronto: subito se non è un
+    Future, altrimenti al completamento (anche annidato: Future del fetcher ->
+    Future della conversione). Un task finito con un'eccezione ha risultato None
+    (gli errori dei download e delle conversioni sono già nel log dei worker).
+    """
+    if not isinstance(result, Future):
+        callback(result)
+        return
+
+    def done(future):
+        try:
+            value = future.result()
+        except Exception:
+            value = None
+        when_resolved(value, callback)
+
+    result.add_done_callback(done)
+
+
+class _Slot:
+    """Posto di un item nel buffer di riordino di run_windowed."""
+
+    def __init__(self, item):
+        self.item = item
+        self.submitted = time.monotonic()
+        self.done = False
+        self.result = None
+
+
+def run_windowed(items, submit, window, deadline=None, retry=None):
+    """
+    Sottomette gli item uno alla volta con submit(item) tenendone al massimo
+    `window` in lavorazione, e genera le coppie (item, risultato) nell'ordine
+    degli item.
+
+    `items` è un iterabile (anche un generatore) di tuple il cui primo elemento
+    identifica l'item nei log. submit può ritornare un Future o direttamente il
+    risultato (righe da non scaricare); i task falliti hanno risultato None.
+
+    I risultati vengono raccolti nell'ordine di completamento in un buffer di
+    riordino, da cui escono appena tutti gli item precedenti sono pronti.
+    Con `deadline` (secondi dalla sottomissione) l'item più vecchio, se è più
+    lento della scadenza e la finestra è piena, viene rimandato: genera subito
+    (item, DEFERRED) e il risultato definitivo alla fine, dopo tutti gli altri.
+    Gli item rimandati ancora in lavorazione sono al massimo `window`: oltre,
+    si torna ad attendere l'item più vecchio.
+    Se un item rimandato fallisce e c'è `retry`, retry(item) (Future o
+    risultato) viene tentato ancora una volta prima di generarne il risultato.
+    """
+    completions = queue.SimpleQueue()
+    slots = deque()
+    deferred = []
+
+    def collect(timeout):
+        # Registra i completamenti arrivati, attendendo il primo al massimo `timeout`
+        # secondi (None = senza limite); False se non è arrivato niente
+        try:
+            slot, result = completions.get(timeout=timeout) if timeout is None or timeout > 0 else completions.get_nowait()
+        except queue.Empty:
+            return False
+        while True:
+            slot.done, slot.result = True, result
+            try:
+                slot, result = completions.get_nowait()
+            except queue.Empty:
+                return True
+
+    def advance(limit):
+        # Genera gli item pronti in testa e libera la finestra finché ci sono meno di `limit` item
+        collect(0)
+        while slots and (slots[0].done or len(slots) >= limit):
+            head = slots[0]
+            if head.done:
+                slots.popleft()
+                yield head.item, head.result
+                continue
+            # Si rimanda solo a finestra piena (non durante lo svuotamento finale) e gli
+            # item rimandati ancora in lavorazione restano al massimo `window`
+            can_defer = (deadline is not None and len(slots) >= window
+                         and sum(1 for slot in deferred if not slot.done) < window)
+            timeout = head.submitted + deadline - time.monotonic() if can_defer else None
+            if not collect(timeout) and can_defer:
+                # L'item più vecchio ha superato la scadenza: non blocca più gli altri
+                logger.warning(f"Task {head.item[0]} oltre la scadenza di {deadline:g} secondi: rimandato in fondo")
+                slots.popleft()
+                deferred.append(head)
+                yield head.item, DEFERRED
+
+    for item in items:
+        slot = _Slot(item)
+        slots.append(slot)
+        when_resolved(submit(item), partial(_put, completions, slot))
+        yield from advance(window)
+    yield from advance(1)
+
+    # Coda dei retry: prima si attendono tutti gli item rimandati, poi si riprovano quelli falliti
+    retries = []
+    for slot in deferred:
+        while not slot.done:
+            collect(None)
+        if slot.result or retry is None:
+            yield slot.item, slot.result
+            continue
+        retry_slot = _Slot(None)
+        when_resolved(retry(slot.item), partial(_put, completions, retry_slot))
+        retries.append((slot.item, retry_slot))
+    for item, retry_slot in retries:
+        while not retry_slot.done:
+            collect(None)
+        yield item, retry_slot.result
+
+
+def _put(completions, slot, result):
+    completions.put((slot, result))
+
+
+def add_stream_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni della lettura in streaming."""
+    parser.add_argument("--stream", action="store_true", help="Legge il CSV in streaming e scrive il _local.csv riga per riga (memoria costante)")
+    parser.add_argument("--window", type=int, help=f"Con --stream, numero massimo di righe in lavorazione (default: {DEFAULT_WINDOW_PER_WORKER} per worker)")
+    parser.add_argument("--image-deadline", type=float, help="Con --stream, secondi dopo cui un'immagine lenta viene rimandata in fondo al CSV (e riprovata se fallisce) invece di bloccare le righe successive")
+    parser.add_argument("--checkpoint-interval", type=float, default=DEFAULT_CHECKPOINT_INTERVAL, help=f"Senza --stream, secondi tra due salvataggi intermedi dei _local.csv con le immagini già pronte, 0 per disattivarli (default: {DEFAULT_CHECKPOINT_INTERVAL:.0f})")
@@ -0,0 +1,14 @@
+from pipeline.batch import main
+
+# ==============================================================================
+# BATCH DI CATALOGHI SU PIÙ PROCESSI
+# ==============================================================================
+# Processa cartelle o elenchi di CSV dividendo il lavoro tra più processi della
+# pipeline (vedi pipeline/batch.py), con le stesse opzioni e lo stesso preset
+# di default di download_piu_bordi_png.py.
+#
+#   python download_batch.py cataloghi/ --processes 4
+#   python download_batch.py elenco_cataloghi.txt --shard-by url
+
+if __name__ == "__main__":
+    main()
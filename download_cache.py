@@ -0,0 +1,197 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+# ==============================================================================
+# CACHE PERSISTENTE DEI DOWNLOAD (--cache-dir)
+# ==============================================================================
+# Per ogni coppia (URL, cartella di output) la cache ricorda ETag, Last-Modified,
+# hash SHA-256 del contenuto scaricato e il nome del file prodotto. Ai run
+# successivi la richiesta diventa un GET condizionale:
+#   - 304 Not Modified  -> l'immagine è già pronta, niente download né conversione
+#   - 200 con lo stesso hash -> solo i validatori vengono aggiornati
+#   - 200 con hash diverso   -> l'immagine è cambiata e viene riconvertita
+# I byte originali sono salvati anche per contenuto (blobs/<hash>), così un file
+# di output cancellato può essere rigenerato dopo un 304 senza riscaricarlo.
+# Lo spazio dei blob è limitato: oltre `max_bytes` vengono eliminati i meno
+# usati di recente (LRU).
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 1024
+
+
+def content_hash(content):
+    """Hash SHA-256 (esadecimale) del contenuto scaricato."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class DownloadCache:
+    """Indice SQLite + archivio dei contenuti per hash, condivisibile tra thread."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.blobs_dir = self.cache_dir / "blobs"
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.cache_dir / "index.sqlite3", check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                sha256 TEXT NOT NULL,
+                output TEXT NOT NULL,
+                PRIMARY KEY (url, folder)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    # --------------------------------------------------------------------------
+    # Lettura
+    # --------------------------------------------------------------------------
+
+    def lookup(self, url, folder):
+        """Ritorna la voce di cache per (url, cartella) come dizionario, o None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, sha256, output FROM entries WHERE url = ? AND folder = ?",
+                (url, str(folder))
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, sha256, output = row
+        return {'etag': etag, 'last_modified': last_modified, 'sha256': sha256, 'output': output}
+
+    def _blob_path(self, sha256):
+        return self.blobs_dir / sha256[:2] / sha256
+
+    def read_blob(self, sha256):
+        """Ritorna i byte originali salvati per l'hash indicato, o None se sono stati rimossi."""
+        try:
+            content = self._blob_path(sha256).read_bytes()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._db.execute("UPDATE blobs SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._db.commit()
+        return content
+
+    def request_headers(self, entry, folder):
+        """
+        Header condizionali (If-None-Match / If-Modified-Since) per la voce indicata.
+        Sono vuoti se un 304 non basterebbe a produrre l'output (file e blob assenti).
+        """
+        if entry is None:
+            return {}
+        output_exists = os.path.exists(os.path.join(folder, entry['output']))
+        if not output_exists and not self._blob_path(entry['sha256']).exists():
+            return {}
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # --------------------------------------------------------------------------
+    # Scrittura
+    # --------------------------------------------------------------------------
+
+    def store(self, url, folder, response_headers, content, output, sha256=None):
+        """Registra (o aggiorna) la voce per (url, cartella) e salva i byte originali."""
+        sha256 = sha256 or content_hash(content)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (url, folder, etag, last_modified, sha256, output) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, str(folder), response_headers.get('ETag'), response_headers.get('Last-Modified'), sha256, output)
+            )
+            if self.max_bytes > 0 and len(content) <= self.max_bytes:
+                blob_path = self._blob_path(sha256)
+                if not blob_path.exists():
+                    blob_path.parent.mkdir(exist_ok=True)
+                    blob_path.write_bytes(content)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, size, last_used) VALUES (?, ?, ?)",
+                    (sha256, len(content), time.time())
+                )
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Rimuove i blob meno usati di recente finché lo spazio occupato supera max_bytes."""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for sha256, size in self._db.execute("SELECT sha256, size FROM blobs ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                self._blob_path(sha256).unlink()
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            total -= size
+        logger.info(f"Cache: eliminati i contenuti meno recenti, spazio occupato {total / (1024 * 1024):.1f} MB")
+
+    # --------------------------------------------------------------------------
+    # Gestione della risposta
+    # --------------------------------------------------------------------------
+
+    def check_response(self, url, folder, entry, status_code, response_headers, content):
+        """
+        Decide cosa fare di una risposta 200/304 ricevuta con request_headers(entry).
+
+        Ritorna (output, content, sha256, validators): se `output` non è None
+        l'immagine è già pronta; altrimenti `content` va convertito e il risultato
+        registrato con store(url, folder, validators, content, output, sha256).
+        """
+        if status_code == 304 and entry is not None:
+            if os.path.exists(os.path.join(folder, entry['output'])):
+                logger.info(f"Non modificata (304), già presente: {url}")
+                return entry['output'], None, entry['sha256'], None
+            # L'output è stato cancellato: lo rigeneriamo dal contenuto in cache
+            content = self.read_blob(entry['sha256'])
+            if content is None:
+                raise ValueError(f"Risposta 304 per {url} ma contenuto non più in cache")
+            validators = {
+                'ETag': response_headers.get('ETag') or entry['etag'],
+                'Last-Modified': response_headers.get('Last-Modified') or entry['last_modified'],
+            }
+            return None, content, entry['sha256'], validators
+
+        sha256 = content_hash(content)
+        if entry is not None and entry['sha256'] == sha256 and os.path.exists(os.path.join(folder, entry['output'])):
+            logger.info(f"Contenuto invariato, nessuna riconversione: {url}")
+            self.store(url, folder, response_headers, content, entry['output'], sha256)
+            return entry['output'], None, sha256, None
+
+        return None, content, sha256, response_headers
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def add_cache_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni della cache dei download."""
+    parser.add_argument("--cache-dir", help="Cartella della cache persistente dei download (GET condizionali con ETag/Last-Modified)")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_MB, help=f"Spazio massimo in MB per i contenuti in cache, 0 per salvare solo i metadati (default: {DEFAULT_MAX_MB})")
+
+
+def cache_from_args(args):
+    """Crea la DownloadCache dalle opzioni di add_cache_arguments (None se --cache-dir non è indicato)."""
+    if not args.cache_dir:
+        return None
+    return DownloadCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
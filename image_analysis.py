@@ -0,0 +1,66 @@
+import numpy as np
+
+# ==============================================================================
+# ANALISI DEI PIXEL: TRASPARENZA REALE E BORDI (--trim-white)
+# ==============================================================================
+# Il modo dell'immagine (RGBA, LA, P con trasparenza) dice solo che un canale
+# alpha esiste, non che venga usato: molti fornitori esportano PNG RGBA
+# completamente opachi, che salvati come PNG ottimizzato sono lenti da
+# codificare e molto più pesanti di un WebP. analyze_image guarda i pixel,
+# con operazioni numpy sull'intera matrice:
+#   - trasparenza reale: almeno un pixel con alpha < 255
+#   - riquadro del contenuto: i bordi completamente trasparenti (e, con
+#     trim_white, quelli quasi bianchi) vengono tagliati prima di rendere
+#     l'immagine quadrata, così il prodotto non resta piccolo in mezzo a
+#     un'imbottitura già presente nell'originale
+
+OPAQUE_ALPHA = 255   # Alpha di un pixel completamente opaco
+WHITE_LEVEL = 245    # Un pixel con tutti i canali >= WHITE_LEVEL è considerato bianco
+
+
+def _alpha_channel(img):
+    """Canale alpha come matrice numpy, None se l'immagine non ne ha."""
+    if img.mode in ('RGBA', 'LA'):
+        return np.asarray(img.getchannel('A'))
+    if img.mode == 'PA' or (img.mode == 'P' and 'transparency' in img.info):
+        return np.asarray(img.convert('RGBA').getchannel('A'))
+    return None
+
+
+def _content_bbox(mask):
+    """Riquadro (left, upper, right, lower) dei valori True della maschera, None se è vuota."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def analyze_image(img, trim_white=False):
+    """
+    Analizza i pixel di un'immagine (viene decodificata).
+    Ritorna (ha_trasparenza, riquadro): ha_trasparenza è True solo se almeno un
+    pixel non è opaco; riquadro è il (left, upper, right, lower) del contenuto
+    senza bordi trasparenti (e quasi bianchi con trim_white), None se non c'è
+    niente da tagliare o se l'immagine è vuota.
+    """
+    alpha = _alpha_channel(img)
+    has_transparency = alpha is not None and alpha.min() < OPAQUE_ALPHA
+
+    content = alpha > 0 if has_transparency else None
+    if trim_white:
+        rgb = np.asarray(img.convert('RGB'))
+        not_white = (rgb < WHITE_LEVEL).any(axis=2)
+        content = not_white if content is None else content & not_white
+    if content is None:
+        return has_transparency, None
+
+    bbox = _content_bbox(content)
+    if bbox == (0, 0, img.width, img.height):
+        bbox = None
+    return has_transparency, bbox
+
+
+def add_analysis_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni sull'analisi dei pixel."""
+    parser.add_argument("--trim-white", action="store_true", help=f"Taglia anche i bordi quasi bianchi (canali >= {WHITE_LEVEL}) prima di rendere quadrata l'immagine")
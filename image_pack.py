@@ -0,0 +1,14 @@
+from pipeline.pack import main
+
+# ==============================================================================
+# PACCHETTI DI IMMAGINI PER CATALOGO
+# ==============================================================================
+# Elenca, crea, estrae e serve via HTTP i pacchetti <cartella>.pack scritti
+# dalla pipeline con --pack (vedi pipeline/pack.py).
+#
+#   python image_pack.py list Marchio.pack
+#   python image_pack.py extract Marchio.pack destinazione/
+#   python image_pack.py serve *.pack --port 8080
+
+if __name__ == "__main__":
+    main()
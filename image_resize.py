@@ -0,0 +1,80 @@
+import os
+import argparse
+from PIL import Image
+
+# ==============================================================================
+# RIDUZIONE DELLE IMMAGINI GRANDI (--max-size)
+# ==============================================================================
+# Le immagini dei fornitori arrivano spesso a 3000-6000 px, ma vengono usate
+# come miniature prodotto. Con --max-size l'immagine viene ridotta subito dopo
+# l'apertura, prima di qualsiasi conversione o aggiunta di bordi:
+#   - i JPEG vengono decodificati direttamente a scala ridotta (draft mode:
+#     1/2, 1/4 o 1/8 della risoluzione), senza mai allocare l'immagine intera
+#   - gli altri formati vengono rimpiccioliti con Image.reduce (media a blocchi,
+#     molto economica) fino a circa REDUCING_GAP volte la dimensione finale
+#   - il ricampionamento finale (LANCZOS) lavora quindi su un'immagine piccola
+# Così anche la tela quadrata di square_image è al massimo max_size x max_size.
+#
+# Con --variants (vedi pipeline/transforms.py) dalla stessa immagine decodificata
+# vengono ricavate anche le versioni ridotte (es. 1200, 600, 200 px), ognuna
+# dalla precedente: ogni riduzione lavora sull'immagine più piccola disponibile.
+
+REDUCING_GAP = 2.0   # Image.reduce si ferma a ~2x la dimensione finale, poi LANCZOS
+
+
+def reduce_image(img, max_size):
+    """
+    Riduce un'immagine appena aperta (non ancora decodificata) in modo che il
+    lato lungo non superi `max_size`, mantenendo le proporzioni.
+    Ritorna l'immagine ridotta, o quella originale se è già abbastanza piccola
+    o se max_size è None/0.
+    """
+    if not max_size or max(img.size) <= max_size:
+        return img
+    if img.mode == 'P':
+        # Il ricampionamento di una palette sarebbe solo nearest-neighbour
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    # thumbnail usa draft() per i JPEG e reduce() prima di LANCZOS (reducing_gap)
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+
+def iter_variants(img, sizes):
+    """
+    Genera le coppie (lato, immagine) delle varianti ridotte di un'immagine già
+    decodificata, dalla più grande alla più piccola, ognuna ricavata dalla
+    precedente. Le immagini più piccole di una variante non vengono ingrandite.
+    """
+    current = img
+    for size in sorted(sizes, reverse=True):
+        if max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        yield size, current
+
+
+def variant_filename(filename, size):
+    """Nome del file della variante `size` (es. prodotto.webp -> prodotto_600.webp)."""
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}_{size}{extension}"
+
+
+def parse_sizes(value):
+    """Tipo argparse per una lista di lati separati da virgola ("1200,600,200")."""
+    try:
+        sizes = {int(part) for part in value.split(',') if part.strip()}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"lista di dimensioni non valida: {value!r}")
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError(f"lista di dimensioni non valida: {value!r}")
+    return tuple(sorted(sizes, reverse=True))
+
+
+def add_resize_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni sulla dimensione delle immagini."""
+    parser.add_argument("--max-size", type=int, help="Lato massimo in pixel delle immagini prodotte; le immagini più grandi vengono ridotte già in decodifica (default: dimensione originale)")
+
+
+def add_variant_arguments(parser):
+    """Aggiunge al parser argparse l'opzione delle varianti ridotte."""
+    parser.add_argument("--variants", type=parse_sizes, default=(), help="Lati in pixel delle varianti ridotte da produrre oltre all'originale, separati da virgola (es. 1200,600,200)")
@@ -0,0 +1,199 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+# ==============================================================================
+# JOURNAL DEI DOWNLOAD (--journal / --resume)
+# ==============================================================================
+# Ogni immagine elaborata viene aggiunta a un journal SQLite (solo INSERT, mai
+# UPDATE) con CSV, nome, URL, esito, file prodotto e hash SHA-256 del file.
+# Con --resume un nuovo run salta le immagini il cui ultimo esito è 'done' e il
+# cui file esiste ancora, e riprova solo quelle fallite o mai completate: non
+# serve più indovinare il numero di riga da passare a --continue-from.
+#
+# Le scritture sono raggruppate: il commit su disco avviene ogni BATCH_SIZE
+# voci o ogni FLUSH_INTERVAL secondi. Un'interruzione brusca perde al massimo
+# l'ultimo gruppo, che viene semplicemente rifatto al run successivo.
+#
+# Più processi (vedi pipeline/batch.py) scrivono ognuno nel proprio journal:
+# merge copia in un journal le voci di un altro, latest_outputs ricostruisce
+# dall'ultimo esito di ogni nome il file prodotto per un CSV.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = "download_journal.sqlite3"
+BATCH_SIZE = 50          # Voci per commit
+FLUSH_INTERVAL = 2.0     # Secondi massimi tra due commit
+
+
+def file_hash(path):
+    """Hash SHA-256 (esadecimale) del file indicato, None se non esiste."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class JobJournal:
+    """Journal append-only degli esiti per (CSV, nome, URL), condivisibile tra thread."""
+
+    def __init__(self, path=DEFAULT_JOURNAL, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                csv TEXT NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL,
+                output TEXT,
+                sha256 TEXT,
+                recorded REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS journal_job ON journal (csv, name, url);
+        """)
+        self._db.commit()
+
+    @staticmethod
+    def _csv_key(csv_file):
+        # Lo stesso CSV deve avere la stessa chiave qualunque sia la cartella di lancio
+        return os.path.abspath(csv_file)
+
+    def completed(self, csv_file, name, url, save_path):
+        """
+        Ritorna il file prodotto per (CSV, nome, URL) se l'ultimo esito registrato
+        è 'done' e il file è ancora presente in save_path, altrimenti None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, output FROM journal WHERE csv = ? AND name = ? AND url = ? ORDER BY id DESC LIMIT 1",
+                (self._csv_key(csv_file), name, url)
+            ).fetchone()
+        if row is None or row[0] != 'done' or not row[1]:
+            return None
+        if not os.path.exists(os.path.join(save_path, row[1])):
+            return None
+        return row[1]
+
+    def record(self, csv_file, name, url, save_path, output):
+        """Aggiunge l'esito di un'immagine: 'done' con il file prodotto, 'failed' se output è None."""
+        status = 'done' if output else 'failed'
+        sha256 = file_hash(os.path.join(save_path, output)) if output else None
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO journal (csv, name, url, status, output, sha256, recorded) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._csv_key(csv_file), name, url, status, output, sha256, time.time())
+            )
+            self._pending += 1
+            now = time.monotonic()
+            if self._pending >= self.batch_size or now - self._last_commit >= self.flush_interval:
+                self._commit(now)
+
+    def merge(self, source_path, since=None, csv_files=None):
+        """
+        Aggiunge le voci del journal `source_path`, nel loro ordine: solo quelle
+        registrate da `since` (timestamp) in poi e dei `csv_files`, se indicati.
+        Ritorna il numero di voci copiate.
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("recorded >= ?")
+            params.append(since)
+        if csv_files is not None:
+            keys = [self._csv_key(csv_file) for csv_file in csv_files]
+            conditions.append(f"csv IN ({', '.join('?' * len(keys))})")
+            params.extend(keys)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            self._commit(time.monotonic())
+            self._db.execute("ATTACH DATABASE ? AS source", (source_path,))
+            try:
+                copied = self._db.execute(
+                    "INSERT INTO journal (csv, name, url, status, output, sha256, recorded) "
+                    f"SELECT csv, name, url, status, output, sha256, recorded FROM source.journal {where} ORDER BY id",
+                    params
+                ).rowcount
+                self._db.commit()
+            finally:
+                self._db.execute("DETACH DATABASE source")
+        return copied
+
+    def latest_outputs(self, csv_file, since=None):
+        """
+        Ultimo esito di ogni nome del CSV: {nome: file prodotto, None se l'ultimo
+        tentativo è fallito}, solo tra le voci registrate da `since` in poi se indicato.
+        """
+        with self._lock:
+            self._commit(time.monotonic())
+            rows = self._db.execute(
+                "SELECT name, status, output FROM journal WHERE csv = ? AND recorded >= ? ORDER BY id",
+                (self._csv_key(csv_file), since or 0)
+            ).fetchall()
+        return {name: output if status == 'done' else None for name, status, output in rows}
+
+    def _commit(self, now):
+        self._db.commit()
+        self._pending = 0
+        self._last_commit = now
+
+    def close(self):
+        with self._lock:
+            self._commit(time.monotonic())
+            self._db.close()
+
+
+def journaled(journal, csv_file, name, url, save_path, fn):
+    """
+    Avvolge fn (che ritorna il file prodotto, None o un Future del file) in modo
+    che ogni immagine completata venga registrata dal worker stesso, appena pronta.
+    I fallimenti vanno registrati da chi raccoglie i risultati (con output None):
+    alcuni, come i download falliti del motore asincrono, non passano da fn.
+    """
+    if journal is None:
+        return fn
+
+    def record(output):
+        if output:
+            journal.record(csv_file, name, url, save_path, output)
+
+    def record_future(done):
+        if not done.cancelled() and done.exception() is None:
+            record(done.result())
+
+    def run(*args, **kwargs):
+        output = fn(*args, **kwargs)
+        if isinstance(output, Future):
+            # Conversione ancora in corso nello stadio CPU
+            output.add_done_callback(record_future)
+        else:
+            record(output)
+        return output
+
+    return run
+
+
+def add_journal_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni del journal."""
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, help=f"File SQLite in cui registrare l'esito di ogni immagine (default: {DEFAULT_JOURNAL})")
+    parser.add_argument("--resume", action="store_true", help="Salta le immagini già completate secondo il journal e riprova solo le altre")
+
+
+def journal_from_args(args):
+    """Crea il JobJournal dalle opzioni di add_journal_arguments."""
+    return JobJournal(args.journal)
@@ -0,0 +1,81 @@
+from PIL import features
+
+# ==============================================================================
+# FORMATO DI OUTPUT DELLE IMMAGINI (--alpha-format)
+# ==============================================================================
+# Le immagini senza trasparenza vengono sempre salvate in WebP lossy. Per quelle
+# con trasparenza il formato si sceglie con --alpha-format:
+#   - png  : PNG ottimizzato (default, compatibile con i CSV già pubblicati);
+#            è di gran lunga la codifica più lenta e produce i file più pesanti
+#   - webp : WebP lossy con canale alpha (alpha_quality regola la qualità
+#            dell'alpha, --lossless-alpha salva l'intera immagine lossless)
+#   - avif : AVIF con canale alpha, se Pillow è compilato con libavif
+# `method` (0-6) è il compromesso velocità/dimensione dell'encoder WebP: 0 è il
+# più veloce, 6 il più compatto. I numeri di confronto si ottengono con
+# benchmark_formats.py sulle immagini di un catalogo.
+
+ALPHA_FORMATS = ('png', 'webp', 'avif')
+DEFAULT_QUALITY = 85
+DEFAULT_WEBP_METHOD = 4        # Default di libwebp
+DEFAULT_ALPHA_QUALITY = 100
+DEFAULT_AVIF_SPEED = 6         # Default di libavif (0 = più lento e compatto, 10 = più veloce)
+
+
+class OutputFormats:
+    """
+    Politica di salvataggio: per ogni immagine ritorna estensione, formato PIL e
+    opzioni dell'encoder in base alla trasparenza. È serializzabile, quindi può
+    essere passata ai processi dello stadio di conversione.
+    """
+
+    def __init__(self, alpha_format='png', quality=DEFAULT_QUALITY, webp_method=DEFAULT_WEBP_METHOD,
+                 alpha_quality=DEFAULT_ALPHA_QUALITY, lossless_alpha=False, avif_speed=DEFAULT_AVIF_SPEED):
+        if alpha_format not in ALPHA_FORMATS:
+            raise ValueError(f"Formato per la trasparenza non valido: {alpha_format}")
+        if alpha_format == 'avif' and not features.check('avif'):
+            raise ValueError("Pillow non supporta AVIF in questa installazione")
+        self.alpha_format = alpha_format
+        self.quality = quality
+        self.webp_method = webp_method
+        self.alpha_quality = alpha_quality
+        self.lossless_alpha = lossless_alpha
+        self.avif_speed = avif_speed
+
+    def for_image(self, has_transparency):
+        """Ritorna (estensione, formato PIL, opzioni di salvataggio) per un'immagine."""
+        webp_options = {"quality": self.quality, "method": self.webp_method}
+        if not has_transparency:
+            return ".webp", "WEBP", webp_options
+        if self.alpha_format == 'webp':
+            if self.lossless_alpha:
+                return ".webp", "WEBP", {"lossless": True, "quality": self.quality, "method": self.webp_method}
+            return ".webp", "WEBP", {**webp_options, "alpha_quality": self.alpha_quality}
+        if self.alpha_format == 'avif':
+            return ".avif", "AVIF", {"quality": self.quality, "speed": self.avif_speed}
+        return ".png", "PNG", {"optimize": True}
+
+    def extensions(self, may_have_transparency):
+        """Estensioni possibili dell'output di un'immagine, prima di analizzarne i pixel."""
+        candidates = [True, False] if may_have_transparency else [False]
+        return list(dict.fromkeys(self.for_image(has_transparency)[0] for has_transparency in candidates))
+
+
+def available_alpha_formats():
+    """Formati per la trasparenza supportati dall'installazione di Pillow."""
+    return tuple(name for name in ALPHA_FORMATS if name != 'avif' or features.check('avif'))
+
+
+def add_output_format_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni sul formato di output."""
+    parser.add_argument("--alpha-format", choices=available_alpha_formats(), default='png', help="Formato delle immagini con trasparenza (default: png)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help=f"Qualità WebP/AVIF, 0-100 (default: {DEFAULT_QUALITY})")
+    parser.add_argument("--webp-method", type=int, choices=range(7), default=DEFAULT_WEBP_METHOD, metavar="0-6", help=f"Compromesso velocità/dimensione dell'encoder WebP, 0 = più veloce (default: {DEFAULT_WEBP_METHOD})")
+    parser.add_argument("--alpha-quality", type=int, default=DEFAULT_ALPHA_QUALITY, help=f"Con --alpha-format webp, qualità del canale alpha, 0-100 (default: {DEFAULT_ALPHA_QUALITY})")
+    parser.add_argument("--lossless-alpha", action="store_true", help="Con --alpha-format webp, salva le immagini con trasparenza in WebP lossless")
+    parser.add_argument("--avif-speed", type=int, choices=range(11), default=DEFAULT_AVIF_SPEED, metavar="0-10", help=f"Con --alpha-format avif, velocità dell'encoder (default: {DEFAULT_AVIF_SPEED})")
+
+
+def output_formats_from_args(args):
+    """Crea la politica OutputFormats dalle opzioni di add_output_format_arguments."""
+    return OutputFormats(args.alpha_format, args.quality, args.webp_method, args.alpha_quality,
+                         args.lossless_alpha, args.avif_speed)
@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+from PIL import Image
+
+# ==============================================================================
+# INDICE DEGLI HASH PERCETTIVI (--phash-index)
+# ==============================================================================
+# Molti cataloghi usano la stessa foto per decine di articoli, con URL diversi
+# e byte leggermente diversi (ricompressioni, metadati, ridimensionamenti): il
+# confronto per SHA-256 non le riconosce. Per ogni immagine convertita viene
+# calcolato un dHash (differenze di luminosità tra pixel adiacenti di una
+# miniatura HASH_SIZE+1 x HASH_SIZE, HASH_SIZE² bit) e salvato in un indice
+# SQLite per cartella, insieme al colore medio: il dHash ignora colore e
+# luminosità assoluti, quindi due tinte unite diverse (campioni di colore,
+# segnaposto) avrebbero lo stesso hash. Un'immagine il cui hash dista al
+# massimo `max_distance` bit da uno già presente, con colore medio entro
+# COLOR_TOLERANCE, non viene convertita: la riga del CSV punta al file
+# esistente, quindi ogni foto viene codificata e pubblicata una sola volta.
+#
+# L'indice è condiviso tra thread e anche con i processi dello stadio di
+# conversione: ogni processo tiene in memoria gli hash letti e a ogni ricerca
+# carica solo le voci aggiunte dopo l'ultima lettura.
+
+DEFAULT_INDEX = "phash_index.sqlite3"
+HASH_SIZE = 16              # Hash da 16x16 = 256 bit
+DEFAULT_MAX_DISTANCE = 8    # Bit diversi ammessi tra due immagini "uguali"
+COLOR_TOLERANCE = 12        # Differenza massima (0-255) per canale del colore medio
+
+
+def perceptual_hash(img, hash_size=HASH_SIZE):
+    """
+    Impronta di un'immagine aperta: array numpy di byte con il dHash
+    (hash_size² bit) seguito dal colore medio RGB. Le parti trasparenti
+    contano come bianco, così un PNG scontornato e lo stesso prodotto su
+    sfondo bianco hanno la stessa impronta.
+    """
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    thumb = img.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR, reducing_gap=2.0).convert('RGBA')
+    white = Image.new('RGBA', thumb.size, (255, 255, 255, 255))
+    rgb = Image.alpha_composite(white, thumb).convert('RGB')
+    pixels = np.asarray(rgb.convert('L'), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    mean_color = np.asarray(rgb).reshape(-1, 3).mean(axis=0).round().astype(np.uint8)
+    return np.concatenate([bits, mean_color])
+
+
+def _split(phash):
+    """Separa un'impronta (o una matrice di impronte) in bit del dHash (uint64) e colore medio."""
+    return phash[..., :-3].view(np.uint64), phash[..., -3:].astype(np.int16)
+
+
+class _FolderHashes:
+    """Impronte note di una cartella: file prodotto -> impronta, con le matrici per la ricerca."""
+
+    def __init__(self):
+        self.by_output = {}
+        self._outputs = None
+        self._bits = None
+        self._colors = None
+
+    def set(self, output, phash):
+        self.by_output[output] = phash
+        self._bits = None
+
+    def distances(self, phash):
+        """
+        Ritorna (file, distanze in bit) per tutti i file della cartella; i file
+        con un colore medio troppo diverso hanno distanza infinita.
+        """
+        if self._bits is None:
+            self._outputs = list(self.by_output)
+            self._bits, self._colors = _split(np.stack([self.by_output[output] for output in self._outputs]))
+        bits, color = _split(phash)
+        distances = np.bitwise_count(self._bits ^ bits).sum(axis=1).astype(float)
+        distances[np.abs(self._colors - color).max(axis=1) > COLOR_TOLERANCE] = np.inf
+        return self._outputs, distances
+
+
+class PerceptualIndex:
+    """Indice SQLite persistente degli hash percettivi dei file prodotti, per cartella."""
+
+    def __init__(self, path=DEFAULT_INDEX, max_distance=DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._folders = {}
+        self._last_id = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS phash (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                folder TEXT NOT NULL,
+                output TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                recorded REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def __reduce__(self):
+        # Nei processi di conversione l'indice viene riaperto una volta sola per processo
+        return _shared_index, (self.path, self.max_distance)
+
+    @staticmethod
+    def _folder_key(folder):
+        return os.path.abspath(folder)
+
+    def _refresh(self):
+        """Carica le voci aggiunte (anche da altri processi) dopo l'ultima lettura."""
+        rows = self._db.execute(
+            "SELECT id, folder, output, hash FROM phash WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for row_id, folder, output, phash in rows:
+            self._folders.setdefault(folder, _FolderHashes()).set(output, np.frombuffer(phash, dtype=np.uint8))
+            self._last_id = row_id
+
+    def find(self, phash, folder, exclude=()):
+        """
+        Ritorna il file esistente in `folder` più simile all'hash indicato, se
+        dista al massimo max_distance bit, altrimenti None. I file in `exclude`
+        vengono ignorati.
+        """
+        with self._lock:
+            self._refresh()
+            hashes = self._folders.get(self._folder_key(folder))
+            if hashes is None:
+                return None
+            outputs, distances = hashes.distances(phash)
+        for position in np.argsort(distances, kind='stable'):
+            if distances[position] > self.max_distance:
+                break
+            output = outputs[position]
+            if output not in exclude and os.path.exists(os.path.join(folder, output)):
+                return output
+        return None
+
+    def add(self, phash, folder, output):
+        """Registra l'hash del file prodotto in `folder` (sostituisce quello precedente dello stesso file)."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO phash (folder, output, hash, recorded) VALUES (?, ?, ?, ?)",
+                (self._folder_key(folder), output, phash.tobytes(), time.time())
+            )
+            # Commit immediato: la voce deve essere visibile subito agli altri processi
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_shared_indexes = {}
+
+
+def _shared_index(path, max_distance):
+    """Un solo PerceptualIndex per processo e per file (usato da __reduce__)."""
+    key = (path, max_distance)
+    if key not in _shared_indexes:
+        _shared_indexes[key] = PerceptualIndex(path, max_distance)
+    return _shared_indexes[key]
+
+
+def add_phash_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni dell'indice degli hash percettivi."""
+    parser.add_argument("--phash-index", help=f"File SQLite degli hash percettivi: le immagini quasi identiche a una già convertita puntano al file esistente (es. {DEFAULT_INDEX})")
+    parser.add_argument("--phash-distance", type=int, default=DEFAULT_MAX_DISTANCE, help=f"Bit diversi (su {HASH_SIZE * HASH_SIZE}) entro cui due immagini sono considerate uguali (default: {DEFAULT_MAX_DISTANCE})")
+
+
+def phash_index_from_args(args):
+    """Crea il PerceptualIndex dalle opzioni di add_phash_arguments (None se --phash-index non è indicato)."""
+    if not args.phash_index:
+        return None
+    return PerceptualIndex(args.phash_index, args.phash_distance)
@@ -0,0 +1,32 @@
+# ==============================================================================
+# PIPELINE UNIFICATA: FETCHER -> TRASFORMAZIONE -> SINK
+# ==============================================================================
+# Un'unica implementazione di lettura dei CSV, download, conversione e
+# scrittura dei _local.csv per tutti gli script download_*.py, che ora sono
+# preset (vedi presets.py). Gli stadi sono intercambiabili:
+#   - fetchers.py    : requests / httpx / async, stessa politica di retry
+#   - scheduler.py   : code per host davanti al fetcher (--host-scheduler)
+#   - transforms.py  : conversione, bordi quadrati, riduzione, varianti
+#   - conversion.py  : cache, contenuti già convertiti, pool di processi
+#   - sinks.py       : dove vengono salvate le immagini
+#   - pack.py        : pacchetti con indice per catalogo (--pack), estrazione e server
+#   - runner.py      : CSV in blocco o in streaming, deduplica degli URL
+#   - batch.py       : cataloghi interi su più processi (download_batch.py)
+#   - naming.py      : nomi dei file e URL delle righe
+#   - metrics.py     : tempi per stadio e contatori per host (--metrics-report)
+#   - metrics_server.py : metriche live in formato Prometheus (--metrics-port)
+# Un miglioramento a uno stadio vale per tutti i preset.
+
+from pipeline.cli import build_parser, main, run
+from pipeline.conversion import ContentIndex, ConversionStage, Converter
+from pipeline.fetchers import (FETCHERS, AsyncFetcher, HttpxFetcher, RequestsFetcher, SharedHttpClient,
+                               create_fetcher, create_session)
+from pipeline.metrics import ImageMetrics, RunMetrics
+from pipeline.metrics_server import MetricsServer, prometheus_text
+from pipeline.naming import NAMING_RULES, clean_filename, normalize_url, task_of
+from pipeline.pack import PackReader, extract_pack, pack_folder
+from pipeline.presets import PRESETS
+from pipeline.runner import process_csvs, process_csvs_streaming
+from pipeline.scheduler import HostScheduler
+from pipeline.sinks import FolderSink, PackSink
+from pipeline.transforms import ImageTransform, square_image
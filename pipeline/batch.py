@@ -0,0 +1,244 @@
+import os
+import csv
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+from job_journal import JobJournal
+from pipeline.cli import build_parser, configure_logging, preset_from_argv, run
+from pipeline.metrics import RunMetrics
+from pipeline.presets import CPU_WORKERS, DEFAULT_PRESET, PRESETS
+from pipeline.runner import create_updated_csv
+from pipeline.sinks import FolderSink, sink_factory_from_args
+
+# ==============================================================================
+# BATCH DI CATALOGHI SU PIÙ PROCESSI (download_batch.py)
+# ==============================================================================
+# Per risincronizzare tutti i cataloghi dei marchi in un colpo solo:
+#   python download_batch.py cataloghi/ [elenco.txt ...] --processes 4 [opzioni della pipeline]
+# Gli argomenti sono cartelle (tutti i .csv che contengono), elenchi di CSV
+# (un percorso per riga, relativo all'elenco; '#' per i commenti) o CSV.
+# Ogni processo esegue la pipeline completa (fetcher e connessioni, scheduler,
+# stadio di conversione con --cpu-workers diviso tra i processi) su una parte
+# del lavoro:
+#   --shard-by csv  (default) ogni processo riceve CSV interi, bilanciati per
+#                   dimensione, e scrive i loro _local.csv come farebbe il run
+#                   in un solo processo
+#   --shard-by url  ogni processo scarica solo gli URL del suo shard (hash
+#                   dell'URL normalizzato, vedi url_shard): lo stesso host viene
+#                   servito da tutti i processi e un URL in comune a più CSV
+#                   resta in un solo processo. I _local.csv vengono ricostruiti
+#                   alla fine dal journal unito
+# Ogni processo ha il suo journal, il suo report delle metriche e il suo elenco
+# di fallimenti: a fine run vengono uniti in --journal, --metrics-report e
+# --failed-downloads. Con --metrics-port il processo k espone le sue metriche
+# su porta + k. I limiti di --rate/--burst valgono per processo.
+#
+# Su più macchine (stessa cartella di lavoro e stessi CSV) con --shard K/M la
+# macchina K scarica solo gli URL del suo shard, diviso poi tra i suoi
+# processi; copiati cartelle delle immagini e journal delle altre macchine,
+#   python download_batch.py cataloghi/ --merge-journal journal_macchina_1.sqlite3
+# unisce i journal e ricostruisce i _local.csv completi senza scaricare niente.
+
+logger = logging.getLogger(__name__)
+
+SHARD_BY = ('csv', 'url')
+
+
+def discover_csvs(sources):
+    """CSV da processare: quelli delle cartelle, degli elenchi e quelli indicati direttamente, senza ripetizioni."""
+    csv_files = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            csv_files.extend(str(csv_file) for csv_file in sorted(path.glob('*.csv'))
+                             if not csv_file.stem.endswith('_local'))
+        elif path.suffix.lower() == '.csv':
+            csv_files.append(str(path))
+        else:
+            with open(path, 'r', encoding='utf-8') as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        csv_files.append(str(path.parent / line))
+    return list(dict.fromkeys(csv_files))
+
+
+def partition_csvs(csv_files, processes):
+    """Divide i CSV in al massimo `processes` gruppi di dimensione simile (i più grandi per primi, al gruppo più leggero)."""
+    groups = [[] for _ in range(min(processes, len(csv_files)))]
+    loads = [0] * len(groups)
+    sizes = {csv_file: os.path.getsize(csv_file) if os.path.exists(csv_file) else 0 for csv_file in csv_files}
+    for csv_file in sorted(csv_files, key=lambda csv_file: -sizes[csv_file]):
+        lightest = loads.index(min(loads))
+        groups[lightest].append(csv_file)
+        loads[lightest] += sizes[csv_file]
+    # Dentro ogni gruppo i CSV restano nell'ordine indicato
+    order = {csv_file: position for position, csv_file in enumerate(csv_files)}
+    return [sorted(group, key=order.get) for group in groups]
+
+
+def parse_shard(value):
+    """Converte 'K/M' (0 <= K < M) nella coppia (K, M)."""
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"Shard non valido: {value}")
+    return index, count
+
+
+def process_shards(machine, processes):
+    """Shard degli URL dei `processes` processi della macchina `machine` (K, M): insieme coprono esattamente il suo shard."""
+    # Lo shard K/M è diviso tra i processi senza dipendere dal loro numero: gli URL con
+    # url_shard(url, M * P) == K + M * k sono esattamente quelli con url_shard(url, M) == K, per ogni P
+    index, count = machine
+    return [(index + count * k, count * processes) for k in range(processes)]
+
+
+def _run_shard(args, log_file, label, shard, update_csvs, seed_journal, image_metrics):
+    # Punto di ingresso di un processo del batch (avviato con spawn: stato pulito)
+    configure_logging(log_file, label)
+    if seed_journal:
+        # Con --resume il journal del processo parte dalle voci dei suoi CSV nel journal principale
+        journal = JobJournal(args.journal)
+        journal.merge(seed_journal, csv_files=args.csv_files)
+        journal.close()
+    run(args, shard, update_csvs, image_metrics)
+
+
+def rebuild_local_csvs(journal, csv_files, naming='strict', variants=(), since=None, sink_factory=FolderSink):
+    """
+    Riscrive i _local.csv dall'ultimo esito di ogni riga nel journal (registrato
+    da `since` in poi). Il sink di ogni catalogo viene chiuso prima: con --pack
+    il pacchetto comprende anche le immagini copiate dalle altre macchine.
+    """
+    for csv_file in csv_files:
+        if not os.path.exists(csv_file):
+            continue
+        results = {name: output for name, output in journal.latest_outputs(csv_file, since).items() if output}
+        sink = sink_factory(Path(csv_file).stem)
+        sink.close()
+        create_updated_csv(csv_file, sink.public_name, results, naming, variants)
+
+
+def _merge_failed_downloads(paths, destination):
+    rows = []
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                rows.extend(list(csv.reader(f))[1:])
+    if not rows:
+        return
+    with open(destination, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["CSV", "Num", "Name", "URL"])
+        writer.writerows(rows)
+    logger.warning(f"Download falliti in tutti i processi: {len(rows)} (elencati in '{destination}')")
+
+
+def run_batch(args, log_file):
+    """Esegue il batch (vedi l'intestazione del modulo) con le opzioni di build_batch_parser."""
+    csv_files = discover_csvs(args.csv_files)
+    if not csv_files:
+        logger.error("Nessun CSV trovato.")
+        return
+    journal = JobJournal(args.journal)
+
+    if args.merge_journal:
+        for path in args.merge_journal:
+            logger.info(f"Unione del journal {path}: {journal.merge(path)} voci")
+        rebuild_local_csvs(journal, csv_files, args.naming, args.variants, sink_factory=sink_factory_from_args(args))
+        journal.close()
+        return
+
+    machine = parse_shard(args.shard) if args.shard else (0, 1)
+    by_url = args.shard_by == 'url' or args.shard is not None
+    if by_url and args.stream:
+        logger.warning("Con gli shard per URL i CSV vengono letti in blocco: --stream ignorato")
+        args.stream = False
+    if by_url:
+        groups = [csv_files] * args.processes
+        shards = process_shards(machine, args.processes)
+    else:
+        groups = partition_csvs(csv_files, args.processes)
+        shards = [None] * len(groups)
+    logger.info(f"Batch: {len(csv_files)} CSV su {len(groups)} processi (shard per {'URL' if by_url else 'CSV'})")
+
+    start = time.time()
+    work_dir = tempfile.mkdtemp(prefix='batch-', dir='.')
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for k, (group, shard) in enumerate(zip(groups, shards)):
+        shard_args = type(args)(**vars(args))
+        shard_args.csv_files = group
+        shard_args.journal = os.path.join(work_dir, f"journal.{k}.sqlite3")
+        shard_args.metrics_report = os.path.join(work_dir, f"metrics.{k}.json")
+        shard_args.failed_downloads = os.path.join(work_dir, f"failed.{k}.txt")
+        shard_args.metrics_port = args.metrics_port + k if args.metrics_port is not None else None
+        shard_args.cpu_workers = max(1, args.cpu_workers // len(groups)) if args.cpu_workers else 0
+        seed_journal = args.journal if args.resume and os.path.exists(args.journal) else None
+        process = context.Process(target=_run_shard, name=f"shard-{k + 1}",
+                                  args=(shard_args, log_file, f"processo {k + 1}/{len(groups)}", shard, not by_url,
+                                        seed_journal, args.metrics_report is not None))
+        process.start()
+        processes.append((process, shard_args))
+
+    # Il report di ogni processo ha le singole immagini solo se servono al report finale, altrimenti gli aggregati
+    metrics = RunMetrics(keep_images=args.metrics_report is not None)
+    for process, shard_args in processes:
+        process.join()
+        if process.exitcode:
+            logger.error(f"Il {process.name} è terminato con codice {process.exitcode}")
+        # Le voci registrate dal processo (anche se interrotto) finiscono nel journal principale
+        if os.path.exists(shard_args.journal):
+            journal.merge(shard_args.journal, since=start)
+        if os.path.exists(shard_args.metrics_report):
+            metrics.merge_report(shard_args.metrics_report)
+    _merge_failed_downloads([shard_args.failed_downloads for _, shard_args in processes], args.failed_downloads)
+
+    if by_url:
+        # Con --resume valgono anche le immagini completate nei run precedenti (e quindi non registrate ora)
+        rebuild_local_csvs(journal, csv_files, args.naming, args.variants, None if args.resume else start,
+                           sink_factory_from_args(args))
+    journal.close()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    metrics.log_summary()
+    if args.metrics_report:
+        metrics.write_report(args.metrics_report)
+    logger.info(f"\nBatch completato in {time.time() - start:.2f} secondi.")
+
+
+def build_batch_parser(preset=DEFAULT_PRESET):
+    """Parser della pipeline con le opzioni del batch; gli argomenti posizionali sono cartelle, elenchi o CSV."""
+    parser = build_parser(preset)
+    parser.description = "Processa cataloghi interi (cartelle o elenchi di CSV) su più processi"
+    parser.add_argument("--processes", type=int, default=CPU_WORKERS, help=f"Numero di processi della pipeline (default: numero di core, {CPU_WORKERS})")
+    parser.add_argument("--shard-by", choices=SHARD_BY, default='csv', help="Divisione del lavoro tra i processi: CSV interi o hash dell'URL (default: csv)")
+    parser.add_argument("--shard", help="Con più macchine, 'K/M': questa macchina (0-based) scarica solo gli URL del suo shard (implica --shard-by url)")
+    parser.add_argument("--merge-journal", action="append", help="Unisce il journal indicato (di un'altra macchina) a --journal e ricostruisce i _local.csv, senza scaricare")
+    return parser
+
+
+def main(argv=None, preset=DEFAULT_PRESET):
+    """Punto di ingresso di download_batch.py."""
+    preset = preset_from_argv(argv, preset)
+    parser = build_batch_parser(preset)
+    args = parser.parse_args(argv)
+    if args.continue_from:
+        parser.error("--continue-from non è supportato dal batch: usare --resume")
+    if args.shard:
+        try:
+            parse_shard(args.shard)
+        except ValueError:
+            parser.error(f"--shard deve essere nella forma K/M con 0 <= K < M: {args.shard}")
+    log_file = PRESETS[preset]['log_file']
+    configure_logging(log_file)
+    run_batch(args, log_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import time
+import argparse
+import logging
+
+from body_reader import add_body_arguments
+from csv_stream import DEFAULT_WINDOW_PER_WORKER, add_stream_arguments
+from download_cache import add_cache_arguments, cache_from_args
+from job_journal import add_journal_arguments, journal_from_args
+from rate_limiter import add_rate_limit_arguments, rate_limiter_from_args
+from pipeline.conversion import Converter
+from pipeline.fetchers import add_fetcher_arguments, fetcher_from_args
+from pipeline.metrics import RunMetrics, add_metrics_arguments
+from pipeline.metrics_server import metrics_server_from_args
+from pipeline.naming import NAMING_RULES
+from pipeline.presets import CPU_WORKERS, DEFAULT_PRESET, PRESETS
+from pipeline.runner import FAILED_DOWNLOADS, process_csvs, process_csvs_streaming
+from pipeline.scheduler import add_scheduler_arguments, scheduler_from_args
+from pipeline.sinks import add_sink_arguments, sink_factory_from_args
+from pipeline.transforms import add_transform_arguments, transform_from_args
+
+# ==============================================================================
+# RIGA DI COMANDO DELLA PIPELINE
+# ==============================================================================
+#   python -m pipeline catalogo.csv [altro.csv ...] [--preset piu_bordi_png] [opzioni]
+# Gli script download_*.py chiamano main() con il loro preset.
+
+logger = logging.getLogger(__name__)
+
+# Chiavi dei preset che non sono opzioni della CLI
+_PRESET_SETTINGS = ('description', 'log_file')
+
+
+def configure_logging(log_file, label=None):
+    """Log su console e su `log_file`, come negli script storici; `label` distingue i processi del batch."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - {label} - %(levelname)s - %(message)s' if label else '%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def build_parser(preset=DEFAULT_PRESET):
+    """Parser argparse di tutte le opzioni della pipeline, con i default del preset indicato."""
+    settings = PRESETS[preset]
+    parser = argparse.ArgumentParser(description=settings['description'])
+    parser.add_argument("csv_files", nargs='+', help="Percorso/i del/i file CSV da processare.")
+    parser.add_argument("--preset", choices=PRESETS, default=preset, help=f"Valori di default delle opzioni (default: {preset})")
+    add_fetcher_arguments(parser)
+    parser.add_argument("--cpu-workers", type=int, default=CPU_WORKERS, help="Numero di processi dedicati alla conversione delle immagini, 0 per convertire nei worker di download (default: numero di core)")
+    parser.add_argument("--naming", choices=NAMING_RULES, default='strict', help="Regola per i nomi dei file: 'strict' tiene solo lettere, cifre, '_' e '-', 'legacy' sostituisce i caratteri non validi con '_'")
+    parser.add_argument("--continue-from", type=int, help="Numero dell'immagine (1-based) del primo CSV da cui riprendere il download (opzionale, meglio --resume)")
+    parser.add_argument("--failed-downloads", default=FAILED_DOWNLOADS, help=f"File in cui elencare le immagini fallite (default: {FAILED_DOWNLOADS})")
+    add_transform_arguments(parser)
+    add_sink_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_journal_arguments(parser)
+    add_body_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.set_defaults(**{key: value for key, value in settings.items() if key not in _PRESET_SETTINGS})
+    return parser
+
+
+def run(args, shard=None, update_csvs=True, image_metrics=None):
+    """
+    Esegue la pipeline con le opzioni già lette da build_parser. `shard`,
+    `update_csvs` e `image_metrics` servono ai processi del batch (vedi
+    process_csvs e pipeline/batch.py): le metriche delle singole immagini
+    vengono conservate solo se `image_metrics`, per default con --metrics-report.
+    """
+    rate_limiter = rate_limiter_from_args(args)
+    cache = cache_from_args(args)
+    journal = journal_from_args(args)
+    transform = transform_from_args(args)
+    sink_factory = sink_factory_from_args(args)
+    window = args.window or args.workers * DEFAULT_WINDOW_PER_WORKER
+    metrics = RunMetrics(keep_images=args.metrics_report is not None if image_metrics is None else image_metrics)
+    metrics_server = metrics_server_from_args(args, metrics)
+
+    start_time = time.time()
+    converter = Converter(transform, args.cpu_workers, cache)
+    try:
+        # Un solo fetcher (e quindi le stesse connessioni) per tutti i CSV del run
+        # Lo scheduler per host sta davanti al fetcher e lo chiude con sé
+        with scheduler_from_args(args, fetcher_from_args(args, rate_limiter, args.cpu_workers or None),
+                                 rate_limiter) as fetcher:
+            if args.stream:
+                process_csvs_streaming(args.csv_files, fetcher, converter, window, args.naming, journal,
+                                       args.resume, args.continue_from, metrics, args.image_deadline,
+                                       args.failed_downloads, sink_factory)
+            else:
+                # Tutti i CSV vengono pianificati insieme: gli URL in comune vengono scaricati una volta sola
+                process_csvs(args.csv_files, fetcher, converter, args.naming, journal, args.resume,
+                             args.continue_from, metrics, args.checkpoint_interval, shard, update_csvs,
+                             args.failed_downloads, sink_factory)
+    finally:
+        converter.shutdown()
+        if metrics_server is not None:
+            metrics_server.close()
+        journal.close()
+        if cache is not None:
+            cache.close()
+        if transform.phash_index is not None:
+            transform.phash_index.close()
+
+    metrics.log_summary()
+    if args.metrics_report:
+        metrics.write_report(args.metrics_report)
+    logger.info(f"\nProcesso completato in {time.time() - start_time:.2f} secondi.")
+
+
+def preset_from_argv(argv=None, preset=DEFAULT_PRESET):
+    """Preset indicato con --preset (o `preset`): cambia i default di tutte le altre opzioni, va letto prima del parser completo."""
+    preset_parser = argparse.ArgumentParser(add_help=False)
+    preset_parser.add_argument("--preset", choices=PRESETS, default=preset)
+    return preset_parser.parse_known_args(argv)[0].preset
+
+
+def main(argv=None, preset=DEFAULT_PRESET):
+    """Punto di ingresso della CLI; `preset` è il preset di default se --preset non è indicato."""
+    preset = preset_from_argv(argv, preset)
+    args = build_parser(preset).parse_args(argv)
+    configure_logging(PRESETS[preset]['log_file'])
+    run(args)
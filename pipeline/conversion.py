@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from download_cache import content_hash
+from pipeline.metrics import ImageMetrics
+
+# ==============================================================================
+# STADIO DI CONVERSIONE (--cpu-workers)
+# ==============================================================================
+# Converter collega fetcher e trasformazione: riceve le risposte 200/304 dal
+# fetcher, le fa passare dalla cache (GET condizionali), evita di riconvertire
+# contenuti già visti nel run (ContentIndex, per SHA-256) e lancia la
+# trasformazione. Con cpu_workers > 0 le trasformazioni girano in un pool di
+# processi (ConversionStage) mentre i worker di I/O continuano a scaricare;
+# con 0 girano nei worker stessi. I tempi degli stadi misurati nei processi
+# tornano indietro con il risultato e finiscono nell'ImageMetrics dell'immagine.
+
+logger = logging.getLogger(__name__)
+
+
+class ContentIndex:
+    """Hash del contenuto scaricato -> percorso del file già convertito, condiviso tra i worker."""
+
+    def __init__(self):
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def get(self, sha256):
+        with self._lock:
+            path = self._paths.get(sha256)
+        return path if path is not None and os.path.exists(path) else None
+
+    def add(self, sha256, path):
+        with self._lock:
+            self._paths.setdefault(sha256, path)
+
+
+class ConversionStage:
+    """
+    Stadio CPU della pipeline: le conversioni girano in un ProcessPoolExecutor
+    (un processo per core, senza contesa sul GIL) mentre i thread di I/O
+    continuano a scaricare. Tra i due stadi ci sono al massimo `max_pending`
+    conversioni in coda: quando la coda è piena i thread di I/O attendono
+    invece di accumulare immagini scaricate in memoria.
+    """
+
+    def __init__(self, cpu_workers, max_pending=None):
+        self.executor = ProcessPoolExecutor(max_workers=cpu_workers)
+        self._slots = threading.BoundedSemaphore(max_pending or cpu_workers * 2)
+        # I processi vengono creati (fork) al primo submit: lo facciamo subito,
+        # prima che esistano i thread dei fetcher, perché un fork mentre un altro
+        # thread tiene un lock (log, client HTTP) può bloccare il processo figlio
+        self.executor.submit(os.getpid).result()
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def _apply_in_stage(transform, submitted, content, sink, name, url, index, total):
+    """Esegue la trasformazione in un processo dello stadio; ritorna (nome del file, ImageMetrics della conversione)."""
+    metrics = ImageMetrics(url)
+    metrics.since('cpu_queue', submitted)
+    filename = transform.apply(content, sink, name, url, index, total, metrics)
+    return filename, metrics
+
+
+class Converter:
+    """
+    Gestione delle risposte scaricate: cache, contenuti già convertiti e
+    trasformazione (`transform`, vedi pipeline/transforms.py), inline oppure in
+    un ConversionStage di `cpu_workers` processi. Va chiuso con shutdown().
+    """
+
+    def __init__(self, transform, cpu_workers=0, cache=None):
+        self.transform = transform
+        self.cache = cache
+        self.content_index = ContentIndex()
+        self.stage = ConversionStage(cpu_workers) if cpu_workers else None
+
+    def handler(self, sink, name, url, index, total, entry=None, metrics=None):
+        """
+        Ritorna la funzione handle(status_code, headers, content) da passare al
+        fetcher per l'immagine `name`; `entry` è la voce di cache usata per gli
+        header condizionali della richiesta, `metrics` l'eventuale ImageMetrics
+        dell'immagine. handle ritorna il nome del file prodotto, oppure un
+        Future con il nome se la conversione è nello stadio CPU.
+        """
+        def handle(status_code, headers, content):
+            sha256 = None
+            overwrite = False
+            validators = headers
+            if self.cache is not None:
+                output, content, sha256, validators = self.cache.check_response(
+                    url, sink.folder, entry, status_code, headers, content
+                )
+                if output is not None:
+                    return output
+                # Immagine nuova o cambiata: va riconvertita anche se il file esiste
+                overwrite = True
+            return self.convert(content, sink, name, url, index, total, overwrite, validators, sha256, metrics)
+
+        return handle
+
+    def convert(self, content, sink, name, url, index, total, overwrite=False, validators=None, sha256=None,
+                metrics=None):
+        """
+        Converte un'immagine scaricata. Ritorna subito il nome del file se il
+        contenuto era già stato convertito, altrimenti il nome (o un Future con
+        il nome) del file prodotto dalla trasformazione, che sostituisce sempre
+        i file esistenti. `overwrite` (immagine nuova o cambiata) vale per il
+        collegamento di un contenuto già convertito. Indice dei contenuti e
+        cache vengono aggiornati nel processo principale.
+        """
+        sha256 = sha256 or content_hash(content)
+        linked_filename = self._link_known_content(sha256, sink, name, url, index, total, overwrite)
+        if linked_filename is not None:
+            self._converted(sha256, sink, url, validators, content, linked_filename)
+            return linked_filename
+
+        if self.stage is None:
+            filename = self.transform.apply(content, sink, name, url, index, total, metrics)
+            self._converted(sha256, sink, url, validators, content, filename)
+            return filename
+
+        # Anche l'attesa di uno slot libero nello stadio conta come coda di conversione
+        converted = self.stage.submit(_apply_in_stage, self.transform, time.perf_counter(), content, sink, name,
+                                      url, index, total)
+        future = Future()
+
+        def on_converted(done):
+            if done.cancelled():
+                future.cancel()
+                return
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+                return
+            filename, converted_metrics = done.result()
+            if metrics is not None:
+                metrics.merge(converted_metrics)
+            try:
+                self._converted(sha256, sink, url, validators, content, filename)
+            finally:
+                future.set_result(filename)
+
+        converted.add_done_callback(on_converted)
+        return future
+
+    def _link_known_content(self, sha256, sink, name, url, index, total, overwrite=False):
+        """
+        Se un file con lo stesso contenuto è già stato convertito lo collega come
+        `name` nel sink e ritorna il nuovo nome del file, altrimenti None.
+        """
+        existing_path = self.content_index.get(sha256)
+        if existing_path is None:
+            return None
+        # Stesso contenuto -> stessa trasparenza -> stessa estensione
+        filename = f"{name}{os.path.splitext(existing_path)[1]}"
+        sink.link(existing_path, filename, self.transform.variants, overwrite=overwrite)
+        logger.info(f"[{index}/{total}] Contenuto già convertito, collegato: {url} -> {sink.path(filename)}")
+        return filename
+
+    def _converted(self, sha256, sink, url, validators, content, filename):
+        if not filename:
+            return
+        self.content_index.add(sha256, sink.path(filename))
+        if self.cache is not None:
+            self.cache.store(url, sink.folder, validators, content, filename, sha256)
+
+    def shutdown(self):
+        if self.stage is not None:
+            self.stage.shutdown()
@@ -0,0 +1,413 @@
+import time
+import argparse
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from async_engine import AsyncEngineRunner, should_retry
+from body_reader import CHUNK_SIZE, DEFAULT_MAX_BYTES, BodyReader, ResponseRejected
+from rate_limiter import HostRateLimiter, parse_retry_after
+from pipeline.metrics import timed
+
+# ==============================================================================
+# FETCHER: DOWNLOAD DELLE IMMAGINI (--fetcher)
+# ==============================================================================
+# Tutti i fetcher hanno la stessa interfaccia:
+#   submit(url, index, total, handle, headers=None, metrics=None) -> Future
+# scaricano l'URL (rate limiter, retry, corpo letto con BodyReader) e chiamano
+# handle(status_code, headers, content) con le risposte 200/304; il Future
+# contiene il risultato di handle, None se il download fallisce. Con un
+# ImageMetrics (vedi pipeline/metrics.py) registrano tempi di attesa,
+# connessione, TTFB e trasferimento, tentativi, 429 e byte ricevuti.
+#   - requests : thread con una requests.Session e connection pool condiviso
+#   - httpx    : thread con un httpx.Client condiviso (HTTP/2 con --http2)
+#   - async    : asyncio/httpx in un thread dedicato (vedi async_engine), con
+#                --workers download contemporanei
+# La politica di retry è la stessa per tutti: backoff esponenziale sui 429
+# (imposto dal rate limiter a tutto l'host), attesa lineare sugli errori del
+# server e di rete, nessun retry per i 4xx definitivi e le risposte scartate.
+
+logger = logging.getLogger(__name__)
+
+FETCHERS = ('requests', 'httpx', 'async')
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 5
+DEFAULT_TIMEOUT = 30.0
+
+# Header comuni a tutte le richieste (impostati una sola volta su sessione/client)
+DEFAULT_HEADERS = {
+    'User-Agent': (
+        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+        'AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/91.0.4472.124 Safari/537.36'
+    ),
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7'
+}
+
+
+def referer_headers(url):
+    """Header per-richiesta: il Referer è la radice del sito che ospita l'immagine."""
+    parsed = urlparse(url)
+    return {'Referer': f"{parsed.scheme}://{parsed.netloc}/"}
+
+
+# Metriche della richiesta in corso nel thread, per i tempi di connessione di urllib3
+_connect_metrics = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            metrics = getattr(_connect_metrics, 'metrics', None)
+            if metrics is not None:
+                metrics.since('connect', start)
+
+
+class _TimedHTTPSConnection(_TimedHTTPConnection, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter le cui connessioni nuove sommano il tempo di connessione (e TLS) alle metriche del thread."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
+
+
+def create_session(max_workers=3, max_hosts=10):
+    """
+    Crea una requests.Session con connection pool condiviso tra i thread.
+
+    Ogni host ha al massimo `max_workers` connessioni keep-alive (pool_block=True
+    evita di aprirne di extra), così i worker riusano le connessioni TCP/TLS già
+    aperte invece di rifare l'handshake per ogni immagine.
+    `max_hosts` è il numero di pool per host mantenuti in cache.
+    """
+    session = requests.Session()
+    adapter = _TimedHTTPAdapter(
+        pool_connections=max_hosts,
+        pool_maxsize=max_workers,
+        pool_block=True
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+class SharedHttpClient:
+    """
+    httpx.Client a lunga vita condiviso da tutti i worker.
+
+    Con HTTP/2 le richieste verso lo stesso host vengono multiplexate come stream
+    sulla stessa connessione. `max_connections` limita le connessioni totali,
+    `max_streams` il numero di richieste contemporaneamente in volo sul client
+    (httpx non espone il limite di stream HTTP/2 lato client, quindi lo
+    applichiamo con un semaforo) e `keepalive_expiry` quanti secondi una
+    connessione inattiva resta aperta.
+    """
+
+    def __init__(self, http2=True, max_connections=10, max_streams=100, keepalive_expiry=30.0,
+                 timeout=DEFAULT_TIMEOUT):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.client = httpx.Client(
+            http2=http2, headers=DEFAULT_HEADERS, limits=limits,
+            follow_redirects=True, timeout=timeout
+        )
+        self._streams = threading.BoundedSemaphore(max_streams)
+
+    def get(self, url, **kwargs):
+        with self._streams:
+            return self.client.get(url, **kwargs)
+
+    @contextmanager
+    def stream(self, url, **kwargs):
+        """GET in streaming: lo slot resta occupato finché il corpo non è stato letto."""
+        with self._streams:
+            with self.client.stream('GET', url, **kwargs) as response:
+                yield response
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Fetcher(ABC):
+    """
+    Base dei fetcher: header per-richiesta e parametri comuni. Va chiuso con
+    close() (o usato come context manager).
+    """
+
+    def __init__(self, rate_limiter=None, max_retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                 max_bytes=DEFAULT_MAX_BYTES, referer=False):
+        # Il rate limiter deve essere condiviso da tutti i worker
+        self.rate_limiter = rate_limiter if rate_limiter is not None else HostRateLimiter()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_bytes = max_bytes
+        self.referer = referer
+
+    def request_headers(self, url, headers=None):
+        """Header della singola richiesta: Referer (se richiesto) più quelli indicati (es. GET condizionali)."""
+        request_headers = referer_headers(url) if self.referer else {}
+        request_headers.update(headers or {})
+        return request_headers
+
+    @abstractmethod
+    def submit(self, url, index, total, handle, headers=None, metrics=None):
+        """Avvia il download (vedi l'intestazione del modulo) e ritorna un Future con il risultato di handle."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ThreadedFetcher(Fetcher):
+    """
+    Fetcher a thread: `max_workers` thread scaricano e chiamano handle. Le
+    sottoclassi forniscono _stream(url, headers, metrics), un context manager
+    che produce (status_code, headers, blocchi del corpo) e somma a metrics il
+    tempo di apertura delle connessioni nuove.
+    """
+
+    # Eccezioni di rete che vale la pena riprovare
+    errors = ()
+
+    def __init__(self, max_workers, **kwargs):
+        super().__init__(**kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, url, index, total, handle, headers=None, metrics=None):
+        return self.executor.submit(self._run, url, index, total, handle, self.request_headers(url, headers),
+                                    metrics)
+
+    def _run(self, url, index, total, handle, headers, metrics=None):
+        if metrics is not None:
+            metrics.download_started()
+        try:
+            fetched = self.fetch(url, index, total, headers, metrics)
+        finally:
+            if metrics is not None:
+                metrics.download_finished()
+        if fetched is None:
+            return None
+        # La conversione avviene a connessione già restituita al pool
+        try:
+            return handle(*fetched)
+        except Exception as e:
+            logger.error(f"[{index}/{total}] ERRORE durante la conversione di {url}: {type(e).__name__} - {e}")
+            return None
+
+    @abstractmethod
+    def _stream(self, url, headers, metrics=None):
+        """Context manager che produce (status_code, headers, blocchi del corpo) della risposta."""
+
+    def fetch(self, url, index, total, headers=None, metrics=None):
+        """
+        Scarica un URL con la politica di retry comune.
+        Ritorna (status_code, headers, contenuto) per i 200, o per i 304 delle
+        richieste condizionali (contenuto vuoto), oppure None se fallisce.
+        """
+        for attempt in range(1, self.max_retries + 1):
+            # Attendiamo solo se l'host ha già ricevuto troppe richieste
+            with timed(metrics, 'throttle'):
+                self.rate_limiter.wait(url)
+            status_code = None
+            try:
+                started = metrics.request_started() if metrics is not None else None
+                with self._stream(url, headers, metrics) as (status_code, response_headers, chunks):
+                    if metrics is not None:
+                        metrics.headers_received(started)
+                    retry_after = parse_retry_after(response_headers.get('Retry-After'))
+                    if status_code == 429 and retry_after is None:
+                        retry_after = self.retry_delay * (2 ** (attempt - 1))  # Backoff esponenziale
+                    self.rate_limiter.record_response(url, status_code, retry_after)
+                    content = b''
+                    if status_code == 200:
+                        with timed(metrics, 'transfer'):
+                            content = BodyReader(url, response_headers, self.max_bytes).read(chunks)
+                if metrics is not None:
+                    metrics.attempt(status_code, len(content))
+
+                if status_code in (200, 304):
+                    return status_code, response_headers, content
+                if status_code == 429:
+                    # Il rate limiter blocca l'host per retry_after secondi per tutti
+                    # i worker: l'attesa avviene al prossimo rate_limiter.wait()
+                    logger.warning(f"[{index}/{total}] Rate limit raggiunto (429) per {url}. Tentativo {attempt}/{self.max_retries}. Attesa di {retry_after:.0f} secondi...")
+                    continue
+                logger.error(f"[{index}/{total}] ERRORE HTTP {status_code}: Impossibile scaricare {url}")
+                if not should_retry(status_code):
+                    return None
+            except ResponseRejected as e:
+                # Non è un'immagine o è troppo grande: inutile riprovare
+                if metrics is not None:
+                    metrics.attempt(status_code)
+                logger.error(f"[{index}/{total}] Risposta scartata: {e}")
+                return None
+            except self.errors as e:
+                if metrics is not None:
+                    metrics.attempt(status_code)
+                logger.error(f"[{index}/{total}] ERRORE RICHIESTA per {url} (tentativo {attempt}/{self.max_retries}): {type(e).__name__} - {e}")
+
+            if attempt < self.max_retries:
+                wait_time = self.retry_delay * attempt
+                logger.info(f"Tentativo {attempt}/{self.max_retries}. Attesa di {wait_time} secondi...")
+                with timed(metrics, 'throttle'):
+                    time.sleep(wait_time)
+
+        logger.error(f"[{index}/{total}] Download fallito per {url} dopo {self.max_retries} tentativi.")
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class RequestsFetcher(ThreadedFetcher):
+    """Thread con una requests.Session condivisa (vedi create_session)."""
+
+    errors = (requests.exceptions.RequestException,)
+
+    def __init__(self, max_workers, timeout=DEFAULT_TIMEOUT, **kwargs):
+        super().__init__(max_workers, **kwargs)
+        self.session = create_session(max_workers)
+        self.timeout = timeout
+
+    @contextmanager
+    def _stream(self, url, headers, metrics=None):
+        # Le connessioni di urllib3 (vedi _TimedHTTPAdapter) leggono le metriche dal thread
+        _connect_metrics.metrics = metrics
+        try:
+            # Il context manager restituisce sempre la connessione al pool, anche
+            # quando il corpo della risposta non viene letto (429, errori HTTP)
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                yield response.status_code, response.headers, response.iter_content(CHUNK_SIZE)
+        finally:
+            _connect_metrics.metrics = None
+
+    def close(self):
+        super().close()
+        self.session.close()
+
+
+class HttpxFetcher(ThreadedFetcher):
+    """Thread con un SharedHttpClient condiviso (HTTP/2 con multiplexing se http2=True)."""
+
+    errors = (httpx.HTTPError,)
+
+    def __init__(self, max_workers, http2=True, max_connections=None, max_streams=100, keepalive_expiry=30.0,
+                 **kwargs):
+        super().__init__(max_workers, **kwargs)
+        self.client = SharedHttpClient(http2=http2, max_connections=max_connections or max_workers,
+                                       max_streams=max_streams, keepalive_expiry=keepalive_expiry)
+
+    @contextmanager
+    def _stream(self, url, headers, metrics=None):
+        extensions = {'trace': metrics.connect_trace()} if metrics is not None else None
+        with self.client.stream(url, headers=headers, extensions=extensions) as response:
+            yield response.status_code, response.headers, response.iter_bytes(CHUNK_SIZE)
+
+    def close(self):
+        super().close()
+        self.client.close()
+
+
+class AsyncFetcher(Fetcher):
+    """
+    Motore asincrono (vedi async_engine): `max_workers` è il numero di download
+    contemporanei, `cpu_workers` il numero di thread che eseguono handle.
+    """
+
+    def __init__(self, max_workers, http2=False, cpu_workers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.runner = AsyncEngineRunner(
+            self.rate_limiter, max_concurrency=max_workers, cpu_workers=cpu_workers, headers=DEFAULT_HEADERS,
+            http2=http2, retry_delay=self.retry_delay, max_retries=self.max_retries,
+            max_bytes=self.max_bytes
+        )
+
+    def submit(self, url, index, total, handle, headers=None, metrics=None):
+        return self.runner.submit({
+            'url': url, 'index': index, 'total': total,
+            'headers': self.request_headers(url, headers), 'handle': handle, 'metrics': metrics,
+        })
+
+    def close(self):
+        self.runner.close()
+
+
+def create_fetcher(name, max_workers, **kwargs):
+    """Crea il fetcher `name` (vedi FETCHERS); le opzioni che non lo riguardano vengono ignorate."""
+    common = {key: kwargs[key] for key in ('rate_limiter', 'max_retries', 'retry_delay', 'max_bytes', 'referer')
+              if key in kwargs}
+    if name == 'requests':
+        return RequestsFetcher(max_workers, **common)
+    if name == 'httpx':
+        options = {key: kwargs[key] for key in ('http2', 'max_connections', 'max_streams', 'keepalive_expiry')
+                   if key in kwargs}
+        return HttpxFetcher(max_workers, **options, **common)
+    if name == 'async':
+        options = {key: kwargs[key] for key in ('http2', 'cpu_workers') if key in kwargs}
+        return AsyncFetcher(max_workers, **options, **common)
+    raise ValueError(f"Fetcher non valido: {name}")
+
+
+def add_fetcher_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni dei fetcher."""
+    parser.add_argument("--io-workers", "--workers", dest="workers", type=int, default=5, help="Numero di thread concorrenti per il download (download contemporanei con --fetcher async)")
+    parser.add_argument("--fetcher", choices=FETCHERS, default='requests', help="Client HTTP usato per i download (default: requests)")
+    parser.add_argument("--engine", choices=['threads', 'async'], help="Compatibilità: --engine async equivale a --fetcher async")
+    parser.add_argument("--retries", dest="max_retries", type=int, default=DEFAULT_RETRIES, help=f"Tentativi per ogni immagine, 1 per non riprovare (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--retry-delay", type=float, default=DEFAULT_RETRY_DELAY, help=f"Secondi di attesa base tra un tentativo e l'altro (default: {DEFAULT_RETRY_DELAY})")
+    parser.add_argument("--referer", action=argparse.BooleanOptionalAction, default=False, help="Invia come Referer la radice del sito che ospita l'immagine")
+    parser.add_argument("--http2", action=argparse.BooleanOptionalAction, default=False, help="Con --fetcher httpx/async, usa HTTP/2 con multiplexing")
+    parser.add_argument("--max-connections", type=int, help="Con --fetcher httpx, numero massimo di connessioni aperte dal client (default: pari a --workers)")
+    parser.add_argument("--max-streams", type=int, default=100, help="Con --fetcher httpx, numero massimo di richieste contemporanee in volo sul client (default: 100)")
+    parser.add_argument("--keepalive-expiry", type=float, default=30.0, help="Con --fetcher httpx, secondi dopo cui una connessione inattiva viene chiusa (default: 30)")
+
+
+def fetcher_from_args(args, rate_limiter=None, cpu_workers=None):
+    """Crea il fetcher dalle opzioni di add_fetcher_arguments (e --max-bytes di body_reader)."""
+    name = 'async' if args.engine == 'async' else args.fetcher
+    return create_fetcher(
+        name, args.workers, rate_limiter=rate_limiter, max_retries=args.max_retries, retry_delay=args.retry_delay,
+        max_bytes=args.max_bytes, referer=args.referer, http2=args.http2, max_connections=args.max_connections,
+        max_streams=args.max_streams, keepalive_expiry=args.keepalive_expiry, cpu_workers=cpu_workers
+    )
@@ -0,0 +1,456 @@
+import csv
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+# ==============================================================================
+# METRICHE DEL RUN (--metrics-report)
+# ==============================================================================
+# Ogni immagine scaricata ha un ImageMetrics con il tempo passato in ogni stadio:
+#   queue      attesa di un worker di download libero
+#   throttle   attesa del rate limiter e tra un tentativo e l'altro
+#   connect    DNS, connessione TCP e handshake TLS (solo connessioni nuove)
+#   ttfb       dall'invio della richiesta all'arrivo degli header
+#   transfer   lettura del corpo della risposta
+#   cpu_queue  attesa di un processo (o thread) di conversione libero
+#   decode     decodifica, già ridotta con --max-size
+#   square     analisi dei pixel, taglio dei bordi, tela quadrata e varianti ridotte
+#   encode     codifica nel formato di output (varianti comprese)
+#   write      scrittura dei file su disco
+# più tentativi, 429 e byte ricevuti. RunMetrics raccoglie le immagini
+# completate in aggregati a memoria costante: a fine run il log riporta la
+# distribuzione di ogni stadio e i contatori per host, e con --metrics-report
+# lo stesso riepilogo (più una riga per immagine, conservata solo in questo
+# caso) viene salvato in JSON, o in CSV con una riga per immagine.
+# Dal confronto tra rete, CPU e throttle si vede subito se un catalogo lento è
+# limitato dal server, dalla conversione o dai 429.
+# Durante il run RunMetrics tiene anche contatori e gauge aggiornati (immagini
+# in coda e in download, risposte per host e codice, byte ricevuti e scritti,
+# istogrammi degli stadi), esposti con --metrics-port (vedi metrics_server.py).
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('queue', 'throttle', 'connect', 'ttfb', 'transfer', 'cpu_queue', 'decode', 'square', 'encode', 'write')
+# Raggruppamento degli stadi per il verdetto finale
+STAGE_GROUPS = {
+    'rete': ('connect', 'ttfb', 'transfer'),
+    'CPU': ('decode', 'square', 'encode', 'write'),
+    'coda di conversione': ('cpu_queue',),
+    'rate limit e retry': ('throttle',),
+}
+# Eventi di trace di httpx (httpcore) che delimitano l'apertura di una connessione
+CONNECT_EVENTS = ('connection.connect_tcp', 'connection.start_tls')
+# Limiti superiori (secondi) delle classi degli istogrammi
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class ImageMetrics:
+    """
+    Tempi e contatori di una singola immagine. Viene riempito da fetcher e
+    trasformazione (anche in un processo di conversione, che ne rimanda indietro
+    gli stadi) e chiuso da RunMetrics.finish.
+    """
+
+    def __init__(self, url, catalog=None, run=None):
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.catalog = catalog
+        self.submitted = time.perf_counter()
+        self.stages = {}
+        self.attempts = 0
+        self.throttled = 0
+        self.bytes = 0
+        self.written = 0
+        self.status = None
+        self.filename = None
+        self.seconds = None
+        # RunMetrics a cui segnalare gli eventi per i contatori live (None nei processi di conversione)
+        self._run = run
+        self._state = 'queued'
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def since(self, stage, start):
+        """Aggiunge a `stage` il tempo trascorso da `start` (time.perf_counter)."""
+        self.add(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.since(stage, start)
+
+    def download_started(self, queued_since=None):
+        """
+        Da chiamare quando un worker prende in carico il download: chiude
+        l'attesa in coda (iniziata alla sottomissione o a `queued_since`).
+        """
+        self.since('queue', self.submitted if queued_since is None else queued_since)
+        self._move('downloading')
+
+    def download_finished(self):
+        """Da chiamare a download concluso (riuscito o no), prima della conversione."""
+        self._move(None)
+
+    def _move(self, state):
+        if self._run is not None and state != self._state:
+            self._run.moved(self._state, state)
+        self._state = state
+
+    def request_started(self):
+        """Da chiamare all'invio di una richiesta; il valore ritornato va passato a headers_received."""
+        return time.perf_counter(), self.stages.get('connect', 0.0)
+
+    def headers_received(self, started):
+        """Aggiunge a 'ttfb' il tempo dall'invio agli header, esclusa l'eventuale connessione nuova."""
+        start, connect_before = started
+        connect = self.stages.get('connect', 0.0) - connect_before
+        self.add('ttfb', max(0.0, time.perf_counter() - start - connect))
+
+    def connect_trace(self):
+        """
+        Callback `trace` per le extensions di httpx: somma a 'connect' la durata
+        di connessione TCP (DNS compreso) e handshake TLS.
+        """
+        started = {}
+
+        def trace(event_name, info):
+            name, _, phase = event_name.rpartition('.')
+            if name not in CONNECT_EVENTS:
+                return
+            if phase == 'started':
+                started[name] = time.perf_counter()
+            elif name in started:
+                self.since('connect', started.pop(name))
+
+        return trace
+
+    def async_connect_trace(self):
+        """Come connect_trace, per httpx.AsyncClient (che vuole una coroutine)."""
+        trace = self.connect_trace()
+
+        async def async_trace(event_name, info):
+            trace(event_name, info)
+
+        return async_trace
+
+    def attempt(self, status_code, received=0):
+        """Registra un tentativo di download (status None per gli errori di rete)."""
+        self.attempts += 1
+        self.status = status_code
+        self.bytes += received
+        if status_code == 429:
+            self.throttled += 1
+        if self._run is not None:
+            self._run.response(self.host, status_code, received)
+
+    def wrote(self, size):
+        """Registra `size` byte scritti su disco."""
+        self.written += size
+
+    def merge(self, other):
+        """Aggiunge tempi e byte scritti misurati altrove (es. in un processo di conversione)."""
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        self.written += other.written
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    @classmethod
+    def from_dict(cls, data):
+        """ImageMetrics ricostruito da una voce di as_dict (es. dal report di un altro processo)."""
+        metrics = cls(data['url'], data.get('catalog'))
+        metrics.filename = data.get('filename') or None
+        metrics.status = data.get('status')
+        for key in ('attempts', 'throttled', 'bytes', 'written'):
+            setattr(metrics, key, data.get(key) or 0)
+        metrics.seconds = data.get('seconds')
+        metrics.stages = {stage: data[stage] for stage in STAGES if data.get(stage)}
+        return metrics
+
+    def as_dict(self):
+        return {
+            'url': self.url, 'host': self.host, 'catalog': self.catalog, 'filename': self.filename,
+            'status': self.status, 'attempts': self.attempts, 'throttled': self.throttled, 'bytes': self.bytes,
+            'written': self.written, 'seconds': self.seconds, **{stage: self.stages.get(stage, 0.0) for stage in STAGES},
+        }
+
+
+def timed(metrics, stage):
+    """Context manager che misura `stage` su un ImageMetrics, oppure non fa niente se metrics è None."""
+    return metrics.timed(stage) if metrics is not None else nullcontext()
+
+
+def percentile(sorted_values, fraction):
+    """Percentile (0-1) per rango su una lista già ordinata, 0 se vuota."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def histogram(values):
+    """Conteggi cumulativi per limite superiore (come gli istogrammi Prometheus)."""
+    return [sum(1 for value in values if value <= bound) for bound in BUCKETS]
+
+
+def distribution(values):
+    """Riepilogo di una serie di durate: numero, totale, percentili, massimo e istogramma."""
+    values = sorted(values)
+    return {
+        'count': len(values), 'total': sum(values), 'p50': percentile(values, 0.50),
+        'p90': percentile(values, 0.90), 'p99': percentile(values, 0.99), 'max': values[-1] if values else 0.0,
+        'histogram': histogram(values),
+    }
+
+
+def new_aggregate():
+    """Aggregato di una serie di durate (numero, totale, massimo, istogramma) aggiornato con observe."""
+    return {'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * len(BUCKETS)}
+
+
+def observe(aggregate, seconds):
+    """Aggiunge una durata all'aggregato."""
+    aggregate['count'] += 1
+    aggregate['total'] += seconds
+    aggregate['max'] = max(aggregate['max'], seconds)
+    buckets = aggregate['histogram']
+    for position, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            buckets[position] += 1
+
+
+def merge_aggregate(aggregate, other):
+    """Somma a `aggregate` un altro aggregato (o una distribuzione, di cui ignora i percentili)."""
+    aggregate['count'] += other['count']
+    aggregate['total'] += other['total']
+    aggregate['max'] = max(aggregate['max'], other['max'])
+    aggregate['histogram'] = [count + more for count, more in zip(aggregate['histogram'], other['histogram'])]
+
+
+def histogram_percentile(aggregate, fraction):
+    """Percentile (0-1) stimato dall'istogramma: limite superiore della classe che lo contiene (al più il massimo)."""
+    if not aggregate['count']:
+        return 0.0
+    rank = min(aggregate['count'] - 1, int(fraction * aggregate['count'])) + 1
+    for bound, cumulative in zip(BUCKETS, aggregate['histogram']):
+        if cumulative >= rank:
+            return min(bound, aggregate['max'])
+    return aggregate['max']
+
+
+def estimated_distribution(aggregate):
+    """Come distribution, da un aggregato: i percentili sono stimati dall'istogramma."""
+    return {**aggregate, 'histogram': list(aggregate['histogram']), 'p50': histogram_percentile(aggregate, 0.50),
+            'p90': histogram_percentile(aggregate, 0.90), 'p99': histogram_percentile(aggregate, 0.99)}
+
+
+def _new_host():
+    return {'images': 0, 'failed': 0, 'attempts': 0, 'retries': 0, 'throttled': 0, 'bytes': 0,
+            'network': new_aggregate()}
+
+
+class RunMetrics:
+    """
+    Raccolta thread-safe delle immagini completate nel run: contatori live
+    (vedi live()) e aggregati per stadio e per host, con memoria costante.
+    Gli ImageMetrics delle singole immagini vengono conservati solo con
+    `keep_images` (per le righe del report di --metrics-report), e in quel caso
+    i percentili del riepilogo sono esatti invece che stimati dagli istogrammi.
+    """
+
+    def __init__(self, keep_images=False):
+        self.started = time.time()
+        self.keep_images = keep_images
+        self._start = time.perf_counter()
+        self._images = []
+        self._lock = threading.Lock()
+        self._gauges = {'queued': 0, 'downloading': 0}
+        self._outcomes = {'done': 0, 'failed': 0}
+        self._responses = {}
+        self._received = {}
+        self._written = 0
+        self._stages = {stage: new_aggregate() for stage in STAGES}
+        self._hosts = {}
+
+    def start(self, url, catalog=None):
+        """Nuovo ImageMetrics per un'immagine appena sottomessa (in coda per il download)."""
+        with self._lock:
+            self._gauges['queued'] += 1
+        return ImageMetrics(url, catalog, self)
+
+    def moved(self, source, destination):
+        """Sposta un'immagine tra gli stati live ('queued', 'downloading', None = uscita)."""
+        with self._lock:
+            if source is not None:
+                self._gauges[source] -= 1
+            if destination is not None:
+                self._gauges[destination] += 1
+
+    def response(self, host, status_code, received):
+        """Conta una risposta (status None per gli errori di rete) e i byte ricevuti da un host."""
+        key = (host, 'error' if status_code is None else str(status_code))
+        with self._lock:
+            self._responses[key] = self._responses.get(key, 0) + 1
+            self._received[host] = self._received.get(host, 0) + received
+
+    def finish(self, metrics, filename):
+        """Chiude le metriche di un'immagine (`filename` None se fallita)."""
+        metrics.filename = filename or None
+        metrics.seconds = time.perf_counter() - metrics.submitted
+        # Un download annullato può essere ancora "in coda"
+        metrics.download_finished()
+        self._collect(metrics)
+
+    def _collect(self, metrics):
+        with self._lock:
+            if self.keep_images:
+                self._images.append(metrics)
+            self._outcomes['done' if metrics.filename else 'failed'] += 1
+            self._written += metrics.written
+            for stage, seconds in metrics.stages.items():
+                observe(self._stages[stage], seconds)
+            host = self._hosts.get(metrics.host)
+            if host is None:
+                host = self._hosts[metrics.host] = _new_host()
+            host['images'] += 1
+            host['failed'] += metrics.filename is None
+            host['attempts'] += metrics.attempts
+            host['retries'] += metrics.retries
+            host['throttled'] += metrics.throttled
+            host['bytes'] += metrics.bytes
+            observe(host['network'], sum(metrics.stages.get(stage, 0.0) for stage in STAGE_GROUPS['rete']))
+
+    def merge_report(self, path):
+        """
+        Aggiunge al run un report JSON di write_report (es. di un altro processo
+        del batch): le sue immagini, o i suoi aggregati se non ne contiene.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        images = report.get('image_metrics', [])
+        for data in images:
+            self._collect(ImageMetrics.from_dict(data))
+        if images or not report.get('images'):
+            return len(images)
+        with self._lock:
+            self._outcomes['done'] += report['images'] - report['failed']
+            self._outcomes['failed'] += report['failed']
+            self._written += report.get('written', 0)
+            for stage, stats in report['stages'].items():
+                merge_aggregate(self._stages[stage], stats)
+            for name, stats in report['hosts'].items():
+                host = self._hosts.get(name)
+                if host is None:
+                    host = self._hosts[name] = _new_host()
+                for key in ('images', 'failed', 'attempts', 'retries', 'throttled', 'bytes'):
+                    host[key] += stats[key]
+                merge_aggregate(host['network'], stats['network'])
+        return report['images']
+
+    def live(self):
+        """
+        Fotografia dei contatori live: immagini in coda e in download, esiti,
+        risposte per (host, codice), byte ricevuti per host, byte scritti e
+        istogrammi cumulativi (BUCKETS) con somma dei secondi per stadio.
+        """
+        with self._lock:
+            return {
+                'gauges': dict(self._gauges), 'outcomes': dict(self._outcomes),
+                'responses': dict(self._responses), 'received': dict(self._received), 'written': self._written,
+                'stage_buckets': {stage: list(stats['histogram']) for stage, stats in self._stages.items()},
+                'stage_sums': {stage: stats['total'] for stage, stats in self._stages.items()},
+                'uptime': time.perf_counter() - self._start,
+            }
+
+    def images(self):
+        with self._lock:
+            return list(self._images)
+
+    def summary(self):
+        """Riepilogo del run: stadi (solo le immagini che li hanno attraversati), host e totali."""
+        with self._lock:
+            stages = {stage: estimated_distribution(stats) for stage, stats in self._stages.items()}
+            hosts = {name: {**stats, 'network': estimated_distribution(stats['network'])}
+                     for name, stats in self._hosts.items()}
+            outcomes, written, images = dict(self._outcomes), self._written, list(self._images)
+        if self.keep_images:
+            # Con le singole immagini i percentili sono esatti
+            for stage in STAGES:
+                stages[stage] = distribution([image.stages[stage] for image in images if stage in image.stages])
+            networks = {}
+            for image in images:
+                networks.setdefault(image.host, []).append(
+                    sum(image.stages.get(stage, 0.0) for stage in STAGE_GROUPS['rete']))
+            for name, values in networks.items():
+                hosts[name]['network'] = distribution(values)
+        return {
+            'started': self.started, 'seconds': time.perf_counter() - self._start,
+            'images': outcomes['done'] + outcomes['failed'], 'failed': outcomes['failed'], 'written': written,
+            'buckets': list(BUCKETS[:-1]), 'stages': stages, 'hosts': hosts,
+        }
+
+    def write_report(self, path):
+        """Salva il report: JSON (riepilogo più una voce per immagine) o CSV (una riga per immagine) secondo l'estensione."""
+        images = [image.as_dict() for image in self.images()]
+        if str(path).lower().endswith('.csv'):
+            fieldnames = list(ImageMetrics('').as_dict())
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(images)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({**self.summary(), 'image_metrics': images}, f, indent=2)
+        logger.info(f"Report delle metriche salvato in {path}")
+
+    def log_summary(self):
+        """Scrive nel log la tabella degli stadi, quella degli host e il collo di bottiglia probabile."""
+        summary = self.summary()
+        if not summary['images']:
+            return
+        lines = [f"\n--- Metriche: {summary['images']} immagini, {summary['failed']} fallite ---",
+                 f"{'stadio':<10} {'n':>6} {'totale s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  istogramma (<=5ms ... <=10s, oltre)"]
+        for stage, stats in summary['stages'].items():
+            if not stats['count']:
+                continue
+            counts = [stats['histogram'][0]] + [high - low for low, high in zip(stats['histogram'], stats['histogram'][1:])]
+            lines.append(f"{stage:<10} {stats['count']:>6} {stats['total']:>9.1f} {stats['p50'] * 1000:>8.0f} "
+                         f"{stats['p90'] * 1000:>8.0f} {stats['p99'] * 1000:>8.0f} {stats['max'] * 1000:>8.0f}  "
+                         f"{_sparkline(counts)}")
+
+        lines.append(f"\n{'host':<30} {'img':>6} {'fallite':>7} {'retry':>6} {'429':>5} {'MB':>8} {'rete p50 ms':>12} {'rete p99 ms':>12}")
+        for host, stats in sorted(summary['hosts'].items(), key=lambda item: -item[1]['images']):
+            lines.append(f"{host[:30]:<30} {stats['images']:>6} {stats['failed']:>7} {stats['retries']:>6} "
+                         f"{stats['throttled']:>5} {stats['bytes'] / 1e6:>8.1f} "
+                         f"{stats['network']['p50'] * 1000:>12.0f} {stats['network']['p99'] * 1000:>12.0f}")
+
+        totals = {group: sum(summary['stages'][stage]['total'] for stage in stages)
+                  for group, stages in STAGE_GROUPS.items()}
+        spent = sum(totals.values())
+        if spent:
+            shares = ", ".join(f"{group} {seconds / spent:.0%}" for group, seconds in totals.items())
+            lines.append(f"\nTempo per gruppo di stadi: {shares}")
+            lines.append(f"Collo di bottiglia probabile: {max(totals, key=totals.get)}")
+        logger.info("\n".join(lines))
+
+
+def _sparkline(counts):
+    """Istogramma compatto in una riga di caratteri (altezza relativa alla classe più piena)."""
+    levels = " .:-=+*#"
+    peak = max(counts) or 1
+    return "".join(levels[min(len(levels) - 1, -(-count * (len(levels) - 1) // peak))] for count in counts)
+
+
+def add_metrics_arguments(parser):
+    """Aggiunge al parser argparse le opzioni del report e dell'endpoint delle metriche."""
+    parser.add_argument("--metrics-report", help="File in cui salvare le metriche del run: .json (riepilogo e immagini) o .csv (una riga per immagine)")
+    parser.add_argument("--metrics-port", type=int, help="Porta su cui esporre le metriche live in formato Prometheus (/metrics)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Indirizzo su cui ascolta l'endpoint delle metriche (default: 127.0.0.1, 0.0.0.0 per tutte le interfacce)")
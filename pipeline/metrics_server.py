@@ -0,0 +1,121 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline.metrics import BUCKETS, STAGES
+
+# ==============================================================================
+# ENDPOINT DELLE METRICHE LIVE (--metrics-port)
+# ==============================================================================
+# Per i run lunghi (tutti i CSV dei fornitori di notte) espone i contatori
+# live di RunMetrics in formato testo Prometheus su http://<host>:<porta>/metrics:
+#   pipeline_images_total{outcome}              immagini completate / fallite
+#   pipeline_download_queue_depth               immagini in attesa di un worker
+#   pipeline_downloads_in_flight                download in corso
+#   pipeline_http_responses_total{host,code}    risposte per host e codice (429 compresi;
+#                                               code="error" per gli errori di rete)
+#   pipeline_received_bytes_total{host}         byte scaricati per host
+#   pipeline_written_bytes_total                byte delle immagini scritte
+#   pipeline_stage_seconds{stage}               istogramma dei tempi per stadio
+#                                               (encode compreso, vedi metrics.py)
+#   pipeline_uptime_seconds                     secondi dall'inizio del run
+# Il server gira in un thread daemon e legge solo una fotografia dei contatori:
+# non rallenta i worker. In locale:
+#   curl -s http://127.0.0.1:9108/metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _bound(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def prometheus_text(run_metrics):
+    """Contatori live di un RunMetrics nel formato testo di Prometheus."""
+    live = run_metrics.live()
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label(label)}"' for key, label in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    metric("pipeline_images_total", "counter", "Immagini completate per esito.",
+           [((('outcome', outcome),), count) for outcome, count in live['outcomes'].items()])
+    metric("pipeline_download_queue_depth", "gauge", "Immagini sottomesse in attesa di un worker di download.",
+           [((), live['gauges']['queued'])])
+    metric("pipeline_downloads_in_flight", "gauge", "Download in corso (attese del rate limiter comprese).",
+           [((), live['gauges']['downloading'])])
+    metric("pipeline_http_responses_total", "counter", "Risposte HTTP per host e codice (error = errore di rete).",
+           [((('host', host), ('code', code)), count) for (host, code), count in sorted(live['responses'].items())])
+    metric("pipeline_received_bytes_total", "counter", "Byte scaricati per host.",
+           [((('host', host),), size) for host, size in sorted(live['received'].items())])
+    metric("pipeline_written_bytes_total", "counter", "Byte delle immagini scritte su disco.",
+           [((), live['written'])])
+
+    name = "pipeline_stage_seconds"
+    lines.append(f"# HELP {name} Secondi passati da ogni immagine completata in ogni stadio.")
+    lines.append(f"# TYPE {name} histogram")
+    for stage in STAGES:
+        buckets = live['stage_buckets'][stage]
+        for bound, count in zip(BUCKETS, buckets):
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{_bound(bound)}"}} {count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {live["stage_sums"][stage]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {buckets[-1]}')
+
+    metric("pipeline_uptime_seconds", "gauge", "Secondi dall'inizio del run.", [((), live['uptime'])])
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = prometheus_text(self.server.run_metrics).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    """Server HTTP in un thread daemon che espone un RunMetrics su /metrics. Va chiuso con close()."""
+
+    def __init__(self, run_metrics, port, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.run_metrics = run_metrics
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Metriche Prometheus su http://{host}:{self.server.server_port}/metrics")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def metrics_server_from_args(args, run_metrics):
+    """Avvia il MetricsServer se è indicato --metrics-port, altrimenti ritorna None."""
+    if args.metrics_port is None:
+        return None
+    return MetricsServer(run_metrics, args.metrics_port, args.metrics_host)
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit
+
+# ==============================================================================
+# NOMI DEI FILE E URL DELLE RIGHE DEL CSV
+# ==============================================================================
+# Ogni riga con `name` e `image_url` diventa un task {'name', 'url'}:
+#   - l'URL è la parte di image_url che comincia da 'http' (alcuni cataloghi
+#     hanno prefissi o spazi davanti all'indirizzo)
+#   - il nome è quello del prodotto pulito con una delle regole di NAMING_RULES;
+#     lo stesso nome pulito è la chiave usata per aggiornare il _local.csv
+# Le due regole esistono perché i CSV già pubblicati puntano a file nominati
+# in modo diverso: 'legacy' (download_images*.py) sostituisce i caratteri non
+# validi con '_', 'strict' (download_piu_bordi*.py) tiene solo lettere, cifre,
+# '_' e '-'.
+# url_shard assegna ogni URL (normalizzato) a uno di N shard in modo
+# deterministico, uguale su tutte le macchine (vedi pipeline/batch.py).
+
+logger = logging.getLogger(__name__)
+
+INVALID_CHARS = '<>:"/\\|?*\n\r\t '
+
+
+def _clean_legacy(name):
+    name = name.strip()
+    for char in INVALID_CHARS:
+        name = name.replace(char, '_')
+    return name
+
+
+def _clean_strict(name):
+    return "".join(c for c in name if c.isalnum() or c in ('_', '-')).rstrip()
+
+
+NAMING_RULES = {
+    'legacy': _clean_legacy,
+    'strict': _clean_strict,
+}
+
+
+def clean_filename(name, naming='strict'):
+    """Pulisce il nome di un prodotto con la regola `naming` (vedi NAMING_RULES)."""
+    return NAMING_RULES[naming](name)
+
+
+def normalize_url(url):
+    """Normalizza un URL per il confronto tra cataloghi (schema/host minuscoli, niente porta di default né frammento)."""
+    parsed = urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parsed.path or '/', parsed.query, ''))
+
+
+def url_shard(url, shards):
+    """Shard (0..shards-1) dell'URL: hash dell'URL normalizzato, stabile tra processi e macchine."""
+    digest = hashlib.sha1(normalize_url(url).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def task_of(row, naming='strict'):
+    """Ritorna il task {'name', 'url'} di una riga del CSV, o None se la riga non ha un URL 'http'."""
+    raw_image_url = row.get('image_url') or ''
+    name = row.get('name') or ''
+
+    if raw_image_url and name:
+        http_pos = raw_image_url.find('http')
+        if http_pos != -1:
+            return {'name': clean_filename(name, naming), 'url': raw_image_url[http_pos:].strip()}
+        logger.warning(f"Nessun URL 'http' trovato nella riga per il prodotto: {name}")
+    return None
@@ -0,0 +1,343 @@
+import os
+import json
+import mmap
+import socket
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+# ==============================================================================
+# PACCHETTI DI IMMAGINI PER CATALOGO (--pack)
+# ==============================================================================
+# Per il deploy le migliaia di file piccoli di una cartella diventano due file
+# sequenziali accanto alla cartella:
+#   <cartella>.pack      dati: intestazione PACK_MAGIC seguita dai file uno dopo
+#                        l'altro, solo in aggiunta (mai riscritto)
+#   <cartella>.pack.idx  indice JSON, una riga per file aggiunto:
+#                        {"name", "offset", "length", "format", "sha256", "mtime_ns"}
+#                        (per lo stesso nome vale l'ultima riga)
+# pack_folder aggiunge al pacchetto solo i file nuovi o cambiati della cartella
+# (stessa dimensione e mtime = già presente); un contenuto già nel pacchetto,
+# come i file collegati tra nomi diversi, viene solo indicizzato di nuovo.
+# Più processi (vedi pipeline/batch.py) si alternano con un file di lock.
+# La cartella resta la copia di lavoro (--resume, cache, deduplica): è il
+# pacchetto che si copia sui server.
+#
+#   python image_pack.py list Marchio.pack
+#   python image_pack.py build Marchio/            (pacchetto di una cartella esistente)
+#   python image_pack.py extract Marchio.pack destinazione/ [nome ...]
+#   python image_pack.py serve *.pack --port 8080
+# serve risponde a /images/<cartella>/<file> e /images/<cartella>.pack/<file>
+# (i percorsi del _local.csv, anche con --pack-references) leggendo i dati dal
+# pacchetto mappato in memoria (mmap), con ETag = SHA-256 del file.
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"IMGPACK1"
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+LOCK_POLL = 0.1     # Secondi tra due tentativi di prendere il lock del pacchetto
+
+CONTENT_TYPES = {
+    'webp': 'image/webp', 'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
+    'avif': 'image/avif',
+}
+
+
+def pack_path_for(folder):
+    """Percorso del pacchetto di una cartella: <cartella>.pack accanto alla cartella."""
+    folder = Path(folder)
+    return folder.with_name(folder.name + PACK_SUFFIX)
+
+
+def index_path_for(pack_path):
+    return Path(f"{pack_path}{INDEX_SUFFIX}")
+
+
+def read_index(pack_path):
+    """Indice di un pacchetto: {nome: voce}, con l'ultima voce di ogni nome (le righe incomplete vengono ignorate)."""
+    entries = {}
+    try:
+        with open(index_path_for(pack_path), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['name']] = entry
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+class _PackLock:
+    """
+    Lock esclusivo tra processi su un pacchetto (file creato con O_EXCL, con
+    macchina e pid del proprietario): un lock di un processo terminato di questa
+    macchina viene rimosso, quelli delle altre macchine (storage condiviso) no.
+    """
+
+    def __init__(self, pack_path):
+        self.path = f"{pack_path}{LOCK_SUFFIX}"
+
+    def __enter__(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self._remove_if_stale()
+                time.sleep(LOCK_POLL)
+                continue
+            os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode('utf-8'))
+            os.close(fd)
+            return self
+
+    def _remove_if_stale(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                host, _, pid = f.read().rpartition(' ')
+            if host == socket.gethostname() and pid:
+                os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.remove(self.path)
+        except (FileNotFoundError, ValueError, PermissionError, OverflowError):
+            pass
+
+    def __exit__(self, *exc_info):
+        os.remove(self.path)
+
+
+def pack_folder(folder, pack_path=None, fsync=False):
+    """
+    Aggiunge al pacchetto (default: <cartella>.pack) i file nuovi o cambiati
+    della cartella, poi le loro righe all'indice. Ritorna (file indicizzati,
+    byte aggiunti). Con `fsync` dati e indice vengono portati su disco.
+    """
+    folder = Path(folder)
+    pack_path = Path(pack_path) if pack_path is not None else pack_path_for(folder)
+    with _PackLock(pack_path):
+        index = read_index(pack_path)
+        by_hash = {entry['sha256']: entry for entry in index.values()}
+        lines = []
+        appended = 0
+        with open(pack_path, 'ab') as data:
+            if data.tell() == 0:
+                data.write(PACK_MAGIC)
+            offset = data.tell()
+            for item in sorted(os.scandir(folder), key=lambda item: item.name):
+                # I file nascosti sono i temporanei dei sink (vedi pipeline/sinks.py)
+                if item.name.startswith('.') or not item.is_file():
+                    continue
+                stat = item.stat()
+                known = index.get(item.name)
+                if known is not None and known['length'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                    continue
+                with open(item.path, 'rb') as f:
+                    content = f.read()
+                sha256 = hashlib.sha256(content).hexdigest()
+                stored = by_hash.get(sha256)
+                if stored is None:
+                    data.write(content)
+                    stored = {'offset': offset, 'length': len(content)}
+                    offset += len(content)
+                    appended += len(content)
+                entry = {'name': item.name, 'offset': stored['offset'], 'length': stored['length'],
+                         'format': os.path.splitext(item.name)[1].lstrip('.').lower(), 'sha256': sha256,
+                         'mtime_ns': stat.st_mtime_ns}
+                index[item.name] = by_hash[sha256] = entry
+                lines.append(json.dumps(entry, separators=(',', ':')) + "\n")
+            if fsync:
+                data.flush()
+                os.fsync(data.fileno())
+        # L'indice viene scritto dopo i dati: un'interruzione lascia al più byte non indicizzati
+        if lines:
+            with open(index_path_for(pack_path), 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+    return len(lines), appended
+
+
+class PackReader:
+    """Lettura di un pacchetto mappato in memoria; refresh() vede i file aggiunti nel frattempo."""
+
+    def __init__(self, pack_path):
+        self.path = Path(pack_path)
+        self.name = self.path.name[:-len(PACK_SUFFIX)] if self.path.name.endswith(PACK_SUFFIX) else self.path.stem
+        self._file = open(self.path, 'rb')
+        self._map = None
+        self._index_size = None
+        self.entries = {}
+        self.refresh()
+        if self._map[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f"{self.path} non è un pacchetto di immagini")
+
+    def refresh(self):
+        """Rilegge indice e mappa se l'indice è cambiato (il pacchetto cresce solo in coda)."""
+        try:
+            index_size = os.path.getsize(index_path_for(self.path))
+        except FileNotFoundError:
+            index_size = 0
+        if index_size == self._index_size and self._map is not None:
+            return
+        entries = read_index(self.path)
+        # La mappa precedente non viene chiusa: resta valida finché esistono viste restituite da read() (ad es. di
+        # una risposta in corso) e viene liberata con l'ultima di esse
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries, self._index_size = entries, index_size
+
+    def read(self, name):
+        """Contenuto del file `name` (memoryview sul pacchetto mappato), None se non c'è."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return memoryview(self._map)[entry['offset']:entry['offset'] + entry['length']]
+
+    def close(self):
+        """Chiude il pacchetto; le viste restituite da read() vanno rilasciate prima."""
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_safe_name(name):
+    """True se `name` è un semplice nome di file: niente percorsi assoluti, separatori o '..'."""
+    separators = [separator for separator in ('/', '\\', os.sep, os.altsep) if separator]
+    return bool(name) and not os.path.isabs(name) and '..' not in name and not any(
+        separator in name for separator in separators)
+
+
+def extract_pack(pack_path, destination, names=None):
+    """
+    Estrae i file del pacchetto (tutti o solo `names`) in `destination`; ritorna
+    il numero di file estratti. I nomi che uscirebbero da `destination` (indice
+    corrotto o costruito ad arte) vengono scartati.
+    """
+    destination = Path(destination)
+    destination.mkdir(parents=True, exist_ok=True)
+    extracted = 0
+    with PackReader(pack_path) as reader:
+        for name in names or sorted(reader.entries):
+            if not is_safe_name(name):
+                logger.error(f"Nome non valido nel pacchetto {pack_path}, scartato: {name!r}")
+                continue
+            content = reader.read(name)
+            if content is None:
+                logger.warning(f"{name} non è nel pacchetto {pack_path}")
+                continue
+            # File temporaneo rinominato, come nei sink
+            temporary_path = destination / f".{name}.{os.getpid()}.tmp"
+            with open(temporary_path, 'wb') as f:
+                f.write(content)
+            os.replace(temporary_path, destination / name)
+            content.release()
+            extracted += 1
+    return extracted
+
+
+class _PackHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = unquote(urlsplit(self.path).path).strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'images':
+            self.send_error(404)
+            return
+        folder, name = parts[1], parts[2]
+        reader = self.server.packs.get(folder[:-len(PACK_SUFFIX)] if folder.endswith(PACK_SUFFIX) else folder)
+        if reader is None:
+            self.send_error(404)
+            return
+        with self.server.lock:
+            reader.refresh()
+            entry = reader.entries.get(name)
+            content = reader.read(name)
+        if content is None:
+            self.send_error(404)
+            return
+        try:
+            self._send(entry, content)
+        finally:
+            content.release()
+
+    def _send(self, entry, content):
+        etag = f'"{entry["sha256"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(entry['format'], 'application/octet-stream'))
+        self.send_header('Content-Length', str(entry['length']))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve_packs(pack_paths, port=8080, host='127.0.0.1'):
+    """Serve i pacchetti indicati su http://<host>:<porta>/images/<cartella>/<file> fino a Ctrl+C."""
+    server = ThreadingHTTPServer((host, port), _PackHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.packs = {reader.name: reader for reader in map(PackReader, pack_paths)}
+    logger.info(f"Pacchetti {', '.join(sorted(server.packs))} su http://{host}:{server.server_port}/images/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for reader in server.packs.values():
+            reader.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pacchetti di immagini per catalogo: elenco, creazione, estrazione e server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="Elenca i file di un pacchetto")
+    list_parser.add_argument("pack")
+    build_parser = commands.add_parser("build", help="Aggiunge a <cartella>.pack i file nuovi o cambiati della cartella")
+    build_parser.add_argument("folder")
+    build_parser.add_argument("--fsync", action="store_true", help="Porta dati e indice su disco")
+    extract_parser = commands.add_parser("extract", help="Estrae i file di un pacchetto in una cartella")
+    extract_parser.add_argument("pack")
+    extract_parser.add_argument("destination")
+    extract_parser.add_argument("names", nargs='*', help="File da estrarre (default: tutti)")
+    serve_parser = commands.add_parser("serve", help="Serve i pacchetti via HTTP leggendoli con mmap")
+    serve_parser.add_argument("packs", nargs='+')
+    serve_parser.add_argument("--port", type=int, default=8080, help="Porta del server (default: 8080)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Indirizzo del server (default: 127.0.0.1)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "list":
+        entries = read_index(args.pack)
+        for entry in sorted(entries.values(), key=lambda entry: entry['name']):
+            print(f"{entry['name']}\t{entry['offset']}\t{entry['length']}\t{entry['format']}\t{entry['sha256']}")
+        logger.info(f"{len(entries)} file, {os.path.getsize(args.pack) / 1e6:.1f} MB")
+    elif args.command == "build":
+        indexed, appended = pack_folder(args.folder, fsync=args.fsync)
+        logger.info(f"{pack_path_for(args.folder)}: {indexed} file indicizzati, {appended / 1e6:.1f} MB aggiunti")
+    elif args.command == "extract":
+        logger.info(f"Estratti {extract_pack(args.pack, args.destination, args.names)} file in {args.destination}")
+    else:
+        serve_packs(args.packs, args.port, args.host)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+
+# ==============================================================================
+# PRESET DELLA PIPELINE (--preset)
+# ==============================================================================
+# Ogni preset è un insieme di valori di default delle opzioni della CLI (vedi
+# pipeline/cli.py) e corrisponde a uno degli script storici, che ora sono solo
+# un richiamo alla pipeline con il loro preset. Qualunque opzione resta
+# modificabile dalla riga di comando.
+#   images        : WebP q85 senza bordi, nomi 'legacy'    (download_images.py)
+#   images_httpx  : come images, con httpx, HTTP/2 e Referer (download_images_httpx.py)
+#   piu_bordi     : quadrate su sfondo bianco, sempre WebP; le già quadrate
+#                   conservano la trasparenza (download_piu_bordi.py)
+#   piu_bordi_png : quadrate, trasparenza conservata (PNG) (download_piu_bordi_png.py)
+
+CPU_WORKERS = os.cpu_count() or 1
+
+PRESETS = {
+    'images': {
+        'description': "Scarica e converti in WebP le immagini da uno o più file CSV",
+        'log_file': "download_log.txt",
+        'workers': 3,
+        'cpu_workers': CPU_WORKERS,
+        'fetcher': 'requests',
+        'naming': 'legacy',
+        'square': False,
+        'alpha_format': 'webp',
+    },
+    'images_httpx': {
+        'description': "Scarica e converti in WebP le immagini da uno o più file CSV (httpx, HTTP/2)",
+        'log_file': "download_log.txt",
+        'workers': 3,
+        'cpu_workers': CPU_WORKERS,
+        'fetcher': 'httpx',
+        'http2': True,
+        'referer': True,
+        'naming': 'legacy',
+        'square': False,
+        'alpha_format': 'webp',
+    },
+    'piu_bordi': {
+        'description': "Scarica immagini da file CSV, le converte in WebP e le rende quadrate aggiungendo bordi bianchi.",
+        'log_file': "image_processing_log.txt",
+        'workers': 5,
+        'cpu_workers': CPU_WORKERS,
+        'fetcher': 'requests',
+        'naming': 'strict',
+        'square': True,
+        'flatten': True,
+        # Come lo script storico: la trasparenza si perde solo aggiungendo i bordi
+        'flatten_square': False,
+        'alpha_format': 'webp',
+    },
+    'piu_bordi_png': {
+        'description': "Scarica immagini da file CSV, le converte nel formato appropriato e le rende quadrate preservando la trasparenza.",
+        'log_file': "image_processing_log.txt",
+        'workers': 5,
+        'cpu_workers': CPU_WORKERS,
+        'fetcher': 'requests',
+        'naming': 'strict',
+        'square': True,
+        'alpha_format': 'png',
+    },
+}
+
+DEFAULT_PRESET = 'piu_bordi_png'
@@ -0,0 +1,506 @@
+import os
+import csv
+import time
+import queue
+import logging
+from functools import partial
+from pathlib import Path
+
+from csv_stream import (DEFAULT_CHECKPOINT_INTERVAL, DEFERRED, LocalCsvWriter, iter_rows, local_csv_path,
+                        patch_local_csv, read_fieldnames, run_windowed, when_resolved)
+from image_resize import variant_filename
+from job_journal import journaled
+from pipeline.naming import clean_filename, normalize_url, task_of, url_shard
+from pipeline.sinks import FolderSink
+
+# ==============================================================================
+# ESECUZIONE DELLA PIPELINE SUI CSV
+# ==============================================================================
+# Per ogni CSV: le righe diventano task (vedi pipeline/naming.py), le immagini
+# vengono scaricate dal fetcher, convertite dal Converter e salvate nel sink
+# del catalogo (cartella con il nome del CSV), poi local_csv/<nome>_local.csv
+# viene scritto con i percorsi /images/<cartella>/<file>.
+#   - process_csvs legge tutti i CSV, scarica ogni URL (normalizzato) una sola
+#     volta e collega il file prodotto in tutti i cataloghi che lo usano; le
+#     immagini vengono raccolte nell'ordine in cui si completano e i _local.csv
+#     salvati a intervalli regolari (checkpoint) con quelle già pronte
+#   - process_csvs_streaming legge i CSV in streaming (vedi csv_stream) con al
+#     massimo `window` righe in lavorazione e le righe più lente della scadenza
+#     rimandate in fondo
+# In entrambi i casi l'avanzamento (e con le metriche i contatori per host)
+# viene scritto nel log man mano che le immagini si completano.
+# Le righe fallite restano con l'URL originale e vengono elencate in
+# failed_downloads.txt. Con un RunMetrics (vedi pipeline/metrics.py) ogni
+# immagine scaricata registra i tempi dei suoi stadi.
+
+logger = logging.getLogger(__name__)
+
+FAILED_DOWNLOADS = "failed_downloads.txt"
+PROGRESS_INTERVAL = 10.0    # Secondi tra due righe di avanzamento nel log
+
+
+class Progress:
+    """
+    Avanzamento in ordine di completamento: ogni PROGRESS_INTERVAL secondi (e
+    all'ultima immagine) una riga nel log con immagini pronte, fallite e
+    velocità, più le risposte per host se c'è un RunMetrics.
+    """
+
+    def __init__(self, total, metrics=None, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.metrics = metrics
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self._start = self._logged = time.monotonic()
+
+    def completed(self, ok):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self._logged >= self.interval or self.done + self.failed == self.total:
+            self._logged = now
+            self.log(now)
+
+    def log(self, now=None):
+        elapsed = (now or time.monotonic()) - self._start
+        completed = self.done + self.failed
+        rate = completed / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Avanzamento: {completed}/{self.total} immagini ({self.done} pronte, {self.failed} fallite), {rate:.1f} immagini/s")
+        if self.metrics is not None:
+            hosts = {}
+            for (host, code), count in self.metrics.live()['responses'].items():
+                hosts.setdefault(host, []).append(f"{code}: {count}")
+            for host, codes in sorted(hosts.items()):
+                logger.info(f"  {host} -> {', '.join(sorted(codes))}")
+
+
+def submit_image(fetcher, converter, sink, name, url, index, total, journal=None, csv_file_path=None,
+                 metrics=None):
+    """
+    Sottomette download e conversione di un'immagine del catalogo `sink`.
+    Ritorna un Future con il nome del file prodotto, o direttamente il nome se
+    il file esiste già e non va scaricato.
+    Con una cache il file viene invece rivalidato con un GET condizionale.
+    Con un `journal` il worker registra l'immagine appena completata, con un
+    `metrics` (RunMetrics) i tempi dell'immagine vengono raccolti a fine lavorazione.
+    """
+    entry = None
+    headers = None
+    cache = converter.cache
+    if cache is not None:
+        entry = cache.lookup(url, sink.folder)
+        headers = cache.request_headers(entry, sink.folder)
+    else:
+        existing_filename = converter.transform.existing_output(sink, name)
+        if existing_filename is not None:
+            logger.info(f"[{index}/{total}] File già esistente, saltato: {sink.path(existing_filename)}")
+            if journal is not None:
+                journal.record(csv_file_path, name, url, sink.folder, existing_filename)
+            return existing_filename
+
+    image_metrics = metrics.start(url, sink.name) if metrics is not None else None
+    handle = journaled(journal, csv_file_path, name, url, sink.folder,
+                       converter.handler(sink, name, url, index, total, entry, image_metrics))
+    future = fetcher.submit(url, index, total, handle, headers, image_metrics)
+    if image_metrics is not None:
+        when_resolved(future, partial(metrics.finish, image_metrics))
+    return future
+
+
+def variant_fieldnames(fieldnames, variants=()):
+    """Header del _local.csv: quello originale più una colonna image_url_<lato> per ogni variante."""
+    extra = [f"image_url_{size}" for size in variants]
+    return list(fieldnames) + [column for column in extra if column not in fieldnames]
+
+
+def set_image_urls(row, images_folder_name, filename, variants=()):
+    """Aggiorna image_url (e le colonne delle varianti) di una riga con i percorsi locali."""
+    row['image_url'] = f"/images/{images_folder_name}/{filename}"
+    for size in variants:
+        row[f"image_url_{size}"] = f"/images/{images_folder_name}/{variant_filename(filename, size)}"
+
+
+def create_updated_csv(original_csv_path, images_folder_name, download_results, naming='strict', variants=(),
+                       checkpoint=False):
+    """
+    Crea una copia del CSV con i percorsi locali aggiornati (e una colonna per
+    ogni variante). Il file viene scritto a parte e poi rinominato, così il
+    _local.csv esistente (anche un checkpoint) resta valido fino all'ultimo.
+    Con `checkpoint` il salvataggio è intermedio e non viene annunciato nel log.
+    """
+    new_csv_path = local_csv_path(original_csv_path)
+    temporary_path = f"{new_csv_path}.tmp"
+    try:
+        with open(original_csv_path, 'r', encoding='utf-8') as infile, \
+             open(temporary_path, 'w', encoding='utf-8', newline='') as outfile:
+
+            reader = csv.DictReader(infile)
+            if not reader.fieldnames:
+                logger.error(f"Il file CSV {original_csv_path} è vuoto o malformattato.")
+                return None
+
+            writer = csv.DictWriter(outfile, fieldnames=variant_fieldnames(reader.fieldnames, variants))
+            writer.writeheader()
+
+            for row in reader:
+                name = clean_filename(row.get('name') or '', naming)
+                if download_results.get(name):
+                    set_image_urls(row, images_folder_name, download_results[name], variants)
+                writer.writerow(row)
+
+        os.replace(temporary_path, new_csv_path)
+        if not checkpoint:
+            logger.info(f"Nuovo CSV creato: {new_csv_path}")
+        return new_csv_path
+    except Exception as e:
+        logger.error(f"Impossibile creare il nuovo file CSV: {e}")
+        return None
+
+
+def save_failed_downloads(failed_downloads, path=FAILED_DOWNLOADS):
+    """Salva le immagini fallite (CSV, numero, nome, URL) in `path` (failed_downloads.txt) per un eventuale retry."""
+    if not failed_downloads:
+        return
+    logger.warning(f"Download falliti: {len(failed_downloads)}")
+    with open(path, "w", encoding="utf-8", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["CSV", "Num", "Name", "URL"])
+        writer.writerows(failed_downloads)
+    logger.info(f"Gli URL dei download falliti sono stati salvati in '{path}'")
+
+
+def read_tasks(csv_file_path, naming='strict'):
+    """
+    Legge un CSV e ritorna la lista dei task {'name', 'url'} con un URL 'http'
+    (None se il file non esiste).
+    """
+    try:
+        return [task for _, row in iter_rows(csv_file_path) if (task := task_of(row, naming)) is not None]
+    except FileNotFoundError:
+        logger.error(f"File non trovato: {csv_file_path}")
+        return None
+
+
+def plan_downloads(csv_files, naming='strict', continue_from=None, shard=None, sink_factory=FolderSink):
+    """
+    Fase di pianificazione: legge tutti i CSV e raggruppa le righe per URL normalizzato.
+
+    Ritorna (catalogs, unique_images): catalogs è la lista dei CSV validi
+    ({'csv', 'sink', 'tasks', 'results'}), unique_images la lista delle
+    immagini da scaricare una sola volta ({'url', 'targets'}), dove targets
+    sono le terne (catalogo, nome, numero dell'immagine nel suo CSV, quello di
+    --continue-from) che usano quell'immagine.
+    Il primo target è quello in cui l'immagine viene effettivamente scaricata.
+    Con `continue_from` le immagini del primo CSV prima di quel numero (1-based)
+    vengono saltate e le loro righe restano con l'URL originale.
+    Con `shard` (indice, numero di shard) restano solo le immagini il cui URL
+    appartiene allo shard indicato (vedi url_shard). Il sink di ogni catalogo
+    viene creato con sink_factory(nome del CSV).
+    """
+    catalogs = []
+    unique_by_url = {}
+    for position, csv_file_path in enumerate(csv_files):
+        logger.info(f"\n--- Lettura di: {csv_file_path} ---")
+        tasks = read_tasks(csv_file_path, naming)
+        if tasks is None:
+            continue
+        first_number = 1
+        if position == 0 and continue_from:
+            logger.info(f"Riprendendo dal download numero {continue_from}")
+            tasks = tasks[continue_from - 1:]
+            first_number = continue_from
+        if not tasks:
+            logger.warning(f"Nessuna immagine valida trovata in {csv_file_path}.")
+            continue
+        logger.info(f"Trovate {len(tasks)} immagini valide da processare.")
+
+        catalog = {'csv': csv_file_path, 'sink': sink_factory(Path(csv_file_path).stem), 'tasks': tasks,
+                   'results': {}}
+        catalogs.append(catalog)
+
+        for number, task in enumerate(tasks, first_number):
+            if shard is not None and url_shard(task['url'], shard[1]) != shard[0]:
+                continue
+            image = unique_by_url.setdefault(normalize_url(task['url']), {'url': task['url'], 'targets': []})
+            image['targets'].append((catalog, task['name'], number))
+
+    return catalogs, list(unique_by_url.values())
+
+
+def materialize_image(image, result, variants, journal=None, failed_downloads=None):
+    """
+    Rende disponibile un'immagine scaricata (risultato `result`, None se fallita)
+    in tutti i target che la usano: il primo ha già il file, negli altri viene
+    collegato. Aggiorna i risultati dei cataloghi, il journal e i falliti (con
+    il numero dell'immagine nel suo CSV, come --continue-from).
+    """
+    # Le righe delle immagini riprese sono già nel journal
+    record = journal is not None and not image.get('resumed')
+    primary_catalog, primary_name, _ = image['targets'][0]
+    if not result:
+        for catalog, name, number in image['targets']:
+            if failed_downloads is not None:
+                failed_downloads.append((catalog['csv'], number, name, image['url']))
+            if record:
+                journal.record(catalog['csv'], name, image['url'], catalog['sink'].folder, None)
+        return
+    source_path = primary_catalog['sink'].path(result)
+    extension = os.path.splitext(result)[1]
+    for catalog, name, number in image['targets']:
+        catalog['changed'] = True
+        if catalog is primary_catalog and name == primary_name:
+            catalog['results'][name] = result
+            continue
+        filename = f"{name}{extension}"
+        try:
+            catalog['sink'].link(source_path, filename, variants)
+            catalog['results'][name] = filename
+        except OSError as e:
+            logger.error(f"Impossibile copiare {source_path} in {catalog['sink'].folder}: {e}")
+            filename = None
+            if failed_downloads is not None:
+                failed_downloads.append((catalog['csv'], number, name, image['url']))
+        if record:
+            journal.record(catalog['csv'], name, image['url'], catalog['sink'].folder, filename)
+
+
+def process_csvs(csv_files, fetcher, converter, naming='strict', journal=None, resume=False, continue_from=None,
+                 metrics=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, shard=None, update_csvs=True,
+                 failed_path=FAILED_DOWNLOADS, sink_factory=FolderSink):
+    """
+    Processa uno o più file CSV scaricando ogni immagine una sola volta.
+
+    Le righe di tutti i CSV vengono raggruppate per URL normalizzato: ogni URL
+    viene scaricato con `fetcher` e convertito da `converter` una volta sola e
+    il file prodotto viene poi collegato (hardlink, o copia se non possibile)
+    nelle cartelle degli altri cataloghi che lo usano. Anche URL diversi con lo
+    stesso contenuto vengono convertiti una volta sola (vedi Converter).
+    `naming` è la regola per i nomi dei file (vedi pipeline/naming.py).
+    Con un `journal` (JobJournal) l'esito di ogni riga viene registrato; con
+    `resume` le immagini già completate secondo il journal non vengono riscaricate.
+    Con `metrics` (RunMetrics) vengono raccolti i tempi di ogni immagine scaricata.
+
+    Le immagini vengono raccolte nell'ordine in cui si completano, non in
+    quello dei CSV: un'immagine lenta non ritarda le altre. Ogni
+    `checkpoint_interval` secondi (0 = mai) i _local.csv dei cataloghi con
+    nuove immagini vengono riscritti con quelle già pronte, così un run
+    interrotto lascia cataloghi utilizzabili.
+
+    Con `shard` (indice, numero di shard) vengono scaricate solo le immagini
+    dello shard; con `update_csvs` False i _local.csv non vengono scritti (li
+    ricostruisce dal journal chi ha lanciato gli shard, vedi pipeline/batch.py).
+    Le immagini fallite vengono elencate in `failed_path`; `sink_factory` crea
+    il sink di ogni catalogo (vedi pipeline/sinks.py).
+    """
+    catalogs, unique_images = plan_downloads(csv_files, naming, continue_from, shard, sink_factory)
+    if not unique_images:
+        return
+
+    total_tasks = sum(len(catalog['tasks']) for catalog in catalogs)
+    total_images = len(unique_images)
+    logger.info(f"\nImmagini uniche da scaricare: {total_images} (su {total_tasks} righe in {len(catalogs)} CSV)")
+
+    completions = queue.SimpleQueue()
+
+    def completed(i, result):
+        completions.put((i, result))
+
+    # Con --resume le immagini già completate (nel loro primo target) non vengono riscaricate
+    resumed = 0
+    for i, image in enumerate(unique_images):
+        catalog, name, _ = image['targets'][0]
+        output = None
+        if journal is not None and resume:
+            output = journal.completed(catalog['csv'], name, image['url'], catalog['sink'].folder)
+        if output:
+            resumed += 1
+            image['resumed'] = True
+            completed(i, output)
+            continue
+        when_resolved(submit_image(fetcher, converter, catalog['sink'], name, image['url'], i + 1, total_images,
+                                   journal, catalog['csv'], metrics),
+                      partial(completed, i))
+    if journal is not None and resume:
+        logger.info(f"Ripresa dal journal: {resumed} immagini già completate, {total_images - resumed} da scaricare")
+
+    failed_downloads = []
+    progress = Progress(total_images, metrics)
+    last_checkpoint = time.monotonic()
+    # Materializziamo ogni immagine in tutti i cataloghi/nomi che la usano, appena è pronta
+    for _ in range(total_images):
+        i, result = completions.get()
+        materialize_image(unique_images[i], result, converter.transform.variants, journal, failed_downloads)
+        progress.completed(bool(result))
+
+        if update_csvs and checkpoint_interval and time.monotonic() - last_checkpoint >= checkpoint_interval:
+            for catalog in catalogs:
+                if catalog.pop('changed', False):
+                    create_updated_csv(catalog['csv'], catalog['sink'].public_name, catalog['results'], naming,
+                                       converter.transform.variants, checkpoint=True)
+            last_checkpoint = time.monotonic()
+
+    for catalog in catalogs:
+        download_results = catalog['results']
+        successful_downloads = sum(1 for task in catalog['tasks'] if download_results.get(task['name']))
+
+        logger.info(f"\n--- Report per {catalog['csv']} ---")
+        logger.info(f"Immagini processate con successo: {successful_downloads}/{len(catalog['tasks'])}")
+
+        catalog['sink'].close()
+        if update_csvs:
+            create_updated_csv(catalog['csv'], catalog['sink'].public_name, download_results, naming,
+                               converter.transform.variants)
+        logger.info(f"--- Fine processamento per: {catalog['csv']} ---")
+
+    save_failed_downloads(failed_downloads, failed_path)
+
+
+# Segnaposto di run_windowed per le righe il cui URL è già stato sottomesso
+_DUPLICATE = object()
+
+
+def process_csvs_streaming(csv_files, fetcher, converter, window, naming='strict', journal=None, resume=False,
+                           continue_from=None, metrics=None, deadline=None, failed_path=FAILED_DOWNLOADS,
+                           sink_factory=FolderSink):
+    """
+    Come process_csvs, ma legge i CSV in streaming (vedi csv_stream), uno dopo
+    l'altro: al massimo `window` righe in lavorazione e _local.csv scritto riga
+    per riga, nell'ordine dell'input.
+
+    Un URL già visto nel run non viene riscaricato: dato che le righe vengono
+    completate in ordine, quando si arriva alla riga duplicata la prima è già
+    risolta e il suo file viene collegato (hardlink o copia) nella cartella
+    della riga. In memoria resta solo l'indice URL -> file, non le righe.
+
+    Con `deadline` (secondi) una riga più lenta non blocca la finestra: viene
+    scritta con l'URL originale e corretta nel _local.csv a fine CSV, quando la
+    sua immagine (riprovata una volta se fallisce) è pronta. Le righe duplicate
+    di un URL rimandato vengono collegate insieme a lei.
+    """
+    variants = converter.transform.variants
+    # URL normalizzato -> percorso del file prodotto (None finché è in lavorazione o se è fallito)
+    first_paths = {}
+    failed_downloads = []
+
+    for position, csv_file_path in enumerate(csv_files):
+        logger.info(f"\n--- Inizio processamento (streaming) per: {csv_file_path} ---")
+        if not os.path.exists(csv_file_path):
+            logger.error(f"File non trovato: {csv_file_path}")
+            continue
+        # Primo passaggio senza tenere le righe in memoria, solo per numerare i log [i/totale]
+        total_images = sum(1 for _, row in iter_rows(csv_file_path) if task_of(row, naming))
+        if not total_images:
+            logger.warning(f"Nessuna immagine valida trovata in {csv_file_path}.")
+            continue
+        logger.info(f"Trovate {total_images} immagini valide da processare.")
+
+        start_index = continue_from if position == 0 and continue_from else 1
+        if start_index > 1:
+            logger.info(f"Riprendendo dal download numero {start_index}")
+        sink = sink_factory(Path(csv_file_path).stem)
+        progress = Progress(total_images - start_index + 1, metrics)
+        # URL normalizzati rimandati oltre la scadenza -> righe duplicate in attesa del loro risultato
+        waiting = {}
+        # Numero di riga -> riga corretta, per le righe scritte prima di avere l'immagine
+        patched = {}
+
+        def numbered_rows():
+            index = 0
+            for row_number, row in iter_rows(csv_file_path):
+                task = task_of(row, naming)
+                if task is not None:
+                    index += 1
+                    if index < start_index:
+                        task = None
+                yield index, row, task, row_number
+
+        def submit(item):
+            index, row, task, _ = item
+            if task is None:
+                return None
+            key = normalize_url(task['url'])
+            if key in first_paths:
+                return _DUPLICATE
+            first_paths[key] = None
+            if journal is not None and resume:
+                output = journal.completed(csv_file_path, task['name'], task['url'], sink.folder)
+                if output:
+                    return output
+            return submit_image(fetcher, converter, sink, task['name'], task['url'], index, total_images,
+                                journal, csv_file_path, metrics)
+
+        def retry(item):
+            index, row, task, _ = item
+            logger.info(f"[{index}/{total_images}] Nuovo tentativo per l'immagine rimandata: {task['url']}")
+            return submit_image(fetcher, converter, sink, task['name'], task['url'], index, total_images,
+                                journal, csv_file_path, metrics)
+
+        def resolve_row(index, row, task, result):
+            # Esito definitivo di una riga: collega i duplicati, aggiorna journal e falliti e ritorna il file (o None)
+            key = normalize_url(task['url'])
+            if result is _DUPLICATE:
+                result = None
+                source_path = first_paths[key]
+                if source_path:
+                    filename = f"{task['name']}{os.path.splitext(source_path)[1]}"
+                    try:
+                        sink.link(source_path, filename, variants)
+                        result = filename
+                    except OSError as e:
+                        logger.error(f"Impossibile copiare {source_path} in {sink.folder}: {e}")
+                if journal is not None:
+                    journal.record(csv_file_path, task['name'], task['url'], sink.folder, result)
+            elif result:
+                first_paths[key] = sink.path(result)
+            elif journal is not None:
+                journal.record(csv_file_path, task['name'], task['url'], sink.folder, None)
+            if result:
+                set_image_urls(row, sink.public_name, result, variants)
+            else:
+                failed_downloads.append((csv_file_path, index, task['name'], task['url']))
+            progress.completed(bool(result))
+            return result
+
+        successful_downloads = 0
+        deferred_rows = set()
+        fieldnames = variant_fieldnames(read_fieldnames(csv_file_path), variants)
+        with LocalCsvWriter(csv_file_path, fieldnames) as writer:
+            for (index, row, task, row_number), result in run_windowed(numbered_rows(), submit, window, deadline,
+                                                                       retry):
+                if task is None:
+                    writer.write_row(row)
+                    continue
+                key = normalize_url(task['url'])
+                if result is DEFERRED:
+                    # Per ora la riga resta con l'URL originale
+                    deferred_rows.add(row_number)
+                    waiting[key] = []
+                    writer.write_row(row)
+                elif result is _DUPLICATE and key in waiting:
+                    waiting[key].append((index, row, task, row_number))
+                    writer.write_row(row)
+                elif row_number in deferred_rows:
+                    # Risultato arrivato in ritardo: la riga (e i suoi duplicati) vanno corretti nel _local.csv
+                    rows = [(index, row, task, row_number, result)]
+                    rows += [(*item, _DUPLICATE) for item in waiting.pop(key)]
+                    for late_index, late_row, late_task, late_number, late_result in rows:
+                        if resolve_row(late_index, late_row, late_task, late_result):
+                            successful_downloads += 1
+                            patched[late_number] = late_row
+                else:
+                    if resolve_row(index, row, task, result):
+                        successful_downloads += 1
+                    writer.write_row(row)
+        sink.close()
+        if patched:
+            patch_local_csv(writer.path, patched)
+
+        logger.info(f"\n--- Report per {csv_file_path} ---")
+        logger.info(f"Immagini processate con successo: {successful_downloads}/{total_images}")
+        logger.info(f"Nuovo CSV creato: {writer.path}")
+        logger.info(f"--- Fine processamento per: {csv_file_path} ---")
+
+    save_failed_downloads(failed_downloads, failed_path)
@@ -0,0 +1,152 @@
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from urllib.parse import urlparse
+
+# ==============================================================================
+# SCHEDULER PER HOST DEI DOWNLOAD (--host-scheduler)
+# ==============================================================================
+# Senza scheduler le righe arrivano al fetcher nell'ordine dei CSV: se un
+# catalogo mescola un host lento (o rallentato dai 429) con host veloci, tutti
+# i worker finiscono sull'host lento e gli altri restano fermi.
+# HostScheduler si mette davanti al fetcher con la stessa interfaccia
+# (submit -> Future) e tiene una coda FIFO per host degli URL estratti dalle
+# righe (vedi task_of in pipeline/naming.py). Al fetcher passano al massimo
+# `slots` download alla volta (uno per worker); ogni posto libero va all'host:
+#   1. senza attesa del rate limiter, se ce n'è almeno uno (gli host bloccati
+#      da un 429 non occupano worker finché ci sono altri host da servire)
+#   2. con meno download in corso rispetto al suo peso (weighted fair queueing
+#      sulla concorrenza: con pesi uguali i worker si dividono tra gli host)
+#   3. servito meno (rispetto al peso) finora, a parità dei precedenti
+# senza mai superare il limite di concorrenza dell'host. Peso ("weight") e
+# limite ("concurrency") di un host si indicano nel file di --rate-config:
+#   "hosts": {"www.hilti.it": {"rate": 2, "burst": 2, "weight": 1, "concurrency": 2}}
+# Se un solo host ha immagini da scaricare le usa tutti i worker (entro il
+# suo limite): lo scheduler non lascia mai worker fermi quando c'è lavoro.
+
+logger = logging.getLogger(__name__)
+
+
+class _Host:
+    """Coda e contatori di un host nello scheduler."""
+
+    def __init__(self, weight=1.0, concurrency=None):
+        self.queue = deque()
+        self.weight = weight
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.served = 0.0   # Download avviati diviso il peso (tempo virtuale del fair queueing)
+
+
+class HostScheduler:
+    """
+    Fetcher che distribuisce i download di `fetcher` tra gli host (vedi
+    l'intestazione del modulo): al massimo `slots` download in corso,
+    `max_per_host` per host se indicato. Chiudendolo si chiude anche il fetcher.
+    """
+
+    def __init__(self, fetcher, slots, max_per_host=None, rate_limiter=None):
+        self.fetcher = fetcher
+        self.slots = slots
+        self.max_per_host = max_per_host
+        self.rate_limiter = rate_limiter if rate_limiter is not None else fetcher.rate_limiter
+        self._hosts = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _host(self, name):
+        host = self._hosts.get(name)
+        if host is None:
+            weight = float(self.rate_limiter.host_option(name, 'weight', 1))
+            concurrency = self.rate_limiter.host_option(name, 'concurrency', self.max_per_host)
+            host = _Host(weight, concurrency)
+            # Un host nuovo parte dal tempo virtuale degli altri, non da zero
+            active = [other.served for other in self._hosts.values() if other.queue or other.in_flight]
+            host.served = min(active, default=0.0)
+            self._hosts[name] = host
+        return host
+
+    def submit(self, url, index, total, handle, headers=None, metrics=None):
+        future = Future()
+        with self._lock:
+            self._host(urlparse(url).netloc).queue.append((url, index, total, handle, headers, metrics, future))
+        self._dispatch()
+        return future
+
+    def _next(self):
+        # Host a cui dare il prossimo posto libero (None se nessuno può riceverlo); da chiamare con il lock
+        candidates = [host for host in self._hosts.values()
+                      if host.queue and (host.concurrency is None or host.in_flight < host.concurrency)]
+        if not candidates:
+            return None
+        ready = [host for host in candidates if self.rate_limiter.delay(host.queue[0][0]) <= 0]
+        return min(ready or candidates, key=lambda host: (host.in_flight / host.weight, host.served))
+
+    def _dispatch(self):
+        jobs = []
+        with self._lock:
+            while self._in_flight < self.slots:
+                host = self._next()
+                if host is None:
+                    break
+                host.in_flight += 1
+                host.served += 1 / host.weight
+                self._in_flight += 1
+                jobs.append((host, host.queue.popleft()))
+        for host, (url, index, total, handle, headers, metrics, future) in jobs:
+            try:
+                inner = self.fetcher.submit(url, index, total, handle, headers, metrics)
+            except Exception as e:
+                self._release(host, future, None, error=e)
+                continue
+            inner.add_done_callback(partial(self._done, host, future))
+
+    def _done(self, host, future, inner):
+        try:
+            result, error = inner.result(), None
+        except Exception as e:
+            result, error = None, e
+        self._release(host, future, result, error)
+
+    def _release(self, host, future, result, error=None):
+        with self._lock:
+            host.in_flight -= 1
+            self._in_flight -= 1
+        # Il posto liberato va subito a un altro download, prima di proseguire con il risultato
+        self._dispatch()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def close(self):
+        # Le immagini ancora in coda (run interrotto) non vengono più scaricate
+        with self._lock:
+            pending = [job for host in self._hosts.values() for job in host.queue]
+            for host in self._hosts.values():
+                host.queue.clear()
+        for job in pending:
+            job[-1].cancel()
+        self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_scheduler_arguments(parser):
+    """Aggiunge al parser argparse le opzioni dello scheduler per host."""
+    parser.add_argument("--host-scheduler", action=argparse.BooleanOptionalAction, default=True, help="Distribuisce i worker tra gli host delle immagini invece di seguire l'ordine dei CSV (default: attivo)")
+    parser.add_argument("--host-concurrency", type=int, help="Download contemporanei massimi per host (default: nessun limite oltre --workers; per singolo host con \"concurrency\" in --rate-config)")
+
+
+def scheduler_from_args(args, fetcher, rate_limiter=None):
+    """Mette un HostScheduler davanti al fetcher secondo le opzioni di add_scheduler_arguments."""
+    if not args.host_scheduler:
+        return fetcher
+    return HostScheduler(fetcher, args.workers, args.host_concurrency, rate_limiter)
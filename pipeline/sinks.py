@@ -0,0 +1,222 @@
+import io
+import os
+import re
+import shutil
+import socket
+import itertools
+from functools import partial
+from pathlib import Path
+
+from image_resize import variant_filename
+from pipeline.metrics import timed
+from pipeline.pack import pack_folder
+
+# ==============================================================================
+# SINK: DOVE FINISCONO LE IMMAGINI CONVERTITE
+# ==============================================================================
+# Il sink di un catalogo riceve le immagini già trasformate e le rende
+# disponibili con il loro nome di file; il runner scrive poi nel _local.csv il
+# percorso pubblico /images/<cartella>/<file>. FolderSink scrive nella cartella
+# che ha il nome del CSV. Un sink è serializzabile, quindi può essere passato
+# ai processi dello stadio di conversione insieme alla trasformazione.
+#
+# Ogni file viene scritto in un file temporaneo nascosto nella stessa cartella
+# (.<nome>.<host>-<pid>-<n>.tmp) e poi rinominato: un'interruzione a metà
+# scrittura lascia al più un temporaneo, mai un'immagine troncata con il nome
+# finale che i controlli di esistenza (--resume, file già convertiti)
+# prenderebbero per buona. All'apertura della cartella vengono rimossi i
+# temporanei dei processi non più attivi di questa macchina: su uno storage
+# condiviso (batch con --shard) quelli delle altre macchine restano intatti. Con --fsync i dati arrivano su disco prima della rinomina:
+#   none   nessun fsync (default): atomico rispetto ai crash del processo
+#   file   fsync del file e della cartella a ogni immagine
+#   batch  fsync del file, quello della cartella ogni --fsync-batch immagini
+#          (per processo) e alla chiusura del sink: meno operazioni sui
+#          metadati con decine di migliaia di file piccoli su storage di rete
+#
+# Con --pack (PackSink) la cartella viene anche raccolta, a fine catalogo, nel
+# pacchetto <cartella>.pack con il suo indice (vedi pipeline/pack.py); con
+# --pack-references il _local.csv punta a /images/<cartella>.pack/<file>.
+
+
+FSYNC_MODES = ('none', 'file', 'batch')
+DEFAULT_FSYNC_BATCH = 100
+
+# Nome della macchina nei temporanei, ridotto ai caratteri che non si confondono con i separatori del nome
+HOST_TAG = re.sub(r'[^A-Za-z0-9_]', '_', socket.gethostname()) or 'host'
+_TEMPORARY = re.compile(r'^\..+\.([A-Za-z0-9_]+)-(\d+)-\d+\.tmp$')
+_temporary_ids = itertools.count()
+# Cartella -> file rinominati dall'ultimo fsync della cartella, nel processo corrente (--fsync batch)
+_unsynced = {}
+
+
+def temporary_path(path):
+    """File temporaneo nascosto, nella stessa cartella, da cui `path` viene poi rinominato."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{HOST_TAG}-{os.getpid()}-{next(_temporary_ids)}.tmp")
+
+
+def fsync_directory(directory):
+    """Porta su disco le voci della cartella (creazioni e rinomine dei file)."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, fsync=False):
+    """Scrive `data` in `path` passando da un file temporaneo rinominato; con `fsync` i dati sono su disco prima."""
+    temporary = temporary_path(path)
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def remove_stale_temporaries(folder):
+    """
+    Rimuove i file temporanei lasciati nella cartella da processi non più attivi
+    di questa macchina (run interrotti); il pid di un'altra macchina non si può verificare.
+    """
+    for entry in os.scandir(folder):
+        match = _TEMPORARY.match(entry.name)
+        if match is None or match.group(1) != HOST_TAG:
+            continue
+        try:
+            os.kill(int(match.group(2)), 0)
+        except ProcessLookupError:
+            os.remove(entry.path)
+        except (PermissionError, OverflowError):
+            pass
+
+
+def is_current_copy(source_path, dest_path):
+    """True se dest_path ha dimensione e mtime di source_path, come una sua copia (shutil.copy2 conserva la mtime)."""
+    source, dest = os.stat(source_path), os.stat(dest_path)
+    return source.st_size == dest.st_size and source.st_mtime_ns == dest.st_mtime_ns
+
+
+def link_or_copy(source_path, dest_path, overwrite=False):
+    """
+    Rende disponibile source_path anche come dest_path con un hardlink (o una
+    copia se non possibile). Un dest_path esistente che non è lo stesso file
+    viene sostituito, salvo che sia una copia aggiornata (is_current_copy) e
+    non ci sia `overwrite`: la scrittura atomica dei sink rimpiazza il file
+    sorgente con un inode nuovo, e i vecchi hardlink non si aggiornano da soli.
+    """
+    if os.path.exists(dest_path):
+        if os.path.samefile(source_path, dest_path) or (not overwrite and is_current_copy(source_path, dest_path)):
+            return
+        os.remove(dest_path)
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        # Anche la copia passa da un temporaneo: mai un file a metà con il nome finale
+        temporary = temporary_path(dest_path)
+        shutil.copy2(source_path, temporary)
+        os.replace(temporary, dest_path)
+
+
+def link_with_variants(source_path, dest_path, variants=(), overwrite=False):
+    """Come link_or_copy, collegando anche le varianti ridotte (vedi image_resize) del file."""
+    link_or_copy(source_path, dest_path, overwrite=overwrite)
+    for size in variants:
+        link_or_copy(variant_filename(source_path, size), variant_filename(dest_path, size), overwrite=overwrite)
+
+
+class FolderSink:
+    """
+    Cartella di output delle immagini di un catalogo (creata se non esiste),
+    scritta con file temporanei rinominati; `fsync` è una di FSYNC_MODES.
+    Va chiusa con close() a fine catalogo (fsync finale della cartella).
+    """
+
+    def __init__(self, folder, fsync='none', fsync_batch=DEFAULT_FSYNC_BATCH):
+        self.folder = Path(folder)
+        self.name = self.folder.name
+        self.public_name = self.name    # Cartella nei percorsi /images/... del _local.csv
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.folder.mkdir(parents=True, exist_ok=True)
+        remove_stale_temporaries(self.folder)
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    def save(self, img, filename, save_format, save_options, metrics=None):
+        """
+        Codifica l'immagine nel formato indicato e la salva come `filename`.
+        La codifica avviene in memoria, così `metrics` separa i tempi di encode e write.
+        """
+        buffer = io.BytesIO()
+        with timed(metrics, 'encode'):
+            img.save(buffer, save_format, **save_options)
+        with timed(metrics, 'write'):
+            atomic_write(self.path(filename), buffer.getbuffer(), fsync=self.fsync != 'none')
+            self._renamed(1)
+        if metrics is not None:
+            metrics.wrote(buffer.tell())
+
+    def link(self, source_path, filename, variants=(), overwrite=False):
+        """Rende disponibile un file già prodotto (anche di un altro sink) come `filename`, con le sue varianti."""
+        link_with_variants(source_path, self.path(filename), variants, overwrite=overwrite)
+        self._renamed(1 + len(variants))
+
+    def _renamed(self, count):
+        # Nuove voci nella cartella: fsync della cartella subito (file) o ogni fsync_batch voci (batch)
+        if self.fsync == 'none':
+            return
+        key = str(self.folder)
+        pending = _unsynced.get(key, 0) + count
+        if self.fsync == 'file' or pending >= self.fsync_batch:
+            fsync_directory(self.folder)
+            pending = 0
+        _unsynced[key] = pending
+
+    def close(self):
+        """Fine del catalogo: con --fsync le voci ancora in sospeso (anche di altri processi) vanno su disco."""
+        if self.fsync != 'none':
+            fsync_directory(self.folder)
+            _unsynced.pop(str(self.folder), None)
+
+
+class PackSink(FolderSink):
+    """
+    FolderSink che a ogni close() aggiunge le immagini nuove o cambiate della
+    cartella al pacchetto <cartella>.pack; con `references` i percorsi del
+    _local.csv sono relativi al pacchetto.
+    """
+
+    def __init__(self, folder, fsync='none', fsync_batch=DEFAULT_FSYNC_BATCH, references=False):
+        super().__init__(folder, fsync, fsync_batch)
+        if references:
+            self.public_name = f"{self.name}.pack"
+
+    def close(self):
+        super().close()
+        pack_folder(self.folder, fsync=self.fsync != 'none')
+
+
+def add_sink_arguments(parser):
+    """Aggiunge al parser argparse le opzioni dei sink."""
+    parser.add_argument("--fsync", choices=FSYNC_MODES, default='none', help="Porta su disco le immagini prima di renderle visibili: 'file' a ogni immagine, 'batch' con un fsync della cartella ogni --fsync-batch immagini (default: none, solo scrittura atomica)")
+    parser.add_argument("--fsync-batch", type=int, default=DEFAULT_FSYNC_BATCH, help=f"Con --fsync batch, immagini tra due fsync della cartella (default: {DEFAULT_FSYNC_BATCH})")
+    parser.add_argument("--pack", action="store_true", help="A fine catalogo raccoglie le immagini della cartella nel pacchetto <cartella>.pack con indice (vedi pipeline/pack.py)")
+    parser.add_argument("--pack-references", action="store_true", help="Il _local.csv punta a /images/<cartella>.pack/<file> (implica --pack)")
+
+
+def sink_factory_from_args(args):
+    """Costruttore dei sink dei cataloghi (nome della cartella -> sink) dalle opzioni di add_sink_arguments."""
+    if args.pack or args.pack_references:
+        return partial(PackSink, fsync=args.fsync, fsync_batch=args.fsync_batch, references=args.pack_references)
+    return partial(FolderSink, fsync=args.fsync, fsync_batch=args.fsync_batch)
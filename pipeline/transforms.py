@@ -0,0 +1,200 @@
+import io
+import argparse
+import logging
+from PIL import Image
+
+from image_analysis import add_analysis_arguments, analyze_image
+from image_resize import add_resize_arguments, add_variant_arguments, iter_variants, reduce_image, variant_filename
+from output_formats import OutputFormats, add_output_format_arguments, output_formats_from_args
+from perceptual_index import add_phash_arguments, perceptual_hash, phash_index_from_args
+from pipeline.metrics import timed
+
+# ==============================================================================
+# TRASFORMAZIONE DELLE IMMAGINI SCARICATE
+# ==============================================================================
+# ImageTransform converte i byte scaricati nel file finale, decodificando
+# l'immagine una sola volta:
+#   1. riduzione già in decodifica (--max-size, vedi image_resize)
+#   2. analisi dei pixel: trasparenza reale e bordi da tagliare (image_analysis)
+#   3. con --flatten la trasparenza viene composta su sfondo bianco (con
+#      --no-flatten-square solo per le immagini che non sono già quadrate)
+#   4. con --square l'immagine viene centrata su una tela quadrata
+#   5. un'unica codifica nel formato scelto da OutputFormats, più le varianti
+#      ridotte (--variants) ricavate dalla stessa immagine
+# Con un PerceptualIndex (--phash-index) un'immagine quasi identica a una già
+# prodotta nella stessa cartella non viene codificata: si usa il file esistente.
+# La trasformazione è serializzabile e gira anche nei processi dello stadio di
+# conversione (vedi pipeline/conversion.py). Con un ImageMetrics vengono
+# misurati gli stadi decode, square (analisi, bordi, tela e varianti), encode
+# e write (vedi pipeline/metrics.py).
+
+logger = logging.getLogger(__name__)
+
+
+def image_has_transparency(img):
+    """
+    True se l'immagine (già aperta) ha un canale alpha o un colore trasparente.
+    Guarda solo il modo: per sapere se i pixel sono davvero trasparenti vedi analyze_image.
+    """
+    return (
+        img.mode in ('RGBA', 'LA', 'PA') or
+        (img.mode == 'P' and 'transparency' in img.info)
+    )
+
+
+def flatten_image(img):
+    """Compone l'immagine su uno sfondo bianco e ritorna un'immagine RGB senza trasparenza."""
+    img = img.convert('RGBA')
+    background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, img).convert('RGB')
+
+
+def square_image(img, has_transparency):
+    """
+    Centra l'immagine su una tela quadrata, tutto in memoria.
+    La tela è trasparente se l'immagine ha trasparenza, bianca altrimenti.
+    Se l'immagine è già quadrata viene restituita così com'è.
+    """
+    width, height = img.size
+    if width == height:
+        return img
+
+    # Trova la dimensione più grande che diventerà la dimensione del nostro quadrato.
+    max_dim = max(width, height)
+
+    # Calcola le coordinate per centrare l'immagine
+    paste_x = (max_dim - width) // 2
+    paste_y = (max_dim - height) // 2
+
+    if has_transparency:
+        # Mantieni la trasparenza
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+
+        # Crea una tela quadrata trasparente e incolla usando l'immagine come maschera alpha
+        square_canvas = Image.new('RGBA', (max_dim, max_dim), (0, 0, 0, 0))
+        square_canvas.paste(img, (paste_x, paste_y), img)
+    else:
+        # Immagine senza trasparenza - usa sfondo bianco
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        square_canvas = Image.new('RGB', (max_dim, max_dim), (255, 255, 255))
+        square_canvas.paste(img, (paste_x, paste_y))
+
+    return square_canvas
+
+
+class ImageTransform:
+    """
+    Trasformazione dei byte scaricati nel file finale (vedi l'intestazione del
+    modulo). `square` rende l'immagine quadrata tagliando prima i bordi
+    trasparenti (e quasi bianchi con `trim_white`), `flatten` elimina la
+    trasparenza (anche delle immagini già quadrate solo con `flatten_square`),
+    `max_size` e `variants` regolano le dimensioni, `formats` (OutputFormats)
+    il formato di salvataggio.
+    """
+
+    def __init__(self, square=True, flatten=False, max_size=None, variants=(), trim_white=False, formats=None,
+                 phash_index=None, flatten_square=True):
+        self.square = square
+        self.flatten = flatten
+        self.flatten_square = flatten_square
+        self.max_size = max_size
+        self.variants = tuple(variants)
+        self.trim_white = trim_white
+        self.formats = formats if formats is not None else OutputFormats()
+        self.phash_index = phash_index
+
+    def extensions(self):
+        """Estensioni possibili dei file prodotti, prima di conoscere l'immagine."""
+        return self.formats.extensions(not self.flatten or not self.flatten_square)
+
+    def existing_output(self, sink, name):
+        """Nome del file già prodotto per `name` nel sink (con tutte le varianti), None se manca."""
+        for extension in self.extensions():
+            filename = f"{name}{extension}"
+            if sink.exists(filename) and all(sink.exists(variant_filename(filename, size)) for size in self.variants):
+                return filename
+        return None
+
+    def apply(self, content, sink, name, url, index, total, metrics=None):
+        """
+        Converte i byte di un'immagine e salva il risultato nel sink come
+        `name` più l'estensione del formato scelto. Ritorna il nome del file
+        salvato (o di quello quasi identico già presente, con l'indice percettivo).
+        `metrics` è l'eventuale ImageMetrics in cui registrare i tempi degli stadi.
+        """
+        # Image.open legge solo l'header: modo e dimensioni sono noti senza decodificare i pixel
+        with Image.open(io.BytesIO(content)) as img:
+            # Dal modo si sa solo se la trasparenza è possibile: senza canale alpha è sicuramente opaca
+            may_have_transparency = image_has_transparency(img)
+
+            with timed(metrics, 'decode'):
+                # Riduzione prima dei bordi: la tela quadrata nasce già alla dimensione finale
+                reduced = reduce_image(img, self.max_size)
+                reduced.load()
+
+            with timed(metrics, 'square'):
+                # Analisi dei pixel sull'immagine già ridotta: trasparenza reale e bordi da tagliare
+                trim_white = self.square and self.trim_white
+                already_square = reduced.size[0] == reduced.size[1]
+                has_transparency, bbox = (analyze_image(reduced, trim_white) if may_have_transparency or trim_white
+                                          else (False, None))
+                if bbox is not None and self.square:
+                    reduced = reduced.crop(bbox)
+                if has_transparency and self.flatten and (self.flatten_square or not already_square):
+                    reduced, has_transparency = flatten_image(reduced), False
+
+                if self.phash_index is not None:
+                    # Hash dopo riduzione e taglio dei bordi: l'imbottitura diversa non conta
+                    phash = perceptual_hash(reduced)
+                    own_filenames = [f"{name}{extension}" for extension in self.extensions()]
+                    similar_filename = self.phash_index.find(phash, sink.folder, exclude=own_filenames)
+                    if similar_filename is not None and all(
+                        sink.exists(variant_filename(similar_filename, size)) for size in self.variants
+                    ):
+                        logger.info(f"[{index}/{total}] Immagine quasi identica a {similar_filename}, nessuna conversione: {url}")
+                        return similar_filename
+
+                file_extension, save_format, save_options = self.formats.for_image(has_transparency)
+                filename = f"{name}{file_extension}"
+                if self.square:
+                    width, height = reduced.size
+                    if width != height:
+                        logger.info(f"L'immagine non è quadrata ({width}x{height}). Aggiunta di bordi a: {sink.path(filename)}")
+                    output = square_image(reduced, has_transparency)
+                elif reduced.mode not in ('RGB', 'RGBA'):
+                    output = reduced.convert('RGBA' if has_transparency else 'RGB')
+                else:
+                    output = reduced
+                # Varianti ridotte ricavate ognuna dalla precedente
+                variants = list(iter_variants(output, self.variants))
+
+            # Unica codifica dell'immagine, seguita dalle varianti
+            sink.save(output, filename, save_format, save_options, metrics)
+            for size, variant in variants:
+                sink.save(variant, variant_filename(filename, size), save_format, save_options, metrics)
+
+        logger.info(f"[{index}/{total}] Scaricato e convertito: {url} -> {sink.path(filename)}")
+        if self.phash_index is not None:
+            self.phash_index.add(phash, sink.folder, filename)
+        return filename
+
+
+def add_transform_arguments(parser):
+    """Aggiunge al parser argparse le opzioni della trasformazione delle immagini."""
+    parser.add_argument("--square", action=argparse.BooleanOptionalAction, default=True, help="Rende quadrate le immagini centrandole su una tela (default: attivo)")
+    parser.add_argument("--flatten", action=argparse.BooleanOptionalAction, default=False, help="Compone la trasparenza su sfondo bianco: tutte le immagini diventano WebP opachi")
+    parser.add_argument("--flatten-square", action=argparse.BooleanOptionalAction, default=True, help="Con --flatten, compone su bianco anche le immagini già quadrate; con --no-flatten-square restano trasparenti (default: attivo)")
+    add_resize_arguments(parser)
+    add_variant_arguments(parser)
+    add_analysis_arguments(parser)
+    add_output_format_arguments(parser)
+    add_phash_arguments(parser)
+
+
+def transform_from_args(args):
+    """Crea l'ImageTransform dalle opzioni di add_transform_arguments."""
+    return ImageTransform(args.square, args.flatten, args.max_size, args.variants, args.trim_white,
+                          output_formats_from_args(args), phash_index_from_args(args), args.flatten_square)
@@ -0,0 +1,193 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# ==============================================================================
+# RATE LIMITER PER HOST (TOKEN BUCKET ADATTIVO)
+# ==============================================================================
+# Sostituisce il ritardo casuale fisso prima di ogni richiesta: ogni host ha un
+# proprio token bucket (richieste/secondo + burst) condiviso da tutti i worker,
+# quindi si aspetta solo quando un host sta effettivamente ricevendo troppe
+# richieste. Il rate si adatta: un 429/503 lo dimezza e blocca l'host per il
+# tempo indicato da Retry-After, una serie di risposte pulite lo fa risalire
+# fino al valore configurato.
+#
+# File di configurazione opzionale (JSON):
+# {
+#     "default": {"rate": 5, "burst": 10},
+#     "hosts": {
+#         "www.hilti.it": {"rate": 2, "burst": 2},
+#         "gattoni.it": {"rate": 20, "burst": 40}
+#     }
+# }
+# Un dominio vale anche per i suoi sottodomini (gattoni.it -> cdn.gattoni.it).
+# Le altre chiavi di un host (es. "weight" e "concurrency" dello scheduler, vedi
+# pipeline/scheduler.py) si leggono con host_option.
+
+logger = logging.getLogger(__name__)
+
+MIN_RATE = 0.1            # Richieste/secondo minime dopo i rallentamenti
+RECOVERY_AFTER = 20       # Risposte pulite consecutive prima di accelerare
+RECOVERY_FACTOR = 1.25    # Fattore di accelerazione (fino al rate configurato)
+THROTTLED_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """Converte l'header Retry-After (secondi o data HTTP) in secondi di attesa, None se assente/non valido."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class _HostBucket:
+    """Stato del token bucket di un singolo host."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.clean_responses = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class HostRateLimiter:
+    """
+    Token bucket per host, thread-safe e utilizzabile anche da asyncio.
+
+    `rate` e `burst` sono i valori di default; `host_limits` è un dizionario
+    dominio -> {"rate": ..., "burst": ...} con eventuali valori specifici.
+    """
+
+    def __init__(self, rate=5.0, burst=10, host_limits=None):
+        self.rate = rate
+        self.burst = burst
+        self.host_limits = host_limits or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path=None, rate=5.0, burst=10):
+        """Crea il limiter leggendo (se indicato) il file JSON di configurazione per dominio."""
+        if not config_path:
+            return cls(rate, burst)
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        default = config.get('default', {})
+        return cls(
+            rate=default.get('rate', rate),
+            burst=default.get('burst', burst),
+            host_limits=config.get('hosts', {})
+        )
+
+    def _host_config(self, host):
+        # Cerca l'host e poi i domini padre: cdn.gattoni.it -> gattoni.it -> it
+        parts = host.split('.')
+        for i in range(len(parts)):
+            limits = self.host_limits.get('.'.join(parts[i:]))
+            if limits:
+                return limits
+        return {}
+
+    def _limits_for(self, host):
+        limits = self._host_config(host)
+        return limits.get('rate', self.rate), limits.get('burst', self.burst)
+
+    def host_option(self, host, key, default=None):
+        """Valore di `key` nella configurazione dell'host (o di un suo dominio padre), `default` se manca."""
+        return self._host_config(host).get(key, default)
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = _HostBucket(*self._limits_for(host))
+            self._buckets[host] = bucket
+        return bucket
+
+    def reserve(self, url):
+        """
+        Prenota un token per l'host dell'URL e ritorna i secondi da attendere
+        prima di poter inviare la richiesta (0 se c'è capacità disponibile).
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            bucket.refill(now)
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            return max(wait, bucket.blocked_until - now)
+
+    def delay(self, url):
+        """Secondi prima che l'host dell'URL abbia capacità, senza prenotare un token (0 se è libero)."""
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._bucket(host)
+            now = time.monotonic()
+            bucket.refill(now)
+            wait = (1 - bucket.tokens) / bucket.rate if bucket.tokens < 1 else 0.0
+            return max(wait, bucket.blocked_until - now)
+
+    def wait(self, url):
+        """Blocca il thread corrente finché l'host dell'URL non ha capacità."""
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url):
+        """Come wait(), ma senza bloccare l'event loop."""
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_response(self, url, status_code, retry_after=None):
+        """
+        Aggiorna il rate dell'host in base all'esito della richiesta.
+
+        Su 429/503 il rate viene dimezzato e l'host bloccato per `retry_after`
+        secondi (tutti i worker attendono, non solo quello che ha ricevuto l'errore).
+        Dopo RECOVERY_AFTER risposte pulite il rate risale verso il valore configurato.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._bucket(host)
+            if status_code in THROTTLED_STATUSES:
+                bucket.clean_responses = 0
+                bucket.rate = max(MIN_RATE, bucket.rate / 2)
+                if retry_after:
+                    bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+                logger.warning(f"Host {host} rallentato a {bucket.rate:.2f} richieste/s (status {status_code})")
+            elif status_code < 500:
+                bucket.clean_responses += 1
+                if bucket.clean_responses >= RECOVERY_AFTER and bucket.rate < bucket.max_rate:
+                    bucket.rate = min(bucket.max_rate, bucket.rate * RECOVERY_FACTOR)
+                    bucket.clean_responses = 0
+                    logger.info(f"Host {host} accelerato a {bucket.rate:.2f} richieste/s")
+
+
+def add_rate_limit_arguments(parser):
+    """Aggiunge al parser argparse le opzioni comuni del rate limiter."""
+    parser.add_argument("--rate", type=float, default=5.0, help="Richieste al secondo per host (default: 5)")
+    parser.add_argument("--burst", type=int, default=10, help="Richieste consecutive consentite senza attesa per host (default: 10)")
+    parser.add_argument("--rate-config", help="File JSON con rate/burst specifici per dominio (opzionale)")
+
+
+def rate_limiter_from_args(args):
+    """Crea l'HostRateLimiter a partire dalle opzioni aggiunte da add_rate_limit_arguments."""
+    return HostRateLimiter.from_config(args.rate_config, args.rate, args.burst)
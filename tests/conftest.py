@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Gli script e il pacchetto pipeline si importano dalla radice del repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
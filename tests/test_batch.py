@@ -0,0 +1,59 @@
+import pytest
+
+from pipeline.batch import parse_shard, partition_csvs, process_shards
+from pipeline.naming import url_shard
+
+URLS = [f"https://cdn{i % 7}.example.com/img/{i}.jpg" for i in range(3000)]
+
+
+def _owners(machines):
+    # (macchina, processo) che scaricano ogni URL, con `machines` = numero di processi di ogni macchina
+    owners = {url: [] for url in URLS}
+    for index, processes in enumerate(machines):
+        for k, (shard, count) in enumerate(process_shards((index, len(machines)), processes)):
+            for url in URLS:
+                if url_shard(url, count) == shard:
+                    owners[url].append((index, k))
+    return owners
+
+
+@pytest.mark.parametrize("machines", [[1], [4], [2, 2], [1, 3], [3, 2, 4]])
+def test_url_shards_cover_every_url_once(machines):
+    owners = _owners(machines)
+    assert all(len(found) == 1 for found in owners.values())
+    # Ogni macchina scarica esattamente il suo shard K/M, qualunque sia il numero dei suoi processi
+    for url, [(index, _)] in owners.items():
+        assert url_shard(url, len(machines)) == index
+    # Ogni processo riceve una parte del lavoro
+    assert len({owner for found in owners.values() for owner in found}) == sum(machines)
+
+
+def test_same_url_lands_in_same_shard():
+    assert url_shard("HTTP://Cdn.Example.com:80/a.jpg#x", 8) == url_shard("http://cdn.example.com/a.jpg", 8)
+
+
+def test_parse_shard():
+    assert parse_shard("0/1") == (0, 1)
+    assert parse_shard("2/3") == (2, 3)
+    for value in ("3/3", "-1/2", "1/0"):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_partition_csvs_balances_sizes_and_keeps_order(tmp_path):
+    sizes = {'a': 900, 'b': 100, 'c': 500, 'd': 400, 'e': 50}
+    csv_files = []
+    for name, size in sizes.items():
+        path = tmp_path / f"{name}.csv"
+        path.write_bytes(b'x' * size)
+        csv_files.append(str(path))
+
+    groups = partition_csvs(csv_files, 2)
+    assert sorted(csv_file for group in groups for csv_file in group) == sorted(csv_files)
+    loads = [sum(sizes[csv_file[-5]] for csv_file in group) for group in groups]
+    assert max(loads) - min(loads) <= 100
+    for group in groups:
+        assert group == [csv_file for csv_file in csv_files if csv_file in group]
+
+    # Mai più gruppi che CSV
+    assert len(partition_csvs(csv_files[:2], 4)) == 2
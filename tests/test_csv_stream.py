@@ -0,0 +1,88 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from csv_stream import DEFERRED, run_windowed
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        yield pool
+
+
+def _sleeping(executor, delays, outcome=lambda index: f"ok-{index}"):
+    # submit che completa l'item `index` dopo delays[index] secondi
+    def task(index):
+        time.sleep(delays[index])
+        return outcome(index)
+
+    return lambda item: executor.submit(task, item[0])
+
+
+def test_results_follow_input_order(executor):
+    # Gli item finiscono in ordine inverso, ma escono nell'ordine di input
+    delays = [0.05 * (5 - i) for i in range(6)]
+    results = list(run_windowed(((i,) for i in range(6)), _sleeping(executor, delays), window=6))
+    assert results == [((i,), f"ok-{i}") for i in range(6)]
+
+
+def test_plain_results_and_failures(executor):
+    def submit(item):
+        if item[0] == 1:
+            return "subito"
+        if item[0] == 2:
+            return executor.submit(lambda: 1 / 0)
+        return executor.submit(lambda: "ok")
+
+    results = list(run_windowed(((i,) for i in range(4)), submit, window=2))
+    assert results == [((0,), "ok"), ((1,), "subito"), ((2,), None), ((3,), "ok")]
+
+
+def test_window_bounds_items_in_flight(executor):
+    window, yielded, in_flight = 3, [], []
+    submit = _sleeping(executor, [0.01] * 20)
+
+    def tracking_submit(item):
+        in_flight.append(item[0] + 1 - len(yielded))
+        return submit(item)
+
+    for item, result in run_windowed(((i,) for i in range(20)), tracking_submit, window=window):
+        yielded.append(item)
+    assert len(yielded) == 20
+    assert max(in_flight) <= window
+
+
+def test_slow_head_is_deferred_past_deadline(executor):
+    delays = [0.6] + [0.01] * 5
+    results = list(run_windowed(((i,) for i in range(6)), _sleeping(executor, delays), window=2, deadline=0.1))
+    assert results[0] == ((0,), DEFERRED)
+    assert results[1:-1] == [((i,), f"ok-{i}") for i in range(1, 6)]
+    assert results[-1] == ((0,), "ok-0")
+
+
+def test_failed_deferred_item_is_retried(executor):
+    def outcome(index):
+        if index == 0:
+            raise OSError("timeout")
+        return f"ok-{index}"
+
+    delays = [0.4] + [0.01] * 3
+    retried = []
+
+    def retry(item):
+        retried.append(item)
+        return executor.submit(lambda: "riprovato")
+
+    results = list(run_windowed(((i,) for i in range(4)), _sleeping(executor, delays, outcome), window=2, deadline=0.1, retry=retry))
+    assert retried == [(0,)]
+    assert results[0] == ((0,), DEFERRED)
+    assert results[-1] == ((0,), "riprovato")
+
+
+def test_final_drain_does_not_defer(executor):
+    # Meno item della finestra: la finestra non è mai piena, niente da rimandare
+    delays = [0.3, 0.01]
+    results = list(run_windowed(((i,) for i in range(2)), _sleeping(executor, delays), window=4, deadline=0.05))
+    assert results == [((0,), "ok-0"), ((1,), "ok-1")]
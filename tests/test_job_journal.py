@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from job_journal import JobJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.sqlite3'))
+    yield journal
+    journal.close()
+
+
+def _output(folder, name, content=b'immagine'):
+    (folder / name).write_bytes(content)
+    return name
+
+
+def test_resume_skips_only_completed_images(journal, tmp_path):
+    _output(tmp_path, 'a.png')
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), 'a.png')
+    journal.record('cat.csv', 'b', 'http://x/b.jpg', str(tmp_path), None)
+
+    assert journal.completed('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path)) == 'a.png'
+    assert journal.completed('cat.csv', 'b', 'http://x/b.jpg', str(tmp_path)) is None
+    # URL cambiato nel CSV o immagine mai vista: da scaricare
+    assert journal.completed('cat.csv', 'a', 'http://x/a2.jpg', str(tmp_path)) is None
+    assert journal.completed('cat.csv', 'c', 'http://x/c.jpg', str(tmp_path)) is None
+
+
+def test_resume_uses_the_latest_outcome(journal, tmp_path):
+    _output(tmp_path, 'a.png')
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), 'a.png')
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), None)
+    assert journal.completed('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path)) is None
+
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), 'a.png')
+    assert journal.completed('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path)) == 'a.png'
+
+
+def test_resume_redownloads_missing_files(journal, tmp_path):
+    _output(tmp_path, 'a.png')
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), 'a.png')
+    (tmp_path / 'a.png').unlink()
+    assert journal.completed('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path)) is None
+
+
+def test_journal_survives_reopening(tmp_path):
+    _output(tmp_path, 'a.png')
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = JobJournal(path, batch_size=1000, flush_interval=1000)
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), 'a.png')
+    journal.close()
+
+    reopened = JobJournal(path)
+    try:
+        assert reopened.completed('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path)) == 'a.png'
+    finally:
+        reopened.close()
+
+
+def test_merge_filters_by_time_and_csv(journal, tmp_path):
+    source = JobJournal(str(tmp_path / 'processo.sqlite3'))
+    source.record('old.csv', 'a', 'http://x/a.jpg', str(tmp_path), None)
+    time.sleep(0.01)
+    since = time.time()
+    source.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), _output(tmp_path, 'a.png'))
+    source.record('cat.csv', 'b', 'http://x/b.jpg', str(tmp_path), None)
+    source.record('other.csv', 'c', 'http://x/c.jpg', str(tmp_path), _output(tmp_path, 'c.png'))
+    source.close()
+
+    assert journal.merge(str(tmp_path / 'processo.sqlite3'), since=since, csv_files=['cat.csv']) == 2
+    assert journal.latest_outputs('cat.csv') == {'a': 'a.png', 'b': None}
+    assert journal.latest_outputs('old.csv') == {}
+    assert journal.latest_outputs('other.csv') == {}
+
+    assert journal.merge(str(tmp_path / 'processo.sqlite3')) == 4
+    assert journal.latest_outputs('other.csv') == {'c': 'c.png'}
+
+
+def test_latest_outputs_keeps_last_outcome_since(journal, tmp_path):
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), _output(tmp_path, 'a.png'))
+    journal.record('cat.csv', 'b', 'http://x/b.jpg', str(tmp_path), _output(tmp_path, 'b.png'))
+    time.sleep(0.01)
+    since = time.time()
+    journal.record('cat.csv', 'a', 'http://x/a.jpg', str(tmp_path), None)
+
+    assert journal.latest_outputs('cat.csv') == {'a': None, 'b': 'b.png'}
+    assert journal.latest_outputs('cat.csv', since) == {'a': None}
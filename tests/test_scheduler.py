@@ -0,0 +1,102 @@
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+import pytest
+
+from pipeline.scheduler import HostScheduler
+from rate_limiter import HostRateLimiter
+
+
+class FakeFetcher:
+    """Fetcher che non scarica: tiene i Future dei download avviati, completati a mano dal test."""
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.started = []
+        self.closed = False
+
+    def submit(self, url, index, total, handle, headers=None, metrics=None):
+        future = Future()
+        self.started.append((url, future))
+        return future
+
+    def in_flight(self):
+        return [url for url, future in self.started if not future.done()]
+
+    def finish(self, url, result="ok"):
+        future = next(future for started, future in self.started if started == url and not future.done())
+        future.set_result(result)
+
+    def close(self):
+        self.closed = True
+
+
+def _scheduler(slots, host_limits=None, max_per_host=None):
+    fetcher = FakeFetcher(HostRateLimiter(rate=1000, burst=1000, host_limits=host_limits))
+    return HostScheduler(fetcher, slots, max_per_host), fetcher
+
+
+def _submit(scheduler, urls):
+    return {url: scheduler.submit(url, i, len(urls), None) for i, url in enumerate(urls)}
+
+
+def test_slots_bound_downloads_in_flight():
+    scheduler, fetcher = _scheduler(slots=3)
+    futures = _submit(scheduler, [f"http://a.test/{i}.jpg" for i in range(6)])
+    assert len(fetcher.in_flight()) == 3
+
+    # Un download finito libera il posto per il successivo e ne inoltra il risultato
+    fetcher.finish("http://a.test/0.jpg", "contenuto")
+    assert futures["http://a.test/0.jpg"].result(timeout=0) == "contenuto"
+    assert len(fetcher.in_flight()) == 3
+    assert len(fetcher.started) == 4
+
+
+def test_hosts_share_the_workers():
+    # Le righe di a.test vengono prima nel CSV, ma b.test non aspetta che finiscano
+    scheduler, fetcher = _scheduler(slots=2)
+    _submit(scheduler, [f"http://a.test/{i}.jpg" for i in range(4)] + [f"http://b.test/{i}.jpg" for i in range(4)])
+    while fetcher.in_flight():
+        fetcher.finish(fetcher.in_flight()[0])
+
+    hosts = [urlparse(url).netloc for url, future in fetcher.started]
+    assert sorted(hosts) == ["a.test"] * 4 + ["b.test"] * 4
+    assert hosts.index("b.test") <= 2
+    assert "b.test" in hosts[:4] and "a.test" in hosts[4:]
+
+
+def test_host_concurrency_limit():
+    scheduler, fetcher = _scheduler(slots=4, host_limits={"a.test": {"concurrency": 1}})
+    _submit(scheduler, [f"http://a.test/{i}.jpg" for i in range(3)] + [f"http://b.test/{i}.jpg" for i in range(2)])
+    hosts = sorted(urlparse(url).netloc for url in fetcher.in_flight())
+    assert hosts == ["a.test", "b.test", "b.test"]
+
+
+def test_max_per_host_without_other_hosts_leaves_slots_free():
+    scheduler, fetcher = _scheduler(slots=4, max_per_host=2)
+    _submit(scheduler, [f"http://a.test/{i}.jpg" for i in range(5)])
+    assert len(fetcher.in_flight()) == 2
+
+
+def test_fetcher_error_is_forwarded_and_frees_the_slot():
+    class FailingFetcher(FakeFetcher):
+        def submit(self, url, index, total, handle, headers=None, metrics=None):
+            if url.endswith("bad.jpg"):
+                raise RuntimeError("rifiutato")
+            return super().submit(url, index, total, handle, headers, metrics)
+
+    fetcher = FailingFetcher(HostRateLimiter(rate=1000, burst=1000))
+    scheduler = HostScheduler(fetcher, slots=1)
+    futures = _submit(scheduler, ["http://a.test/bad.jpg", "http://a.test/good.jpg"])
+    with pytest.raises(RuntimeError):
+        futures["http://a.test/bad.jpg"].result(timeout=0)
+    assert fetcher.in_flight() == ["http://a.test/good.jpg"]
+
+
+def test_close_cancels_queued_downloads():
+    scheduler, fetcher = _scheduler(slots=1)
+    futures = _submit(scheduler, [f"http://a.test/{i}.jpg" for i in range(3)])
+    scheduler.close()
+    assert fetcher.closed
+    assert not futures["http://a.test/0.jpg"].cancelled()
+    assert futures["http://a.test/1.jpg"].cancelled() and futures["http://a.test/2.jpg"].cancelled()
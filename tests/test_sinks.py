@@ -0,0 +1,54 @@
+import os
+
+from PIL import Image
+
+from pipeline import sinks
+from pipeline.runner import materialize_image
+from pipeline.sinks import FolderSink, link_or_copy
+
+
+def _save(sink, filename, color):
+    sink.save(Image.new('RGB', (8, 8), color), filename, 'PNG', {})
+
+
+def _color(path):
+    with Image.open(path) as img:
+        return img.convert('RGB').getpixel((0, 0))
+
+
+def test_changed_content_updates_duplicate_target(tmp_path):
+    # Stessa immagine in due cataloghi: il secondo riceve un hardlink del file del primo
+    sink_a, sink_b = FolderSink(tmp_path / 'a'), FolderSink(tmp_path / 'b')
+    catalog_a = {'csv': 'a.csv', 'sink': sink_a, 'results': {}}
+    catalog_b = {'csv': 'b.csv', 'sink': sink_b, 'results': {}}
+    image = {'url': 'http://example.com/x.jpg', 'targets': [(catalog_a, 'prodA', 1), (catalog_b, 'prodB', 1)]}
+
+    _save(sink_a, 'prodA.png', (255, 0, 0))
+    materialize_image(image, 'prodA.png', ())
+    assert os.path.samefile(sink_a.path('prodA.png'), sink_b.path('prodB.png'))
+
+    # Immagine cambiata sul server: la riconversione rinomina un file nuovo al posto del primo
+    _save(sink_a, 'prodA.png', (0, 0, 255))
+    materialize_image(image, 'prodA.png', ())
+    assert _color(sink_b.path('prodB.png')) == (0, 0, 255)
+    assert os.path.samefile(sink_a.path('prodA.png'), sink_b.path('prodB.png'))
+    assert catalog_b['results'] == {'prodB': 'prodB.png'}
+
+
+def test_copy_fallback_is_replaced_only_when_source_changes(tmp_path, monkeypatch):
+    def no_hardlinks(source, dest):
+        raise OSError("hardlink non supportati")
+
+    monkeypatch.setattr(sinks.os, 'link', no_hardlinks)
+    source, dest = tmp_path / 'source.png', tmp_path / 'dest.png'
+    source.write_bytes(b'prima')
+    link_or_copy(source, dest)
+    copied = os.stat(dest).st_ino
+
+    # Copia aggiornata: non viene rifatta
+    link_or_copy(source, dest)
+    assert os.stat(dest).st_ino == copied
+
+    source.write_bytes(b'dopo, diverso')
+    link_or_copy(source, dest)
+    assert dest.read_bytes() == b'dopo, diverso'